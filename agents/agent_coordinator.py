@@ -1,147 +1,545 @@
 # agents/agent_coordinator.py
 
 import os
-from typing import List, Dict, Any
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional
 from mcp.message_protocol import MCPMessage
+from mcp.message_bus import MessageBus
 from agents.ingestion_agent import IngestionAgent
 from agents.retrieval_agent import RetrievalAgent
 from agents.llm_response_agent import LLMResponseAgent
+from agents.ingestion_pipeline import stream_chunks_to_index
+from agents.bulk_ingestion import collect_files, is_archive
+from agents.answer_cache import AnswerCache
+from agents.document_registry import file_content_hash
+from agents.telemetry import MetricFamily, tracer
 
 class AgentCoordinator:
     """
     The AgentCoordinator orchestrates the flow of messages and tasks
     between the IngestionAgent, RetrievalAgent, and LLMResponseAgent.
     It acts as the central hub for the agentic RAG system.
+
+    Agents are reached through an in-process MCP MessageBus: each request is an
+    MCPMessage routed to the receiving agent's handle_message on the agent's
+    own workers, and all messages of one upload or chat query share a trace_id.
+
+    With `shared_index=True` the index in `index_dir` is shared with other
+    worker processes (see RetrievalAgent); the coordinator refreshes it before
+    any decision that depends on what other workers indexed.
+
+    Every upload and chat query is one trace (see agents.telemetry): its steps,
+    including the agents' work on the bus, are timed as spans of that trace_id.
+
+    Bulk uploads (handle_bulk_upload) gather the chunks of many files into
+    batches of about `bulk_batch_chunks` chunks, embedded and indexed together.
     """
-    def __init__(self, documents_dir: str = 'documents'):
+    def __init__(self, documents_dir: str = 'documents', index_dir: Optional[str] = 'vector_store',
+                 cache_dir: Optional[str] = 'embedding_cache', answer_cache: Optional[AnswerCache] = None,
+                 message_bus: Optional[MessageBus] = None, shared_index: bool = False,
+                 embedding_backend: str = 'torch', embedding_params: Optional[Dict[str, Any]] = None,
+                 generation_backend: str = 'torch', generation_params: Optional[Dict[str, Any]] = None,
+                 dedup_threshold: Optional[float] = 0.9, bulk_batch_chunks: int = 4096,
+                 max_extracted_bytes: Optional[int] = None):
         self.ingestion_agent = IngestionAgent()
-        self.retrieval_agent = RetrievalAgent()
-        self.llm_response_agent = LLMResponseAgent()
+        self.retrieval_agent = RetrievalAgent(index_dir=index_dir, cache_dir=cache_dir, shared_index=shared_index,
+                                              embedding_backend=embedding_backend, embedding_params=embedding_params,
+                                              dedup_threshold=dedup_threshold)
+        self.llm_response_agent = LLMResponseAgent(backend=generation_backend, backend_params=generation_params)
+
+        # Retrieval gets the most workers, so concurrent queries can be micro-batched together;
+        # the LLM gets enough to fill a generation batch
+        self.message_bus = message_bus or MessageBus(tracer=tracer)
+        self.message_bus.register("IngestionAgent", self.ingestion_agent.handle_message, concurrency=4)
+        self.message_bus.register("RetrievalAgent", self.retrieval_agent.handle_message, concurrency=16)
+        self.message_bus.register("LLMResponseAgent", self.llm_response_agent.handle_message, concurrency=8)
         self.documents_dir = documents_dir
+        self.bulk_batch_chunks = bulk_batch_chunks
+        self.max_extracted_bytes = max_extracted_bytes # Per bulk upload, for archives
         os.makedirs(self.documents_dir, exist_ok=True) # Ensure documents directory exists
+        # Repeated questions are answered from here without retrieval or generation
+        self.answer_cache = answer_cache or AnswerCache()
+        # Indexed chunks are kept once, in self.retrieval_agent.chunk_store
+
+    def warmup(self) -> Dict[str, float]:
+        """
+        Loads the document parsers and both models and runs each model once, so
+        the first real request does not pay for it. Returns seconds per step.
+        """
+        timings = {}
+        for name, step in (("parsers", self.ingestion_agent.warmup),
+                           ("embedding_model", self.retrieval_agent.warmup),
+                           ("llm", self.llm_response_agent.warmup)):
+            start = time.perf_counter()
+            step()
+            timings[name] = round(time.perf_counter() - start, 3)
+        print(f"Coordinator: Warm-up finished: {timings}")
+        return timings
 
-        # In-memory storage for processed chunks
-        self.all_indexed_chunks: List[Dict[str, Any]] = []
+    def readiness(self) -> Dict[str, Any]:
+        """Reports which components are loaded; the system is ready once both models are."""
+        components = {
+            "embedding_model": self.retrieval_agent.model_loaded,
+            "llm": self.llm_response_agent.model_loaded,
+            "parsers": self.ingestion_agent.loaded_parsers(),
+            "indexed_chunks": len(self.retrieval_agent.chunk_store)
+        }
+        return {"ready": components["embedding_model"] and components["llm"], "components": components}
 
-    def handle_document_upload(self, file_path: str) -> Dict[str, Any]:
+    def metric_families(self) -> List[MetricFamily]:
+        """
+        Point-in-time metrics for /metrics: index size, MessageBus and batcher
+        queue depths, answer/embedding cache hit rates and model load state.
+        Stage latency histograms come from the tracer.
+        """
+        retrieval, llm = self.retrieval_agent, self.llm_response_agent
+        bus = self.message_bus.stats()
+        batchers = {"query": retrieval.query_batcher.stats() if retrieval.query_batcher else {},
+                    "generation": llm.batching_stats()}
+        answer_cache = self.answer_cache.stats()
+        embedding_cache = retrieval.embedding_cache.stats() if retrieval.embedding_cache else {}
+        readiness = self.readiness()["components"]
+        documents = retrieval.documents.documents()
+        chunk_memory = retrieval.chunk_store.memory_usage()
+        dedup = retrieval.dedup_report()
+        return [
+            ("rag_index_vectors", "gauge", "Vectors in the FAISS index, including deleted rows not yet compacted.",
+             [({}, retrieval._num_vectors())]),
+            ("rag_indexed_chunks", "gauge", "Chunks currently searchable.",
+             [({}, sum(doc["num_chunks"] for doc in documents))]),
+            ("rag_indexed_documents", "gauge", "Documents currently indexed.",
+             [({}, len(documents))]),
+            ("rag_chunk_store_bytes", "gauge", "Memory of the chunk store, by part (mapped text is in the page cache).",
+             [({"part": "text_mapped"}, chunk_memory["text_bytes_mapped"]),
+              ({"part": "text_in_memory"}, chunk_memory["text_bytes_in_memory"]),
+              ({"part": "columns"}, chunk_memory["column_bytes"]),
+              ({"part": "dictionaries"}, chunk_memory["dictionary_bytes"])]),
+            ("rag_dedup_chunks_total", "counter", "Chunks checked for near-duplicates before embedding.",
+             [({}, dedup["chunks_checked"])]),
+            ("rag_dedup_duplicates_total", "counter", "Near-duplicate chunks linked to an indexed chunk instead of embedded.",
+             [({}, dedup["duplicates"])]),
+            ("rag_dedup_embedding_seconds_saved_total", "counter", "Estimated embedding time saved by skipping near-duplicates.",
+             [({}, dedup["embedding_seconds_saved"])]),
+            ("rag_dedup_index_bytes_saved_total", "counter", "Vector and id bytes not added to the index for near-duplicates.",
+             [({}, dedup["index_bytes_saved"])]),
+            ("rag_index_version", "gauge", "Index version; changes on every write.", [({}, retrieval.index_version)]),
+            ("rag_bus_queue_depth", "gauge", "Messages waiting for each agent on the MessageBus.",
+             [({"receiver": name}, entry["queue_depth"]) for name, entry in bus.items()]),
+            ("rag_bus_messages_total", "counter", "Messages handled by each agent.",
+             [({"receiver": name}, entry["processed"]) for name, entry in bus.items()]),
+            ("rag_bus_errors_total", "counter", "Messages whose handler raised, per agent.",
+             [({"receiver": name}, entry["errors"]) for name, entry in bus.items()]),
+            ("rag_batcher_queue_depth", "gauge", "Requests waiting for the query or generation batcher.",
+             [({"batcher": name}, stats["queue_depth"]) for name, stats in batchers.items() if stats]),
+            ("rag_batcher_mean_batch_size", "gauge", "Mean batch size of the query or generation batcher.",
+             [({"batcher": name}, stats["mean_batch_size"]) for name, stats in batchers.items() if stats]),
+            ("rag_batcher_mean_occupancy", "gauge", "Mean batch size as a fraction of the batcher's maximum.",
+             [({"batcher": name}, stats["mean_occupancy"]) for name, stats in batchers.items() if stats]),
+            ("rag_batcher_queue_wait_p95_seconds", "gauge", "p95 time requests waited for their batch (last 1000).",
+             [({"batcher": name}, stats["queue_wait_ms_p95"] / 1000) for name, stats in batchers.items() if stats]),
+            ("rag_answer_cache_lookups_total", "counter", "Answer cache lookups by result.",
+             [({"result": "exact_hit"}, answer_cache["exact_hits"]),
+              ({"result": "semantic_hit"}, answer_cache["semantic_hits"]),
+              ({"result": "miss"}, answer_cache["misses"])]),
+            ("rag_answer_cache_hit_ratio", "gauge", "Fraction of answer cache lookups that hit.",
+             [({}, answer_cache["hit_rate"])]),
+            ("rag_embedding_cache_hit_ratio", "gauge", "Fraction of embedding cache lookups that hit.",
+             [({}, embedding_cache["hit_rate"])] if embedding_cache else []),
+            ("rag_embedding_cache_entries", "gauge", "Embeddings in the embedding cache.",
+             [({}, embedding_cache["entries"])] if embedding_cache else []),
+            ("rag_model_loaded", "gauge", "1 once a model is loaded in this process.",
+             [({"model": "embedding"}, int(readiness["embedding_model"])), ({"model": "llm"}, int(readiness["llm"]))]),
+            ("rag_parser_loaded", "gauge", "1 once the parser library of a file type is imported.",
+             [({"extension": extension}, int(loaded)) for extension, loaded in readiness["parsers"].items()])
+        ]
+
+    def handle_document_upload(self, file_path: str,
+                               progress_callback: Optional[Callable[..., None]] = None) -> Dict[str, Any]:
         """
         Handles the document upload process, sending the file to the IngestionAgent
         and then indexing the resulting chunks with the RetrievalAgent.
+        Parsing, embedding and indexing run as a bounded-memory streaming
+        pipeline (see ingestion_pipeline.stream_chunks_to_index).
+        `progress_callback` is passed to both agents to report per-stage progress.
+
+        Documents are identified by file name. Re-uploading an unchanged file is
+        detected from its content hash and skipped without parsing; a changed
+        file replaces the previous version once its new chunks are indexed
+        (unchanged chunks are served from the embedding cache, not re-embedded).
+        The hash is committed only after that, so a document left half-written
+        by a crash is re-ingested on its next upload rather than skipped.
         """
         print(f"Coordinator: Handling document upload for {file_path}")
+        with tracer.trace('upload', file=os.path.basename(file_path)) as trace_id:
+            return self._upload(file_path, progress_callback, trace_id)
+
+    def _upload(self, file_path: str, progress_callback: Optional[Callable[..., None]], trace_id: str) -> Dict[str, Any]:
+        source = os.path.basename(file_path)
+        with tracer.span('hash'):
+            content_hash = file_content_hash(file_path)
+        with tracer.span('refresh'):
+            self.retrieval_agent.refresh() # Another worker may have indexed this file already
+        previous = self.retrieval_agent.documents.get(source)
+        if previous and previous['content_hash'] == content_hash:
+            print(f"Coordinator: '{source}' is unchanged since it was indexed; skipping.")
+            return {"status": "success", "skipped": True,
+                    "message": f"Document '{source}' is unchanged and already indexed. {len(previous['rows'])} chunks."}
 
         # 1. Send to IngestionAgent
-        # MCP Message (simulated): UI -> Coordinator (implicit upload action)
-        # Coordinator -> IngestionAgent
-        ingestion_request_payload = {"file_path": file_path}
-        ingestion_message = MCPMessage(
+        # Coordinator -> IngestionAgent; the response carries a lazy stream of chunks
+        ingestion_response = self.message_bus.request(MCPMessage(
             sender="Coordinator",
             receiver="IngestionAgent",
             type="INGEST_DOCUMENT_REQUEST",
-            payload=ingestion_request_payload
-        )
-        print(f"Coordinator sending: {ingestion_message}")
-        
-        # IngestionAgent processes the document
-        chunks = self.ingestion_agent.process_document(file_path)
-
-        # MCP Message (simulated): IngestionAgent -> Coordinator
-        ingestion_response_payload = {"chunks": chunks, "file_path": file_path}
-        ingestion_response_message = MCPMessage(
-            sender="IngestionAgent",
-            receiver="Coordinator",
-            type="INGEST_DOCUMENT_RESPONSE",
-            payload=ingestion_response_payload
-        )
-        print(f"Coordinator received: {ingestion_response_message}")
-
-        if not chunks:
-            return {"status": "error", "message": f"Failed to process or extract text from {os.path.basename(file_path)}."}
+            payload={"file_path": file_path, "progress_callback": progress_callback},
+            trace_id=trace_id
+        ))
 
-        # 2. Send chunks to RetrievalAgent for indexing
-        # Coordinator -> RetrievalAgent
-        retrieval_indexing_request_payload = {"chunks": chunks}
-        retrieval_indexing_message = MCPMessage(
-            sender="Coordinator",
-            receiver="RetrievalAgent",
-            type="INDEX_CHUNKS_REQUEST",
-            payload=retrieval_indexing_request_payload
-        )
-        print(f"Coordinator sending: {retrieval_indexing_message}")
+        # IngestionAgent streams chunks while the document is parsed; each batch is
+        # embedded and indexed by the RetrievalAgent while the next one is parsed
+        num_indexed = num_duplicates = 0
+        uploaded_at = int(time.time())
+
+        def index_batch(batch: List[Dict[str, Any]]):
+            nonlocal num_indexed, num_duplicates
+            for chunk in batch:
+                chunk['doc_hash'] = content_hash
+                chunk['uploaded_at'] = uploaded_at
+
+            indexed_before = num_indexed
+            batch_progress = None
+            if progress_callback:
+                # index_documents counts from the start of its batch; report document totals
+                def batch_progress(stage=None, **counters):
+                    progress_callback(stage, **{name: indexed_before + count for name, count in counters.items()})
 
-        self.retrieval_agent.index_documents(chunks)
-        self.all_indexed_chunks.extend(chunks) # Keep track of all chunks for potential future use or debugging
+            # 2. Send chunks to RetrievalAgent for indexing
+            # Coordinator -> RetrievalAgent
+            index_response = self.message_bus.request(MCPMessage(
+                sender="Coordinator",
+                receiver="RetrievalAgent",
+                type="INDEX_CHUNKS_REQUEST",
+                payload={"chunks": batch, "progress_callback": batch_progress},
+                trace_id=trace_id
+            ))
+            num_indexed += len(batch)
+            num_duplicates += index_response.payload.get('duplicates', 0)
 
-        # MCP Message (simulated): RetrievalAgent -> Coordinator
-        retrieval_indexing_response_payload = {"status": "indexed", "num_chunks": len(chunks)}
-        retrieval_indexing_response_message = MCPMessage(
-            sender="RetrievalAgent",
-            receiver="Coordinator",
-            type="INDEX_CHUNKS_RESPONSE",
-            payload=retrieval_indexing_response_payload
-        )
-        print(f"Coordinator received: {retrieval_indexing_response_message}")
+        try:
+            with tracer.span('ingest_pipeline'):
+                stream_chunks_to_index(
+                    ingestion_response.payload['chunks'],
+                    index_batch,
+                    batch_size=self.retrieval_agent.index_batch_size,
+                    progress_callback=progress_callback
+                )
+        except Exception:
+            self._discard_new_rows(source, previous)
+            raise
 
-        return {"status": "success", "message": f"Document '{os.path.basename(file_path)}' processed and indexed. {len(chunks)} chunks added."}
+        if not num_indexed:
+            return {"status": "error", "message": f"Failed to process or extract text from {os.path.basename(file_path)}."}
+        if previous:
+            # The new version is searchable; now retire the old one
+            self.retrieval_agent.delete_rows(previous['rows'])
+        # Only now is the new version complete; until then a re-upload re-ingests instead of skipping
+        self.retrieval_agent.commit_document(source, content_hash)
+
+        action = "replaced" if previous else "processed and indexed"
+        duplicates = f" ({num_duplicates} near-duplicates of indexed chunks linked, not re-embedded)" if num_duplicates else ""
+        return {"status": "success", "message": f"Document '{os.path.basename(file_path)}' {action}. "
+                                                f"{num_indexed} chunks added{duplicates}.",
+                "num_chunks": num_indexed, "duplicates": num_duplicates}
 
-    def handle_chat_query(self, query: str) -> Dict[str, Any]:
+    def handle_bulk_upload(self, paths: List[str], progress_callback: Optional[Callable[..., None]] = None,
+                           delete_archives: bool = False) -> Dict[str, Any]:
         """
-        Handles a user chat query, orchestrating retrieval and LLM response generation.
+        Ingests many documents in one pass. `paths` may name documents, zip/tar
+        archives (extracted into documents_dir, and deleted afterwards if
+        `delete_archives`) and directories (read in place). Files are parsed in
+        parallel on the IngestionAgent's process pool; their chunks are merged
+        into large batches that the RetrievalAgent embeds and indexes together.
+
+        Returns a per-file summary ("files": indexed, unchanged, skipped as an
+        unsupported type, or failed, with chunk counts and messages) and the
+        overall throughput. As with single
+        uploads, unchanged files are skipped and changed ones replace the
+        version indexed before. `progress_callback` gets files_total,
+        files_parsed, files_indexed, files_failed and chunks_indexed.
         """
-        print(f"Coordinator: Handling chat query: '{query}'")
+        print(f"Coordinator: Handling bulk upload of {len(paths)} paths")
+        with tracer.trace('bulk_upload', paths=len(paths)) as trace_id:
+            try:
+                return self._bulk_upload(paths, progress_callback, trace_id)
+            finally:
+                if delete_archives:
+                    for path in paths:
+                        if is_archive(path) and os.path.isfile(path):
+                            os.unlink(path)
+
+    def _bulk_upload(self, paths: List[str], progress_callback: Optional[Callable[..., None]],
+                     trace_id: str) -> Dict[str, Any]:
+        start = time.perf_counter()
+        uploaded_at = int(time.time())
+        with tracer.span('collect'):
+            collected = collect_files(paths, self.documents_dir, self.max_extracted_bytes)
+            self.retrieval_agent.refresh()
+            entries: List[Dict[str, Any]] = list(collected.rejected)
+            to_parse, hashes, previous_versions = [], {}, {}
+            num_bytes = 0
+            for source, file_path in collected.files:
+                entry = {"file": source, "status": "pending", "chunks": 0, "message": None}
+                entries.append(entry)
+                try:
+                    hashes[source] = file_content_hash(file_path)
+                    num_bytes += os.path.getsize(file_path)
+                except OSError as e:
+                    entry.update(status="failed", message=str(e))
+                    continue
+                previous = self.retrieval_agent.documents.get(source)
+                if previous and previous['content_hash'] == hashes[source]:
+                    entry.update(status="unchanged", chunks=len(previous['rows']))
+                    continue
+                previous_versions[source] = previous
+                to_parse.append((source, file_path))
+        by_source = {entry["file"]: entry for entry in entries if entry["status"] == "pending"}
+        counters = {"files_total": len(to_parse), "files_parsed": 0, "files_indexed": 0, "files_failed": 0,
+                    "chunks_indexed": 0}
+        num_duplicates = 0
+
+        def report(stage: Optional[str] = None):
+            if progress_callback:
+                progress_callback(stage, **counters)
+
+        def flush(batch_sources: List[str], batch: List[Dict[str, Any]]):
+            """Indexes the chunks of several files at once; if that fails, each of those files fails."""
+            nonlocal num_duplicates
+            try:
+                index_response = self.message_bus.request(MCPMessage(
+                    sender="Coordinator",
+                    receiver="RetrievalAgent",
+                    type="INDEX_CHUNKS_REQUEST",
+                    payload={"chunks": batch, "batch_size": self.bulk_batch_chunks},
+                    trace_id=trace_id
+                ))
+                num_duplicates += index_response.payload.get('duplicates', 0)
+            except Exception as e:
+                print(f"Coordinator: Indexing a batch of {len(batch_sources)} files failed: {e}")
+                for source in batch_sources:
+                    self._discard_new_rows(source, previous_versions[source])
+                    by_source[source].update(status="failed", chunks=0, message=f"Indexing failed: {e}")
+                counters["files_failed"] += len(batch_sources)
+                report()
+                return
+            for source in batch_sources:
+                previous = previous_versions[source]
+                if previous: # The new version is searchable; now retire the old one
+                    self.retrieval_agent.delete_rows(previous['rows'])
+                self.retrieval_agent.commit_document(source, hashes[source])
+                by_source[source].update(status="indexed", message="Replaced." if previous else None)
+            counters["files_indexed"] += len(batch_sources)
+            counters["chunks_indexed"] += len(batch)
+            report('indexing')
 
+        # Parsing continues on the pool while a batch is being embedded
+        report('parsing')
+        parse_response = self.message_bus.request(MCPMessage(
+            sender="Coordinator",
+            receiver="IngestionAgent",
+            type="PARSE_FILES_REQUEST",
+            payload={"files": to_parse},
+            trace_id=trace_id
+        ))
+        batch_sources: List[str] = []
+        batch: List[Dict[str, Any]] = []
+        parse_seconds = 0.0
+        for result in parse_response.payload['results']:
+            source = result['source']
+            counters["files_parsed"] += 1
+            parse_seconds += result['parse_seconds']
+            if result['error']:
+                by_source[source].update(status="failed", message=result['error'])
+                counters["files_failed"] += 1
+                report()
+                continue
+            for chunk in result['chunks']:
+                chunk['doc_hash'] = hashes[source]
+                chunk['uploaded_at'] = uploaded_at
+            by_source[source]["chunks"] = len(result['chunks'])
+            batch_sources.append(source)
+            batch.extend(result['chunks'])
+            if len(batch) >= self.bulk_batch_chunks:
+                flush(batch_sources, batch)
+                batch_sources, batch = [], []
+        if batch:
+            flush(batch_sources, batch)
+        tracer.record_span('parse', parse_seconds, trace_id, files=len(to_parse))
+
+        elapsed = time.perf_counter() - start
+        statuses = [entry["status"] for entry in entries]
+        throughput = {
+            "elapsed_seconds": round(elapsed, 3),
+            "files_per_second": round(len(to_parse) / elapsed, 2) if elapsed > 0 else 0.0,
+            "chunks_per_second": round(counters["chunks_indexed"] / elapsed, 2) if elapsed > 0 else 0.0,
+            "megabytes_per_second": round(num_bytes / elapsed / 1e6, 3) if elapsed > 0 else 0.0,
+            "parse_seconds": round(parse_seconds, 3) # Summed over the worker processes
+        }
+        duplicates = f" ({num_duplicates} near-duplicates linked, not re-embedded)" if num_duplicates else ""
+        message = (f"Bulk upload: {statuses.count('indexed')} files indexed, {statuses.count('unchanged')} unchanged, "
+                   f"{statuses.count('failed')} failed, {statuses.count('skipped')} skipped. "
+                   f"{counters['chunks_indexed']} chunks added{duplicates} in {elapsed:.1f}s "
+                   f"({throughput['files_per_second']} files/s).")
+        print(f"Coordinator: {message}")
+        succeeded = 'indexed' in statuses or 'unchanged' in statuses
+        return {"status": "success" if succeeded else "error", "message": message, "files": entries,
+                "num_chunks": counters["chunks_indexed"], "duplicates": num_duplicates, "throughput": throughput}
+
+    def _discard_new_rows(self, source: str, previous: Optional[Dict[str, Any]]):
+        """Rolls back a failed upload: deletes the rows it indexed, leaving any previous version in place."""
+        current = self.retrieval_agent.documents.get(source)
+        if current is None:
+            return
+        kept = set(previous['rows']) if previous else set()
+        self.retrieval_agent.delete_rows([row for row in current['rows'] if row not in kept])
+
+    def list_documents(self) -> List[Dict[str, Any]]:
+        """Lists indexed documents with their content hash and chunk count."""
+        self.retrieval_agent.refresh()
+        return self.retrieval_agent.documents.documents()
+
+    def delete_document(self, file_name: str) -> Dict[str, Any]:
+        """Removes one document's chunks from the index and its uploaded file."""
+        source = os.path.basename(file_name)
+        deleted = self.retrieval_agent.delete_document(source)
+        file_path = os.path.join(self.documents_dir, source)
+        if os.path.isfile(file_path):
+            os.unlink(file_path)
+        if not deleted:
+            return {"status": "error", "message": f"Document '{source}' is not indexed."}
+        return {"status": "success", "message": f"Document '{source}' deleted. {deleted} chunks removed."}
+
+    def _retrieve_context(self, query: str, trace_id: str,
+                          filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Sends a query (and its metadata filters, if any) to the RetrievalAgent and returns the retrieved chunks."""
         # 1. Send query to RetrievalAgent
         # Coordinator -> RetrievalAgent
-        retrieval_query_request_payload = {"query": query}
-        retrieval_query_message = MCPMessage(
+        retrieval_response = self.message_bus.request(MCPMessage(
             sender="Coordinator",
             receiver="RetrievalAgent",
             type="RETRIEVE_CONTEXT_REQUEST",
-            payload=retrieval_query_request_payload
-        )
-        print(f"Coordinator sending: {retrieval_query_message}")
-
-        retrieved_chunks = self.retrieval_agent.retrieve_relevant_chunks(query)
-
-        # MCP Message (simulated): RetrievalAgent -> Coordinator
-        retrieval_query_response_payload = {"retrieved_context": retrieved_chunks, "query": query}
-        retrieval_query_response_message = MCPMessage(
-            sender="RetrievalAgent",
-            receiver="Coordinator",
-            type="RETRIEVE_CONTEXT_RESPONSE",
-            payload=retrieval_query_response_payload
-        )
-        print(f"Coordinator received: {retrieval_query_response_message}")
+            payload={"query": query, "filters": filters},
+            trace_id=trace_id
+        ))
+        return retrieval_response.payload['retrieved_context']
+
+    def _lookup_cached_answer(self, query: str):
+        """
+        Checks the exact, then the semantic answer cache for the current index version.
+        Returns (cached_response, tier, query_embedding); the embedding is None on an exact hit.
+        """
+        version = self.retrieval_agent.index_version
+        cached = self.answer_cache.get_exact(query, version)
+        if cached is not None:
+            return cached, "exact", None
+        query_embedding = self.retrieval_agent.embed_query(query)
+        cached = self.answer_cache.get_semantic(query_embedding, version)
+        return cached, ("semantic" if cached is not None else None), query_embedding
+
+    def _store_cached_answer(self, query: str, query_embedding, response: Dict[str, Any], version: int):
+        """Caches a grounded answer; errors and 'no documents' replies have no sources and are skipped."""
+        if response.get('source_context'):
+            self.answer_cache.put(query, query_embedding,
+                                  {"answer": response['answer'], "source_context": response['source_context']}, version)
+
+    def handle_chat_query(self, query: str, decoding: Optional[Dict[str, Any]] = None,
+                          filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Handles a user chat query, orchestrating retrieval and LLM response generation.
+        Answers found in the answer cache are returned without either step.
+        `decoding` overrides the LLM's decoding settings for this query; such
+        answers bypass the answer cache, which holds default-settings answers.
+        `filters` restricts retrieval to matching chunks (see
+        metadata_index.normalize_filters); filtered answers bypass the cache too.
+        """
+        print(f"Coordinator: Handling chat query: '{query}'")
+        with tracer.trace('chat') as trace_id:
+            return {**self._chat(query, decoding, filters, trace_id), "trace_id": trace_id}
+
+    def _chat(self, query: str, decoding: Optional[Dict[str, Any]], filters: Optional[Dict[str, Any]],
+              trace_id: str) -> Dict[str, Any]:
+        with tracer.span('refresh'):
+            self.retrieval_agent.refresh(force=False) # Cached answers must not outlive other workers' changes
+        version = self.retrieval_agent.index_version
+        with tracer.span('answer_cache'):
+            cacheable = not decoding and not filters
+            cached, tier, query_embedding = self._lookup_cached_answer(query) if cacheable else (None, None, None)
+        if cached is not None:
+            print(f"Coordinator: Answer cache hit ({tier}) for query: '{query}'")
+            return {**cached, "cache": tier}
+
+        retrieved_chunks = self._retrieve_context(query, trace_id, filters)
 
         # 2. Send query and retrieved context to LLMResponseAgent
         # Coordinator -> LLMResponseAgent
-        llm_request_payload = {"query": query, "retrieved_context": retrieved_chunks}
-        llm_request_message = MCPMessage(
+        llm_response = self.message_bus.request(MCPMessage(
             sender="Coordinator",
             receiver="LLMResponseAgent",
             type="GENERATE_RESPONSE_REQUEST",
-            payload=llm_request_payload
-        )
-        print(f"Coordinator sending: {llm_request_message}")
-
-        llm_response = self.llm_response_agent.generate_response(query, retrieved_chunks)
-
-        # MCP Message (simulated): LLMResponseAgent -> Coordinator
-        llm_response_message_payload = {"answer": llm_response['answer'], "source_context": llm_response['source_context']}
-        llm_response_message = MCPMessage(
-            sender="LLMResponseAgent",
-            receiver="Coordinator",
-            type="GENERATE_RESPONSE_RESPONSE",
-            payload=llm_response_message_payload
-        )
-        print(f"Coordinator received: {llm_response_message}")
+            payload={"query": query, "retrieved_context": retrieved_chunks, "decoding": decoding},
+            trace_id=trace_id
+        )).payload
 
+        if cacheable:
+            self._store_cached_answer(query, query_embedding, llm_response, version)
         return llm_response
 
+    def handle_chat_query_stream(self, query: str, decoding: Optional[Dict[str, Any]] = None,
+                                 filters: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Streaming variant of handle_chat_query: yields token events as the
+        LLMResponseAgent decodes them, then a final 'done' event with the answer,
+        source_context and latency metrics.
+        """
+        print(f"Coordinator: Handling streaming chat query: '{query}'")
+        with tracer.trace('chat_stream') as trace_id:
+            for event in self._chat_stream(query, decoding, filters, trace_id):
+                yield {**event, "trace_id": trace_id} if event["event"] == "done" else event
+
+    def _chat_stream(self, query: str, decoding: Optional[Dict[str, Any]], filters: Optional[Dict[str, Any]],
+                     trace_id: str) -> Iterator[Dict[str, Any]]:
+        with tracer.span('refresh'):
+            self.retrieval_agent.refresh(force=False)
+        version = self.retrieval_agent.index_version
+        with tracer.span('answer_cache'):
+            cacheable = not decoding and not filters
+            cached, tier, query_embedding = self._lookup_cached_answer(query) if cacheable else (None, None, None)
+        if cached is not None:
+            print(f"Coordinator: Answer cache hit ({tier}) for query: '{query}'")
+            yield {"event": "done", **cached, "cache": tier}
+            return
+
+        retrieved_chunks = self._retrieve_context(query, trace_id, filters)
+
+        # Coordinator -> LLMResponseAgent; the response carries a lazy stream of token events
+        llm_response = self.message_bus.request(MCPMessage(
+            sender="Coordinator",
+            receiver="LLMResponseAgent",
+            type="GENERATE_RESPONSE_STREAM_REQUEST",
+            payload={"query": query, "retrieved_context": retrieved_chunks, "decoding": decoding},
+            trace_id=trace_id
+        ))
+
+        for event in llm_response.payload['events']:
+            if event["event"] == "done" and cacheable:
+                self._store_cached_answer(query, query_embedding, event, version)
+            yield event
+
     def clear_all_data(self):
-        """Clears all indexed documents and agent states."""
+        """
+        Clears all indexed documents and agent states.
+        The embedding cache is kept, so re-uploading the same files is cheap.
+        """
         self.retrieval_agent.clear_index()
-        self.all_indexed_chunks = []
         # Optionally, clear uploaded files from the documents directory
         for filename in os.listdir(self.documents_dir):
             file_path = os.path.join(self.documents_dir, filename)
@@ -163,7 +561,7 @@ if __name__ == "__main__":
         f.write("This is a sample report about Q1 performance. Revenue increased by 10% and customer satisfaction improved. " * 10)
         f.write("Key Performance Indicators (KPIs) for this quarter included sales volume, customer retention, and average transaction value. " * 10)
 
-    coordinator = AgentCoordinator(documents_dir="../documents")
+    coordinator = AgentCoordinator(documents_dir="../documents", index_dir=None, cache_dir=None)
 
     # Test document upload and indexing
     upload_result = coordinator.handle_document_upload("../documents/sample_report.txt")
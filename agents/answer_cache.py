@@ -0,0 +1,122 @@
+# agents/answer_cache.py
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+
+def normalize_query(query: str) -> str:
+    """Lower-cases a query, collapses whitespace and drops trailing punctuation."""
+    return re.sub(r"\s+", " ", query).strip().lower().rstrip("?!. ")
+
+
+class AnswerCache:
+    """
+    Two-tier cache of chat answers, so repeated questions skip retrieval and generation.
+
+    - Exact tier: keyed by the normalized query text.
+    - Semantic tier: keyed by the query embedding; a lookup hits when the cosine
+      similarity to a cached query is at least `similarity_threshold`.
+
+    Every entry belongs to an index version (RetrievalAgent.index_version). A
+    lookup or insert with a different version drops the whole cache, so answers
+    never outlive the documents they were generated from. Both tiers evict the
+    least recently used entry beyond `max_entries` and expire entries after
+    `ttl_seconds`.
+    """
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 3600,
+                 similarity_threshold: float = 0.95):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.version: Optional[int] = None
+        self._exact: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._semantic: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._semantic_matrix: Optional[np.ndarray] = None # Stacked embeddings, rebuilt lazily
+        self._semantic_keys: list = []
+        self._lock = threading.Lock()
+        self.counters = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "invalidations": 0}
+
+    def _check_version(self, version: int):
+        if version != self.version:
+            if self._exact or self._semantic:
+                self.counters["invalidations"] += 1
+            self._exact.clear()
+            self._semantic.clear()
+            self._semantic_matrix = None
+            self.version = version
+
+    def _expired(self, entry: Dict[str, Any]) -> bool:
+        return time.time() - entry["created_at"] > self.ttl_seconds
+
+    def get_exact(self, query: str, version: int) -> Optional[Dict[str, Any]]:
+        """Returns the cached response for the same (normalized) query, if any."""
+        key = normalize_query(query)
+        with self._lock:
+            self._check_version(version)
+            entry = self._exact.get(key)
+            if entry is None or self._expired(entry):
+                self._exact.pop(key, None)
+                return None
+            self._exact.move_to_end(key)
+            self.counters["exact_hits"] += 1
+            return entry["response"]
+
+    def get_semantic(self, query_embedding: np.ndarray, version: int) -> Optional[Dict[str, Any]]:
+        """Returns the cached response of the most similar cached query above the threshold."""
+        with self._lock:
+            self._check_version(version)
+            if self._semantic:
+                if self._semantic_matrix is None:
+                    self._semantic_keys = list(self._semantic.keys())
+                    self._semantic_matrix = np.vstack([self._semantic[k]["embedding"] for k in self._semantic_keys])
+                similarities = self._semantic_matrix @ self._unit(query_embedding)
+                best = int(np.argmax(similarities))
+                key = self._semantic_keys[best]
+                entry = self._semantic[key]
+                if similarities[best] >= self.similarity_threshold and not self._expired(entry):
+                    self._semantic.move_to_end(key)
+                    self.counters["semantic_hits"] += 1
+                    return entry["response"]
+            self.counters["misses"] += 1
+            return None
+
+    @staticmethod
+    def _unit(vector: np.ndarray) -> np.ndarray:
+        vector = np.asarray(vector, dtype='float32').ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def put(self, query: str, query_embedding: Optional[np.ndarray], response: Dict[str, Any], version: int):
+        """Caches a response in the exact tier and, if an embedding is given, the semantic tier."""
+        key = normalize_query(query)
+        entry = {"response": response, "created_at": time.time()}
+        with self._lock:
+            self._check_version(version)
+            self._exact[key] = entry
+            self._exact.move_to_end(key)
+            if len(self._exact) > self.max_entries:
+                self._exact.popitem(last=False)
+            if query_embedding is not None:
+                self._semantic[key] = {**entry, "embedding": self._unit(query_embedding)}
+                self._semantic.move_to_end(key)
+                if len(self._semantic) > self.max_entries:
+                    self._semantic.popitem(last=False)
+                self._semantic_matrix = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns hit/miss counters per tier and the current cache sizes."""
+        with self._lock:
+            lookups = self.counters["exact_hits"] + self.counters["semantic_hits"] + self.counters["misses"]
+            hits = self.counters["exact_hits"] + self.counters["semantic_hits"]
+            return {
+                **self.counters,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "exact_entries": len(self._exact),
+                "semantic_entries": len(self._semantic),
+                "index_version": self.version
+            }
@@ -0,0 +1,138 @@
+# agents/bulk_ingestion.py
+
+import os
+import re
+import shutil
+import tarfile
+import zipfile
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from agents.ingestion_agent import DOCUMENT_EXTENSIONS
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz')
+
+_UNSAFE_CHARS = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+def is_archive(path: str) -> bool:
+    return path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def document_name(relative_path: str) -> str:
+    """
+    The document (source) name of a file inside an archive or directory: its
+    relative path flattened into one safe file name, so 'hr/2024/policy.pdf'
+    becomes 'hr_2024_policy.pdf' and same-named files in different folders
+    stay distinct documents.
+    """
+    parts = [part for part in re.split(r"[\\/]+", relative_path) if part not in ('', '.', '..')]
+    return _UNSAFE_CHARS.sub('_', "_".join(parts)).strip('._')
+
+
+class BulkFileCollector:
+    """
+    Turns a bulk upload (archives, directories and plain documents) into the
+    list of documents to ingest, as (source, file_path) pairs.
+
+    Archive members are extracted into `extract_dir` under their flattened
+    names (see document_name), so an archive can never write outside it, and
+    directories are walked in place. Files of other types are skipped, while
+    a second file with the same document name or an unreadable archive fails;
+    both are listed in `rejected` as per-file summary entries. Extraction
+    stops with a ValueError once more than `max_extracted_bytes` would be
+    written, which guards against archive bombs.
+    """
+    def __init__(self, extract_dir: str, max_extracted_bytes: Optional[int] = None):
+        self.extract_dir = extract_dir
+        self.max_extracted_bytes = max_extracted_bytes
+        self.extracted_bytes = 0
+        self.files: List[Tuple[str, str]] = []
+        self.rejected: List[Dict[str, Any]] = []
+        self._sources = set()
+
+    def add(self, path: str):
+        """Adds a document, the supported documents of an archive, or those below a directory."""
+        if os.path.isdir(path):
+            self._add_directory(path)
+        elif is_archive(path):
+            try:
+                self._add_archive(path)
+            except (zipfile.BadZipFile, tarfile.TarError, EOFError) as e:
+                self.rejected.append({"file": os.path.basename(path), "status": "failed",
+                                      "message": f"Unreadable archive: {e}"})
+        else:
+            self._add_file(os.path.basename(path), path)
+
+    def _accept(self, source: str) -> bool:
+        """Checks a document name before its file is added; records why it is not, if so."""
+        if not source or os.path.splitext(source)[1].lower() not in DOCUMENT_EXTENSIONS:
+            self.rejected.append({"file": source, "status": "skipped", "message": "Unsupported file type."})
+            return False
+        if source in self._sources:
+            self.rejected.append({"file": source, "status": "failed",
+                                 "message": "Another file in this upload has the same document name."})
+            return False
+        self._sources.add(source)
+        return True
+
+    def _add_file(self, source: str, path: str):
+        if self._accept(source):
+            self.files.append((source, path))
+
+    def _add_directory(self, directory: str):
+        for root, dirs, file_names in os.walk(directory):
+            dirs.sort()
+            for file_name in sorted(file_names):
+                path = os.path.join(root, file_name)
+                self._add_file(document_name(os.path.relpath(path, directory)), path)
+
+    def _members(self, archive_path: str) -> Iterator[Tuple[str, int, Any]]:
+        """Yields (name, size, open_member) for every regular file in a zip or tar archive."""
+        if archive_path.lower().endswith('.zip'):
+            with zipfile.ZipFile(archive_path) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir():
+                        yield info.filename, info.file_size, lambda info=info: archive.open(info)
+        else:
+            with tarfile.open(archive_path, 'r:*') as archive:
+                for member in archive:
+                    if member.isfile(): # Links and devices are never extracted
+                        yield member.name, member.size, lambda member=member: archive.extractfile(member)
+
+    def _add_archive(self, archive_path: str):
+        os.makedirs(self.extract_dir, exist_ok=True)
+        for name, size, open_member in self._members(archive_path):
+            source = document_name(name)
+            if not self._accept(source):
+                continue
+            self.extracted_bytes += size
+            if self.max_extracted_bytes is not None and self.extracted_bytes > self.max_extracted_bytes:
+                raise ValueError(f"Archive {os.path.basename(archive_path)} expands to more than "
+                                 f"{self.max_extracted_bytes} bytes.")
+            path = os.path.join(self.extract_dir, source)
+            with open_member() as member, open(path, 'wb') as f:
+                shutil.copyfileobj(member, f)
+            self.files.append((source, path))
+
+
+def collect_files(paths: Iterable[str], extract_dir: str,
+                  max_extracted_bytes: Optional[int] = None) -> BulkFileCollector:
+    """Collects the documents of every path of a bulk upload (see BulkFileCollector)."""
+    collector = BulkFileCollector(extract_dir, max_extracted_bytes)
+    for path in paths:
+        collector.add(path)
+    return collector
+
+
+# Example usage (for testing)
+if __name__ == "__main__":
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        archive_path = os.path.join(tmp, "handbook.zip")
+        with zipfile.ZipFile(archive_path, 'w') as archive:
+            archive.writestr("hr/policy.txt", "Employees may work remotely up to three days per week.")
+            archive.writestr("finance/policy.txt", "Expense reports are due within thirty days.")
+            archive.writestr("images/logo.png", b"\x89PNG")
+        collected = collect_files([archive_path], os.path.join(tmp, "documents"))
+        print(f"Files: {collected.files}")
+        print(f"Rejected: {collected.rejected}")
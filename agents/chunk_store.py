@@ -0,0 +1,378 @@
+# agents/chunk_store.py
+
+import json
+import mmap
+import struct
+from bisect import bisect_right
+from collections.abc import Mapping
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+# Snapshot file: magic, header length, JSON header, then 8-byte aligned sections
+_MAGIC = b"CHNKSTR1"
+_PREFIX = struct.Struct("<8sQ")
+_ALIGN = 8
+
+# Integer fields stored as typed columns; -1 means the chunk has no such field
+NUMERIC_COLUMNS = {"start_word_index": "int64", "end_word_index": "int64", "start_page": "int32", "end_page": "int32",
+                   "duplicate_of": "int64", "start_row": "int64", "end_row": "int64", "uploaded_at": "int64"}
+# String fields with few distinct values, stored as int32 ids into a list of the values
+DICTIONARY_COLUMNS = ("source", "doc_hash")
+
+
+def _padding(size: int) -> int:
+    return -size % _ALIGN
+
+
+class _Column:
+    """A growable typed array. It may start as a read-only (memory-mapped) array, copied on the first write."""
+    def __init__(self, dtype: str, data: Optional[np.ndarray] = None):
+        self.dtype = np.dtype(dtype)
+        self._data = data if data is not None else np.empty(0, dtype=self.dtype)
+        self._size = len(self._data)
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def values(self) -> np.ndarray:
+        return self._data[:self._size]
+
+    def _reserve(self, size: int):
+        if size <= len(self._data) and self._data.flags.writeable:
+            return
+        grown = np.empty(max(size, 2 * self._size, 1024), dtype=self.dtype)
+        grown[:self._size] = self._data[:self._size]
+        self._data = grown # Readers holding the old array still see the same values for existing rows
+
+    def extend(self, values: Iterable[Any]):
+        values = np.asarray(list(values) if not isinstance(values, np.ndarray) else values, dtype=self.dtype)
+        self._reserve(self._size + len(values))
+        self._data[self._size:self._size + len(values)] = values
+        self._size += len(values)
+
+    def __getitem__(self, row: int):
+        return self._data[row]
+
+    def __setitem__(self, row: int, value):
+        self._reserve(self._size)
+        self._data[row] = value
+
+
+class _Dictionary:
+    """Interns strings: each distinct value is stored once and referred to by an int32 id (-1 = None)."""
+    def __init__(self, values: Optional[List[str]] = None):
+        self.values: List[str] = list(values or [])
+        self._ids: Dict[str, int] = {value: i for i, value in enumerate(self.values)}
+
+    def encode(self, value: Optional[str]) -> int:
+        if value is None:
+            return -1
+        value_id = self._ids.get(value)
+        if value_id is None:
+            value_id = self._ids[value] = len(self.values)
+            self.values.append(value)
+        return value_id
+
+    def decode(self, value_id: int) -> Optional[str]:
+        return self.values[value_id] if value_id >= 0 else None
+
+
+class ChunkView(Mapping):
+    """
+    Read-only view of one stored chunk; behaves like the chunk dict it was built
+    from. Fields are read from the store's columns when accessed, so a lookup
+    copies nothing; dict(view) materializes a real dict.
+    """
+    __slots__ = ('_store', 'row')
+
+    def __init__(self, store: 'ChunkStore', row: int):
+        self._store = store
+        self.row = row
+
+    def __getitem__(self, key: str) -> Any:
+        value = self._store.field(self.row, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._store.keys(self.row))
+
+    def __len__(self) -> int:
+        return len(self._store.keys(self.row))
+
+    @property
+    def content_bytes(self) -> memoryview:
+        """The chunk's UTF-8 text as a zero-copy view of the store's buffer."""
+        return self._store.content_bytes(self.row)
+
+    def __repr__(self):
+        return f"ChunkView(row={self.row}, {dict(self)!r})"
+
+
+class ChunkStore:
+    """
+    Columnar storage of the indexed chunks, addressed by row id (= FAISS id).
+
+    Instead of one dict per chunk, the text of all chunks is kept as UTF-8
+    bytes with an offset array (row i is bytes offsets[i]:offsets[i+1]),
+    sources and document hashes are dictionary-encoded, and word/page ranges
+    are typed integer columns. Deleted rows keep their row id and are flagged.
+    Other chunk keys, if any, are kept in a sparse per-row dict.
+
+    Text is held in immutable segments: a snapshot file, memory-mapped by
+    open(), plus one bytes object per extend() call, so readers can hold
+    zero-copy views while rows are appended. store[row] returns a ChunkView
+    (or None for a deleted row); nothing is decoded until a field is read.
+    """
+    def __init__(self):
+        self._segments: List[Tuple[int, Any]] = [] # (global start offset, buffer)
+        self._segment_starts: List[int] = []
+        self._offsets = _Column('int64', np.zeros(1, dtype='int64'))
+        self._columns = {name: _Column(dtype) for name, dtype in NUMERIC_COLUMNS.items()}
+        self._dictionaries = {name: _Dictionary() for name in DICTIONARY_COLUMNS}
+        self._ids = {name: _Column('int32') for name in DICTIONARY_COLUMNS}
+        self._deleted = _Column('uint8')
+        self.num_deleted = 0
+        self._extras: Dict[int, Dict[str, Any]] = {}
+        self._mmap: Optional[mmap.mmap] = None
+
+    # --- Building ---
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[Optional[Dict[str, Any]]]) -> 'ChunkStore':
+        """Builds a store from chunk dicts (None for deleted rows)."""
+        store = cls()
+        store.extend(chunks)
+        return store
+
+    def extend(self, chunks: Iterable[Optional[Dict[str, Any]]]):
+        """Appends chunks as consecutive rows. A None chunk is stored as a deleted row."""
+        chunks = list(chunks)
+        if not chunks:
+            return
+        encoded = [(chunk['content'] if chunk is not None else "").encode('utf-8') for chunk in chunks]
+        lengths = np.fromiter((len(text) for text in encoded), dtype='int64', count=len(encoded))
+        start = int(self._offsets[len(self._offsets) - 1])
+        start_row = len(self)
+        self._segments.append((start, b"".join(encoded)))
+        self._segment_starts.append(start)
+
+        for name, column in self._columns.items():
+            column.extend(-1 if chunk is None or chunk.get(name) is None else chunk[name] for chunk in chunks)
+        for name in DICTIONARY_COLUMNS:
+            dictionary = self._dictionaries[name]
+            self._ids[name].extend(dictionary.encode(chunk.get(name) if chunk is not None else None) for chunk in chunks)
+        self._deleted.extend(1 if chunk is None else 0 for chunk in chunks)
+        self.num_deleted += sum(1 for chunk in chunks if chunk is None)
+        for i, chunk in enumerate(chunks):
+            extra = {key: value for key, value in (chunk or {}).items()
+                     if key != 'content' and key not in NUMERIC_COLUMNS and key not in DICTIONARY_COLUMNS}
+            if extra:
+                self._extras[start_row + i] = extra
+        # Offsets last: a row becomes visible to len() only once all its columns are written
+        self._offsets.extend(start + np.cumsum(lengths))
+
+    def set(self, row: int, key: str, value: Any):
+        """Changes one field of a row (None removes it)."""
+        if key == 'content':
+            raise ValueError("Chunk content cannot be changed in place.")
+        if key in NUMERIC_COLUMNS:
+            self._columns[key][row] = -1 if value is None else value
+        elif key in DICTIONARY_COLUMNS:
+            self._ids[key][row] = self._dictionaries[key].encode(value)
+        elif value is None:
+            self._extras.get(row, {}).pop(key, None)
+        else:
+            self._extras.setdefault(row, {})[key] = value
+
+    def delete(self, row: int) -> bool:
+        """Flags a row as deleted; returns False if it already was."""
+        if self._deleted[row]:
+            return False
+        self._deleted[row] = 1
+        self.num_deleted += 1
+        self._extras.pop(row, None)
+        return True
+
+    # --- Reading ---
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, row: int) -> Optional[ChunkView]:
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(f"Chunk row {row} out of range")
+        return None if self._deleted[row] else ChunkView(self, row)
+
+    def __iter__(self) -> Iterator[Optional[ChunkView]]:
+        for row in range(len(self)):
+            yield self[row]
+
+    def is_deleted(self, row: int) -> bool:
+        return bool(self._deleted[row])
+
+    def column(self, key: str) -> np.ndarray:
+        """A numeric column, or the 'deleted' flags, over all rows as a read-only view (-1 = field absent)."""
+        column = self._deleted if key == 'deleted' else self._columns[key]
+        values = column.values[:len(self)].view()
+        values.flags.writeable = False
+        return values
+
+    def live_rows(self) -> np.ndarray:
+        """Row ids of the chunks that are not deleted."""
+        return np.flatnonzero(self._deleted.values[:len(self)] == 0)
+
+    def content_bytes(self, row: int) -> memoryview:
+        """A row's UTF-8 text as a zero-copy view of its segment."""
+        start, end = int(self._offsets[row]), int(self._offsets[row + 1])
+        segment = bisect_right(self._segment_starts, start) - 1
+        if start == end:
+            return memoryview(b"")
+        segment_start, buffer = self._segments[segment]
+        return memoryview(buffer)[start - segment_start:end - segment_start]
+
+    def content(self, row: int) -> str:
+        return str(self.content_bytes(row), 'utf-8')
+
+    def field(self, row: int, key: str) -> Any:
+        """One field of a row, or None if the chunk does not have it."""
+        if key == 'content':
+            return self.content(row)
+        if key in NUMERIC_COLUMNS:
+            value = int(self._columns[key][row])
+            return value if value >= 0 else None
+        if key in DICTIONARY_COLUMNS:
+            return self._dictionaries[key].decode(int(self._ids[key][row]))
+        return self._extras.get(row, {}).get(key)
+
+    def keys(self, row: int) -> List[str]:
+        keys = ['content']
+        keys.extend(name for name in DICTIONARY_COLUMNS if self._ids[name][row] >= 0)
+        keys.extend(name for name in NUMERIC_COLUMNS if self._columns[name][row] >= 0)
+        keys.extend(self._extras.get(row, {}))
+        return keys
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Bytes used by the text (mapped and in-memory separately), the columns and the dictionaries."""
+        mapped = sum(len(buffer) for _, buffer in self._segments if not isinstance(buffer, bytes))
+        in_memory = sum(len(buffer) for _, buffer in self._segments if isinstance(buffer, bytes))
+        columns = self._offsets.values.nbytes + self._deleted.values.nbytes
+        columns += sum(column.values.nbytes for column in list(self._columns.values()) + list(self._ids.values()))
+        return {
+            "rows": len(self),
+            "text_bytes_mapped": mapped,
+            "text_bytes_in_memory": in_memory,
+            "column_bytes": columns,
+            "distinct_sources": len(self._dictionaries['source'].values),
+            "dictionary_bytes": sum(len(value.encode('utf-8')) for d in self._dictionaries.values() for value in d.values)
+        }
+
+    # --- Persistence ---
+
+    def write(self, f: BinaryIO):
+        """
+        Writes the store as one file that open() can memory-map. The text of
+        deleted rows is dropped; they are kept as empty, deleted rows.
+        """
+        rows = len(self)
+        offsets = self._offsets.values[:rows + 1]
+        deleted = self._deleted.values[:rows].astype(bool)
+        lengths = np.diff(offsets)
+        lengths[deleted] = 0
+        new_offsets = np.concatenate([[0], np.cumsum(lengths)]).astype('int64')
+
+        arrays = {"offsets": new_offsets, "deleted": self._deleted.values[:rows]}
+        arrays.update({name: column.values[:rows] for name, column in self._columns.items()})
+        arrays.update({f"{name}_id": self._ids[name].values[:rows] for name in DICTIONARY_COLUMNS})
+        sections, position = {"text": [0, int(new_offsets[-1])]}, int(new_offsets[-1]) + _padding(int(new_offsets[-1]))
+        for name, array in arrays.items():
+            sections[name] = [position, str(array.dtype), len(array)]
+            position += array.nbytes + _padding(array.nbytes)
+        header = json.dumps({
+            "rows": rows,
+            "num_deleted": int(deleted.sum()),
+            "sections": sections,
+            "dictionaries": {name: self._dictionaries[name].values for name in DICTIONARY_COLUMNS},
+            "extras": {str(row): extra for row, extra in self._extras.items()}
+        }).encode('utf-8')
+        header += b" " * _padding(_PREFIX.size + len(header))
+        f.write(_PREFIX.pack(_MAGIC, len(header)))
+        f.write(header)
+
+        # Text of consecutive live rows is written in one piece
+        live = np.flatnonzero(~deleted)
+        if len(live):
+            breaks = np.flatnonzero(np.diff(live) != 1) + 1
+            for run in np.split(live, breaks):
+                start, end = int(offsets[run[0]]), int(offsets[run[-1] + 1])
+                while start < end:
+                    segment = bisect_right(self._segment_starts, start) - 1
+                    segment_start, buffer = self._segments[segment]
+                    piece_end = min(end, segment_start + len(buffer))
+                    f.write(memoryview(buffer)[start - segment_start:piece_end - segment_start])
+                    start = piece_end
+        f.write(b"\0" * _padding(int(new_offsets[-1])))
+        for array in arrays.values():
+            f.write(np.ascontiguousarray(array).tobytes())
+            f.write(b"\0" * _padding(array.nbytes))
+
+    @classmethod
+    def open(cls, path: str) -> 'ChunkStore':
+        """
+        Memory-maps a file written by write(). Text and columns are read from
+        the page cache, not copied; columns are copied into memory only when
+        rows are appended or deleted.
+        """
+        store = cls()
+        with open(path, 'rb') as f:
+            store._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_length = _PREFIX.unpack_from(store._mmap, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"{path} is not a chunk store file.")
+        header = json.loads(bytes(store._mmap[_PREFIX.size:_PREFIX.size + header_length]).decode('utf-8'))
+        data_start = _PREFIX.size + header_length
+        sections = header["sections"]
+
+        def array(name: str, dtype: str = 'int64') -> np.ndarray:
+            if name not in sections: # A column added after the file was written
+                return np.full(header["rows"], -1, dtype=dtype)
+            offset, dtype, count = sections[name]
+            return np.frombuffer(store._mmap, dtype=dtype, count=count, offset=data_start + offset)
+
+        text_offset, text_length = sections["text"]
+        if text_length:
+            store._segments.append((0, memoryview(store._mmap)[data_start + text_offset:data_start + text_offset + text_length]))
+            store._segment_starts.append(0)
+        store._offsets = _Column('int64', array("offsets"))
+        store._deleted = _Column('uint8', array("deleted"))
+        store._columns = {name: _Column(dtype, array(name, dtype)) for name, dtype in NUMERIC_COLUMNS.items()}
+        store._ids = {name: _Column('int32', array(f"{name}_id", 'int32')) for name in DICTIONARY_COLUMNS}
+        store._dictionaries = {name: _Dictionary(header["dictionaries"].get(name)) for name in DICTIONARY_COLUMNS}
+        store._extras = {int(row): extra for row, extra in header["extras"].items()}
+        store.num_deleted = header["num_deleted"]
+        return store
+
+
+# Example usage (for testing)
+if __name__ == "__main__":
+    import os
+    import tempfile
+
+    store = ChunkStore.from_chunks([
+        {"content": "The quick brown fox.", "source": "doc1.txt", "start_word_index": 0, "end_word_index": 4},
+        {"content": "Jumps over the lazy dog.", "source": "doc1.txt", "start_word_index": 4, "end_word_index": 9},
+        {"content": "Quarterly revenue grew 12%.", "source": "report.pdf", "start_word_index": 0,
+         "end_word_index": 4, "start_page": 1, "end_page": 1}
+    ])
+    store.delete(1)
+    path = os.path.join(tempfile.mkdtemp(), "chunks.bin")
+    with open(path, 'wb') as f:
+        store.write(f)
+    mapped = ChunkStore.open(path)
+    print([dict(chunk) if chunk is not None else None for chunk in mapped])
+    print(mapped.memory_usage())
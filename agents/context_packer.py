@@ -0,0 +1,95 @@
+# agents/context_packer.py
+
+import re
+from typing import Any, Dict, List, Tuple
+
+
+def _words(chunk: Dict[str, Any]) -> List[str]:
+    return chunk['content'].split()
+
+
+def merge_adjacent_chunks(chunks: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int, int]:
+    """
+    Merges chunks of the same source whose word ranges overlap or touch, so the
+    text shared by overlapping chunks appears once, and drops repeated content.
+    Merged chunks take the position of their best-ranked part.
+    Returns (chunks in rank order, number of merges, number of duplicates dropped).
+    """
+    merged: List[Dict[str, Any]] = []
+    seen_content = set()
+    merges = duplicates = 0
+    for chunk in chunks:
+        key = re.sub(r"\s+", " ", chunk['content']).strip().lower()
+        if key in seen_content:
+            duplicates += 1
+            continue
+        seen_content.add(key)
+
+        start, end = chunk.get('start_word_index'), chunk.get('end_word_index')
+        target = None
+        if start is not None and end is not None:
+            for candidate in merged:
+                if (candidate['source'] == chunk['source'] and 'start_word_index' in candidate
+                        and start <= candidate['end_word_index'] and end >= candidate['start_word_index']):
+                    target = candidate
+                    break
+        if target is None:
+            merged.append(dict(chunk))
+            continue
+
+        # Stitch the word ranges together, keeping each shared word once
+        first, second = (target, chunk) if target['start_word_index'] <= start else (chunk, target)
+        first_words, second_words = _words(first), _words(second)
+        tail = second_words[max(0, first['end_word_index'] - second['start_word_index']):]
+        if second['end_word_index'] <= first['end_word_index']:
+            tail = []
+        target.update({
+            "content": " ".join(first_words + tail),
+            "start_word_index": first['start_word_index'],
+            "end_word_index": max(first['end_word_index'], second['end_word_index'])
+        })
+        if 'start_page' in first:
+            target['start_page'] = first['start_page']
+            target['end_page'] = max(first.get('end_page', 0), second.get('end_page', 0))
+        merges += 1
+    return merged, merges, duplicates
+
+
+def pack_context(chunks: List[Dict[str, Any]], tokenizer, budget_tokens: int) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """
+    Fits the highest-ranked context into `budget_tokens` tokens of `tokenizer`.
+
+    Chunks (in rank order) are first merged with merge_adjacent_chunks, then
+    kept whole while they fit; the first chunk that does not fit is cut at the
+    budget and everything after it is dropped. Token counts include the
+    "Source: ...\\nContent: " header each chunk gets in the prompt.
+    Returns (packed chunks, stats) where stats has the tokens kept and cut and
+    the number of merged and duplicate chunks.
+    """
+    merged, merges, duplicates = merge_adjacent_chunks(chunks)
+    blocks = [f"Source: {c['source']}\nContent: {c['content']}" for c in merged]
+    token_ids = tokenizer(blocks, add_special_tokens=False)['input_ids'] if blocks else []
+
+    packed: List[Dict[str, Any]] = []
+    kept = cut = 0
+    remaining = max(0, budget_tokens)
+    for chunk, ids in zip(merged, token_ids):
+        # Each block is joined to the next by a newline, which costs about one token
+        cost = len(ids) + (1 if packed else 0)
+        if cost <= remaining:
+            packed.append(chunk)
+            kept += cost
+            remaining -= cost
+            continue
+        header_tokens = len(tokenizer(f"Source: {chunk['source']}\nContent: ", add_special_tokens=False)['input_ids'])
+        room = remaining - header_tokens - (1 if packed else 0)
+        if room > 0:
+            content_ids = tokenizer(chunk['content'], add_special_tokens=False)['input_ids'][:room]
+            packed.append({**chunk, "content": tokenizer.decode(content_ids, skip_special_tokens=True),
+                           "truncated": True})
+            kept += remaining
+            cut += cost - remaining
+        else:
+            cut += cost
+        remaining = 0
+    return packed, {"context_tokens": kept, "cut_tokens": cut, "merged_chunks": merges, "duplicate_chunks": duplicates}
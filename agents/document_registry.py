@@ -0,0 +1,105 @@
+# agents/document_registry.py
+
+import hashlib
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional
+
+
+def file_content_hash(file_path: str, block_size: int = 1024 * 1024) -> str:
+    """Returns the sha256 of a file's bytes, read in blocks so large files are not loaded whole."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DocumentRegistry:
+    """
+    Tracks which index rows belong to which source document.
+
+    Every indexed chunk carries its 'source' (file name) and 'doc_hash' (hash
+    of the file it came from). The registry maps each source to the set of row
+    ids of its chunks, so a document can be deleted in O(its chunks), and to
+    its committed content hash, so an unchanged re-upload can be recognised
+    from its hash alone.
+
+    Rows are rebuilt from the chunk metadata on load. A hash only counts once
+    the upload that wrote it has committed (see commit(), which the store logs
+    after the last batch and the removal of the previous version), and only
+    while every row of the source carries it. A crash mid-upload therefore
+    leaves a document without a content hash, and re-uploading it re-ingests
+    it instead of keeping a truncated or doubled version.
+    With `trust_chunk_hashes` set, the chunks' doc_hash is taken as committed,
+    for stores written before commits were logged.
+    """
+    def __init__(self):
+        self._documents: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self.trust_chunk_hashes = False
+
+    def _entry(self, source: str) -> Dict[str, Any]:
+        return self._documents.setdefault(source, {"content_hash": None, "rows": set(), "row_hashes": Counter()})
+
+    def add(self, start_row: int, chunks: Iterable[Optional[Dict[str, Any]]]):
+        """Records chunks stored at consecutive rows from start_row (None entries are skipped)."""
+        with self._lock:
+            for row, chunk in enumerate(chunks, start=start_row):
+                if chunk is None:
+                    continue
+                entry = self._entry(chunk['source'])
+                entry["rows"].add(row)
+                entry["row_hashes"][chunk.get('doc_hash')] += 1
+                if self.trust_chunk_hashes and chunk.get('doc_hash'):
+                    entry["content_hash"] = chunk['doc_hash']
+
+    def commit(self, source: str, content_hash: str):
+        """Marks `content_hash` as the source's complete, committed version."""
+        with self._lock:
+            if source in self._documents:
+                self._documents[source]["content_hash"] = content_hash
+
+    def remove(self, source: str, rows: Iterable[int], doc_hash: Optional[str] = None):
+        """Forgets rows of a source (whose chunks carry `doc_hash`); the source itself is forgotten with its last row."""
+        with self._lock:
+            entry = self._documents.get(source)
+            if entry is None:
+                return
+            before = len(entry["rows"])
+            entry["rows"].difference_update(rows)
+            entry["row_hashes"][doc_hash] -= before - len(entry["rows"])
+            entry["row_hashes"] += Counter() # Drops hashes no row carries any more
+            if not entry["rows"]:
+                del self._documents[source]
+
+    @staticmethod
+    def _content_hash(entry: Dict[str, Any]) -> Optional[str]:
+        """The committed hash, if every row of the source carries it; None while the document is incomplete."""
+        if entry["content_hash"] is None or set(entry["row_hashes"]) != {entry["content_hash"]}:
+            return None
+        return entry["content_hash"]
+
+    def get(self, source: str) -> Optional[Dict[str, Any]]:
+        """Returns {'source', 'content_hash', 'rows'} for a source, or None if it is not indexed."""
+        with self._lock:
+            entry = self._documents.get(source)
+            if entry is None:
+                return None
+            return {"source": source, "content_hash": self._content_hash(entry), "rows": sorted(entry["rows"])}
+
+    def committed(self) -> Dict[str, str]:
+        """Source -> committed content hash, to be persisted with a snapshot."""
+        with self._lock:
+            return {source: entry["content_hash"] for source, entry in self._documents.items()
+                    if entry["content_hash"] is not None}
+
+    def documents(self) -> List[Dict[str, Any]]:
+        """Lists the indexed sources with their content hash and chunk count."""
+        with self._lock:
+            return [{"source": source, "content_hash": self._content_hash(entry), "num_chunks": len(entry["rows"])}
+                    for source, entry in sorted(self._documents.items())]
+
+    def clear(self):
+        with self._lock:
+            self._documents = {}
@@ -0,0 +1,211 @@
+# agents/embedding_backends.py
+
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from agents.shared_models import get_embedding_model, load_module
+
+# 'torch' runs the SentenceTransformer as is (fp32). 'onnx' runs its transformer
+# exported to ONNX with onnxruntime; 'onnx-int8' runs a dynamically quantized
+# (int8 weights) copy of that export, which is usually 2-3x faster on CPU.
+EMBEDDING_BACKENDS = ('torch', 'onnx', 'onnx-int8')
+
+
+def set_torch_threads(intra_op_threads: Optional[int] = None, inter_op_threads: Optional[int] = None):
+    """Sizes torch's CPU thread pools. They are process-wide; inter-op can only be set before first use."""
+    torch = load_module('torch')
+    if intra_op_threads:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError as e:
+            print(f"Could not set torch inter-op threads (torch already started its pool): {e}")
+
+
+def export_onnx(sentence_model, export_dir: str, quantize: bool = False) -> str:
+    """
+    Exports the transformer of a SentenceTransformer to `export_dir`/model.onnx
+    and, with `quantize`, a dynamically quantized model-int8.onnx next to it.
+    Existing exports are reused. Returns the path of the requested model.
+    """
+    os.makedirs(export_dir, exist_ok=True)
+    fp32_path = os.path.join(export_dir, "model.onnx")
+    if not os.path.exists(fp32_path):
+        torch = load_module('torch')
+        transformer = sentence_model[0].auto_model
+        sample = sentence_model.tokenizer(["An example sentence to trace the model with."], return_tensors="pt")
+        input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+        tmp_path = os.path.join(export_dir, "model.tmp.onnx")
+        print(f"Exporting embedding model to ONNX in {export_dir}...")
+        transformer.eval()
+        with torch.no_grad():
+            torch.onnx.export(transformer, tuple(sample[name] for name in input_names), tmp_path,
+                              input_names=input_names, output_names=["last_hidden_state"],
+                              dynamic_axes=dynamic_axes, opset_version=14)
+        os.replace(tmp_path, fp32_path)
+    if not quantize:
+        return fp32_path
+
+    int8_path = os.path.join(export_dir, "model-int8.onnx")
+    if not os.path.exists(int8_path):
+        quantization = load_module('onnxruntime.quantization')
+        tmp_path = os.path.join(export_dir, "model-int8.tmp.onnx")
+        print(f"Quantizing ONNX embedding model to int8 in {export_dir}...")
+        quantization.quantize_dynamic(fp32_path, tmp_path, weight_type=quantization.QuantType.QInt8)
+        os.replace(tmp_path, int8_path)
+    return int8_path
+
+
+class OnnxEmbeddingModel:
+    """
+    Runs a SentenceTransformer's transformer, exported to ONNX, on onnxruntime
+    with the same tokenizer, pooling and normalization as the original.
+    encode() takes the arguments the agents pass to SentenceTransformer.encode.
+
+    `intra_op_threads` sizes the thread pool used inside one operator (matrix
+    multiplies); `inter_op_threads` lets independent operators run in parallel.
+    """
+    def __init__(self, sentence_model, export_dir: str, quantize: bool = False,
+                 intra_op_threads: Optional[int] = None, inter_op_threads: Optional[int] = None):
+        ort = load_module('onnxruntime')
+        self.tokenizer = sentence_model.tokenizer
+        self.max_seq_length = sentence_model.max_seq_length
+        self.dimension = sentence_model.get_sentence_embedding_dimension()
+        pooling = sentence_model[1]
+        if getattr(pooling, 'pooling_mode_mean_tokens', False):
+            self.pooling = 'mean'
+        elif getattr(pooling, 'pooling_mode_cls_token', False):
+            self.pooling = 'cls'
+        else:
+            raise ValueError("The ONNX embedding backend supports mean and CLS pooling only.")
+        self.normalize = any(type(module).__name__ == 'Normalize' for module in sentence_model)
+        self.model_path = export_onnx(sentence_model, export_dir, quantize=quantize)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        if inter_op_threads:
+            options.inter_op_num_threads = inter_op_threads
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        self.session = ort.InferenceSession(self.model_path, options, providers=['CPUExecutionProvider'])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def encode(self, sentences, batch_size: int = 32, convert_to_numpy: bool = True, **kwargs) -> np.ndarray:
+        """Embeds a sentence or a list of sentences; returns float32 array(s) like SentenceTransformer."""
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        embeddings = np.empty((len(texts), self.dimension), dtype='float32')
+        # Batching texts of similar length keeps padding, and so wasted compute, small
+        order = np.argsort([-len(text) for text in texts], kind='stable')
+        for start in range(0, len(texts), batch_size):
+            rows = order[start:start + batch_size]
+            encoded = self.tokenizer([texts[i] for i in rows], padding=True, truncation=True,
+                                     max_length=self.max_seq_length, return_tensors='np')
+            input_ids = encoded['input_ids'].astype('int64')
+            feeds = {name: (encoded[name].astype('int64') if name in encoded else np.zeros_like(input_ids))
+                     for name in self.input_names}
+            hidden = self.session.run(None, feeds)[0]
+            if self.pooling == 'cls':
+                pooled = hidden[:, 0]
+            else:
+                mask = encoded['attention_mask'][..., None].astype('float32')
+                pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if self.normalize:
+                pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            embeddings[rows] = pooled
+        return embeddings[0] if single else embeddings
+
+
+def create_embedding_model(model_name: str, backend: str = 'torch', sentence_model=None,
+                           params: Optional[Dict[str, Any]] = None):
+    """
+    Builds the embedding model for `backend`. `sentence_model` is the already
+    loaded SentenceTransformer, if any (the ONNX backends only use it for the
+    export and the tokenizer). `params` may set intra_op_threads,
+    inter_op_threads and export_dir (default onnx_models/<model name>).
+    """
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}'. Expected one of {EMBEDDING_BACKENDS}.")
+    params = params or {}
+    if backend == 'torch':
+        if params.get('intra_op_threads') or params.get('inter_op_threads'):
+            set_torch_threads(params.get('intra_op_threads'), params.get('inter_op_threads'))
+        return sentence_model or load_module('sentence_transformers').SentenceTransformer(model_name)
+    if sentence_model is None:
+        sentence_model = load_module('sentence_transformers').SentenceTransformer(model_name)
+    export_dir = params.get('export_dir') or os.path.join('onnx_models', model_name.replace('/', '__'))
+    return OnnxEmbeddingModel(sentence_model, export_dir, quantize=(backend == 'onnx-int8'),
+                              intra_op_threads=params.get('intra_op_threads'),
+                              inter_op_threads=params.get('inter_op_threads'))
+
+
+def embedding_parity(reference, candidate, texts: Sequence[str], k: int = 5) -> Dict[str, float]:
+    """
+    Compares a candidate embedding model with the reference (fp32) one on
+    `texts`: cosine similarity of each text's two embeddings, and how many of
+    each text's k nearest neighbours among `texts` both models agree on, which
+    is what retrieval quality depends on.
+    """
+    texts = list(texts)
+    ref = np.asarray(reference.encode(texts, convert_to_numpy=True), dtype='float32')
+    cand = np.asarray(candidate.encode(texts, convert_to_numpy=True), dtype='float32')
+    ref_unit = ref / np.clip(np.linalg.norm(ref, axis=1, keepdims=True), 1e-12, None)
+    cand_unit = cand / np.clip(np.linalg.norm(cand, axis=1, keepdims=True), 1e-12, None)
+    cosines = (ref_unit * cand_unit).sum(axis=1)
+
+    k = min(k, len(texts) - 1)
+    agreement = 1.0
+    if k > 0:
+        ref_sims, cand_sims = ref_unit @ ref_unit.T, cand_unit @ cand_unit.T
+        np.fill_diagonal(ref_sims, -np.inf)
+        np.fill_diagonal(cand_sims, -np.inf)
+        ref_top = np.argsort(-ref_sims, axis=1)[:, :k]
+        cand_top = np.argsort(-cand_sims, axis=1)[:, :k]
+        agreement = float(np.mean([len(set(a) & set(b)) / k for a, b in zip(ref_top, cand_top)]))
+    return {
+        "mean_cosine": float(cosines.mean()) if len(cosines) else 1.0,
+        "min_cosine": float(cosines.min()) if len(cosines) else 1.0,
+        f"neighbor_agreement@{k}": agreement
+    }
+
+
+def benchmark_embedding_backends(texts: Sequence[str], model_name: str = 'all-MiniLM-L6-v2',
+                                 backends: tuple = EMBEDDING_BACKENDS, batch_size: int = 32,
+                                 params: Optional[Dict[str, Any]] = None, k: int = 5) -> List[Dict[str, Any]]:
+    """
+    Reports embedding throughput (texts/second) of each backend on `texts`,
+    with its parity against the fp32 torch model (see embedding_parity).
+    """
+    texts = list(texts)
+    reference = get_embedding_model(model_name, 'torch', params)
+    report = []
+    for backend in backends:
+        model = get_embedding_model(model_name, backend, params)
+        model.encode(texts[:batch_size], batch_size=batch_size, convert_to_numpy=True) # Warm-up
+        start = time.perf_counter()
+        model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+        seconds = time.perf_counter() - start
+        report.append({
+            "backend": backend,
+            "texts": len(texts),
+            "seconds": round(seconds, 3),
+            "texts_per_second": round(len(texts) / seconds, 1) if seconds > 0 else 0.0,
+            **({} if backend == 'torch' else embedding_parity(reference, model, texts, k=k))
+        })
+    return report
+
+
+# Example usage (for testing)
+if __name__ == "__main__":
+    sample_texts = [f"Sample sentence number {i} about quarterly revenue, churn and support tickets." for i in range(512)]
+    for row in benchmark_embedding_backends(sample_texts, params={"intra_op_threads": os.cpu_count()}):
+        print(row)
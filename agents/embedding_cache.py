@@ -0,0 +1,122 @@
+# agents/embedding_cache.py
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# SQLite limits the number of bound parameters per statement
+_SQL_BATCH = 500
+# Other processes sharing the cache file add entries this process does not see;
+# its entry count is re-read from the table every this many put_many calls
+_RECOUNT_EVERY = 100
+
+
+class EmbeddingCache:
+    """
+    A content-addressed, on-disk cache of chunk embeddings.
+
+    Entries are keyed by a SHA-256 of (model name, text), so re-uploading a file,
+    or a new version that only changed a few paragraphs, only sends the changed
+    chunks to the model. The cache is a single SQLite file bounded by
+    `max_entries`; the least recently used entries are evicted first.
+    It lives outside the index directory, so it survives clear_index/clear_all_data.
+    The entry count is tracked as entries are added and evicted, so inserts do
+    not scan the table to check the limit.
+    """
+    def __init__(self, cache_dir: str = 'embedding_cache', model_name: str = '', max_entries: int = 1000000):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_path = os.path.join(cache_dir, 'embeddings.sqlite3')
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.cache_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._entries = self._count()
+        self._puts_since_count = 0
+
+    def _count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _key(self, text: str) -> bytes:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode('utf-8')).digest()
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Returns the cached embedding for each text, or None for a cache miss."""
+        keys = [self._key(text) for text in texts]
+        found: Dict[bytes, np.ndarray] = {}
+        now = time.time()
+        with self._lock:
+            for i in range(0, len(keys), _SQL_BATCH):
+                batch = keys[i:i + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype='float32')
+                if rows:
+                    # Refresh recency so frequently re-used chunks are evicted last
+                    self._conn.execute(
+                        f"UPDATE embeddings SET last_used = ? WHERE key IN ({','.join('?' * len(rows))})",
+                        [now] + [key for key, _ in rows]
+                    )
+            self._conn.commit()
+            hits = sum(1 for key in keys if key in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return [found.get(key) for key in keys]
+
+    def put_many(self, texts: List[str], embeddings: np.ndarray):
+        """Stores embeddings for the given texts and evicts the LRU entries over the size limit."""
+        now = time.time()
+        rows = {self._key(text): np.ascontiguousarray(embedding, dtype='float32').tobytes()
+                for text, embedding in zip(texts, embeddings)}
+        keys = list(rows)
+        with self._lock:
+            existing = 0
+            for i in range(0, len(keys), _SQL_BATCH):
+                batch = keys[i:i + _SQL_BATCH]
+                existing += self._conn.execute(
+                    f"SELECT COUNT(*) FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchone()[0]
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                                   [(key, vector, now) for key, vector in rows.items()])
+            self._entries += len(rows) - existing
+            self._puts_since_count += 1
+            if self._entries > self.max_entries or self._puts_since_count >= _RECOUNT_EVERY:
+                self._entries = self._count()
+                self._puts_since_count = 0
+            excess = self._entries - self.max_entries
+            if excess > 0:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (excess,)
+                )
+                self._entries -= excess
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns hit/miss counters and the current number of cached embeddings."""
+        with self._lock:
+            hits, misses, entries = self.hits, self.misses, self._entries
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+            "entries": entries,
+            "max_entries": self.max_entries
+        }
@@ -0,0 +1,151 @@
+# agents/generation_backends.py
+
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from agents.embedding_backends import set_torch_threads
+from agents.shared_models import get_text_generator, load_module
+
+# 'torch' runs the seq2seq model as is (fp32). 'torch-int8' applies dynamic int8
+# quantization to its Linear layers. 'onnx' runs the encoder and decoder exported
+# to ONNX (through optimum) on onnxruntime, with past key/values fed back so each
+# decoding step only runs the newest token.
+GENERATION_BACKENDS = ('torch', 'torch-int8', 'onnx')
+
+# Decoding settings a request may override (see LLMResponseAgent.decoding)
+DECODING_KEYS = ('max_new_tokens', 'num_beams', 'do_sample', 'temperature', 'top_p', 'early_stopping')
+
+# Greedy decoding with the key/value cache; generation stops at the EOS token,
+# and with beam search as soon as num_beams finished candidates exist
+DEFAULT_DECODING = {"max_new_tokens": 200, "num_beams": 1, "do_sample": False, "early_stopping": True}
+
+# Caps on per-request overrides, so one request cannot hold the generation worker for long
+MAX_NEW_TOKENS_LIMIT = 1024
+MAX_NUM_BEAMS = 8
+
+
+def _check_decoding_value(key: str, value: Any):
+    """Raises ValueError if `value` is not a usable setting for decoding key `key`."""
+    is_int = isinstance(value, int) and not isinstance(value, bool)
+    is_number = (is_int or isinstance(value, float)) and value == value # Rejects NaN
+    if key == 'max_new_tokens' and not (is_int and 1 <= value <= MAX_NEW_TOKENS_LIMIT):
+        raise ValueError(f"max_new_tokens must be an integer from 1 to {MAX_NEW_TOKENS_LIMIT}, got {value!r}")
+    if key == 'num_beams' and not (is_int and 1 <= value <= MAX_NUM_BEAMS):
+        raise ValueError(f"num_beams must be an integer from 1 to {MAX_NUM_BEAMS}, got {value!r}")
+    if key in ('do_sample', 'early_stopping') and not isinstance(value, bool):
+        raise ValueError(f"{key} must be true or false, got {value!r}")
+    if key == 'temperature' and not (is_number and 0 < value <= 100):
+        raise ValueError(f"temperature must be a number above 0 (at most 100), got {value!r}")
+    if key == 'top_p' and not (is_number and 0 < value <= 1):
+        raise ValueError(f"top_p must be a number in (0, 1], got {value!r}")
+
+
+def decoding_kwargs(defaults: Dict[str, Any], overrides: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Merges per-request decoding overrides into the defaults; raises ValueError
+    on unknown settings and on override values of the wrong type or out of range.
+    """
+    overrides = overrides or {}
+    unknown = set(overrides) - set(DECODING_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown decoding settings {sorted(unknown)}. Expected some of {DECODING_KEYS}.")
+    for key, value in overrides.items():
+        _check_decoding_value(key, value)
+    kwargs = {**defaults, **overrides}
+    if not kwargs.get('do_sample'):
+        # Sampling settings only confuse greedy/beam decoding
+        kwargs.pop('temperature', None)
+        kwargs.pop('top_p', None)
+    kwargs['use_cache'] = True
+    return kwargs
+
+
+def create_text_generator(model_name: str, backend: str = 'torch', task: str = "text2text-generation",
+                          params: Optional[Dict[str, Any]] = None):
+    """
+    Builds a Hugging Face pipeline for `model_name` on `backend`. `params` may
+    set intra_op_threads and inter_op_threads, and export_dir for the ONNX
+    export (default onnx_models/<model name>).
+    """
+    if backend not in GENERATION_BACKENDS:
+        raise ValueError(f"Unknown generation backend '{backend}'. Expected one of {GENERATION_BACKENDS}.")
+    params = params or {}
+    transformers = load_module('transformers')
+    intra_op_threads, inter_op_threads = params.get('intra_op_threads'), params.get('inter_op_threads')
+
+    if backend == 'onnx':
+        ort = load_module('onnxruntime')
+        ort_models = load_module('optimum.onnxruntime')
+        export_dir = params.get('export_dir') or os.path.join('onnx_models', model_name.replace('/', '__'))
+        options = ort.SessionOptions()
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        if inter_op_threads:
+            options.inter_op_num_threads = inter_op_threads
+        exported = os.path.exists(os.path.join(export_dir, "config.json"))
+        model = ort_models.ORTModelForSeq2SeqLM.from_pretrained(export_dir if exported else model_name,
+                                                                export=not exported, use_cache=True,
+                                                                session_options=options)
+        if not exported:
+            print(f"Exported {model_name} to ONNX in {export_dir}.")
+            model.save_pretrained(export_dir)
+        tokenizer = transformers.AutoTokenizer.from_pretrained(model_name)
+        return transformers.pipeline(task, model=model, tokenizer=tokenizer)
+
+    if intra_op_threads or inter_op_threads:
+        set_torch_threads(intra_op_threads, inter_op_threads)
+    generator = transformers.pipeline(task, model=model_name)
+    if backend == 'torch-int8':
+        torch = load_module('torch')
+        generator.model = torch.quantization.quantize_dynamic(generator.model, {torch.nn.Linear}, dtype=torch.qint8)
+    return generator
+
+
+def benchmark_generation_backends(prompts: Sequence[str], model_name: str = 'google/flan-t5-small',
+                                  backends: tuple = GENERATION_BACKENDS, params: Optional[Dict[str, Any]] = None,
+                                  decoding: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Reports generated tokens/second and per-prompt latency of each backend
+    on `prompts`, and how often its answer matches the fp32 torch answer.
+    """
+    kwargs = decoding_kwargs(DEFAULT_DECODING, decoding)
+    reference_answers = None
+    report = []
+    for backend in backends:
+        generator = get_text_generator(model_name, backend=backend, params=params)
+        tokenizer, model = generator.tokenizer, generator.model
+        model.generate(**tokenizer(prompts[0], return_tensors="pt"), **kwargs) # Warm-up
+
+        answers, latencies, generated_tokens = [], [], 0
+        for prompt in prompts:
+            inputs = tokenizer(prompt, return_tensors="pt", truncation=True)
+            start = time.perf_counter()
+            output = model.generate(**inputs, **kwargs)
+            latencies.append((time.perf_counter() - start) * 1000)
+            # Every token after the decoder start token is generated, up to and including EOS
+            generated_tokens += int((output[0][1:] != tokenizer.pad_token_id).sum())
+            answers.append(tokenizer.decode(output[0], skip_special_tokens=True))
+        if reference_answers is None:
+            reference_answers = answers
+        seconds = sum(latencies) / 1000
+        report.append({
+            "backend": backend,
+            "prompts": len(prompts),
+            "generated_tokens": generated_tokens,
+            "tokens_per_second": round(generated_tokens / seconds, 1) if seconds > 0 else 0.0,
+            "latency_ms_p50": float(np.percentile(latencies, 50)) if latencies else 0.0,
+            "latency_ms_p95": float(np.percentile(latencies, 95)) if latencies else 0.0,
+            "same_answer_as_first_backend": sum(a == b for a, b in zip(answers, reference_answers)) / len(prompts)
+        })
+    return report
+
+
+# Example usage (for testing)
+if __name__ == "__main__":
+    sample_prompts = [f"Answer the question. Context: Revenue in Q{q} grew by {q * 5}%. Question: How much did revenue grow in Q{q}?"
+                      for q in range(1, 5)] * 4
+    for row in benchmark_generation_backends(sample_prompts, params={"intra_op_threads": os.cpu_count()}):
+        print(row)
@@ -0,0 +1,209 @@
+# agents/index_factory.py
+
+import math
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import faiss
+import numpy as np
+
+# Supported vector index backends:
+#   flat  - exact, exhaustive O(N) scan (IndexFlatL2)
+#   hnsw  - graph-based ANN, no training needed, good recall at low latency
+#   ivf   - inverted file with exact (flat) codes, needs trained centroids
+#   ivfpq - inverted file with product-quantized codes, smallest memory footprint
+INDEX_TYPES = ('flat', 'hnsw', 'ivf', 'ivfpq')
+
+DEFAULT_INDEX_PARAMS: Dict[str, Any] = {
+    "hnsw_m": 32,             # Graph degree for HNSW
+    "hnsw_ef_search": 64,     # Candidate list size at query time (recall vs latency)
+    "ivf_nlist": None,        # Number of IVF centroids; None picks ~4*sqrt(N)
+    "ivf_nprobe": 16,         # IVF lists scanned per query (recall vs latency)
+    "pq_m": None,             # PQ sub-quantizers; None picks the largest divisor of dim <= 48
+    "train_sample_size": 100000,  # Max vectors used to train IVF centroids / PQ codebooks
+}
+
+
+def _ivf_nlist(ntotal: int, params: Dict[str, Any]) -> int:
+    if params.get("ivf_nlist"):
+        return params["ivf_nlist"]
+    # ~4*sqrt(N) lists, but keep at least 39 training points per centroid
+    return max(1, min(int(4 * math.sqrt(ntotal)), ntotal // 39))
+
+
+def _pq_m(dimension: int, params: Dict[str, Any]) -> int:
+    if params.get("pq_m"):
+        return params["pq_m"]
+    return max(m for m in range(1, min(dimension, 48) + 1) if dimension % m == 0)
+
+
+def factory_string(index_type: str, dimension: int, ntotal: int, params: Optional[Dict[str, Any]] = None) -> str:
+    """Returns the faiss.index_factory description for an index type sized for `ntotal` vectors."""
+    params = {**DEFAULT_INDEX_PARAMS, **(params or {})}
+    if index_type == 'flat':
+        return "Flat"
+    if index_type == 'hnsw':
+        return f"HNSW{params['hnsw_m']},Flat"
+    nlist = _ivf_nlist(ntotal, params)
+    if index_type == 'ivf':
+        return f"IVF{nlist},Flat"
+    if index_type == 'ivfpq':
+        # 8-bit codebooks need 256*39 training points; fall back to 4 bits on small corpora
+        nbits = 8 if min(ntotal, params['train_sample_size']) >= 256 * 39 else 4
+        return f"IVF{nlist},PQ{_pq_m(dimension, params)}x{nbits}"
+    raise ValueError(f"Unknown index type '{index_type}'. Expected one of {INDEX_TYPES}.")
+
+
+def unwrap_index(index: faiss.Index) -> faiss.Index:
+    """Returns the index that stores the vectors, looking through an IndexIDMap wrapper."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        index = faiss.downcast_index(index.index)
+    return index
+
+
+def index_ids(index: faiss.Index) -> np.ndarray:
+    """Returns the external ids of an id-mapped index, in storage order."""
+    return faiss.vector_to_array(faiss.downcast_index(index).id_map)
+
+
+def reconstruct_all(index: faiss.Index) -> np.ndarray:
+    """Returns every stored vector (approximately, for PQ codes) in storage order."""
+    inner = unwrap_index(index)
+    ivf = faiss.try_extract_index_ivf(inner)
+    if ivf is not None:
+        ivf.make_direct_map()
+    return inner.reconstruct_n(0, inner.ntotal)
+
+
+def reconstruct_ids(index: faiss.Index, ids: Sequence[int]) -> np.ndarray:
+    """Returns the vectors stored under external ids of an IndexIDMap2; raises RuntimeError for a missing id."""
+    ivf = faiss.try_extract_index_ivf(unwrap_index(index))
+    built_map = ivf is not None and ivf.direct_map.no()
+    if built_map:
+        ivf.make_direct_map()
+    try:
+        index = faiss.downcast_index(index)
+        return np.vstack([index.reconstruct(int(i)) for i in ids])
+    finally:
+        if built_map: # An array direct map would make remove_ids (compaction) fail
+            ivf.make_direct_map(False)
+
+
+def set_search_params(index: faiss.Index, params: Optional[Dict[str, Any]] = None):
+    """Applies query-time knobs (HNSW efSearch, IVF nprobe) to an index."""
+    params = {**DEFAULT_INDEX_PARAMS, **(params or {})}
+    index = unwrap_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = params["hnsw_ef_search"]
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = params["ivf_nprobe"]
+
+
+def search_parameters(index: faiss.Index, params: Optional[Dict[str, Any]] = None,
+                      selector: Optional[faiss.IDSelector] = None) -> faiss.SearchParameters:
+    """
+    Returns per-query search parameters for an index, restricted to the ids
+    accepted by `selector`. Each index family needs its own parameter class,
+    and the class replaces the index's own efSearch/nprobe, so those are set too.
+    The caller must keep `selector` alive for as long as the parameters are used.
+    """
+    params = {**DEFAULT_INDEX_PARAMS, **(params or {})}
+    inner = unwrap_index(index)
+    if isinstance(inner, faiss.IndexHNSW):
+        search_params = faiss.SearchParametersHNSW()
+        search_params.efSearch = params["hnsw_ef_search"]
+    elif faiss.try_extract_index_ivf(inner) is not None:
+        search_params = faiss.SearchParametersIVF()
+        search_params.nprobe = params["ivf_nprobe"]
+    else:
+        search_params = faiss.SearchParameters()
+    search_params.sel = selector
+    return search_params
+
+
+def build_index(index_type: str, vectors: np.ndarray, params: Optional[Dict[str, Any]] = None,
+                ids: Optional[np.ndarray] = None) -> faiss.Index:
+    """
+    Builds an index of the given type over `vectors`, training it first if the
+    type requires it (IVF centroids and PQ codebooks are trained on a random sample).
+    If `ids` are given, the index is wrapped in an IndexIDMap2 and vectors[i] gets id ids[i].
+    """
+    params = {**DEFAULT_INDEX_PARAMS, **(params or {})}
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    ntotal, dimension = vectors.shape
+    index = faiss.index_factory(dimension, factory_string(index_type, dimension, ntotal, params))
+
+    if not index.is_trained:
+        sample_size = min(ntotal, params["train_sample_size"])
+        sample = vectors
+        if sample_size < ntotal:
+            rng = np.random.default_rng(0)
+            sample = vectors[rng.choice(ntotal, sample_size, replace=False)]
+        print(f"Training {index_type} index on {sample_size} of {ntotal} vectors...")
+        index.train(sample)
+
+    if ids is None:
+        index.add(vectors)
+    else:
+        index = faiss.IndexIDMap2(index)
+        index.add_with_ids(vectors, np.ascontiguousarray(ids, dtype='int64'))
+    set_search_params(index, params)
+    return index
+
+
+def promote_index(index: faiss.Index, index_type: str, params: Optional[Dict[str, Any]] = None) -> faiss.Index:
+    """Rebuilds an exact (flat) index as an approximate index of `index_type`, keeping its ids."""
+    start = time.time()
+    ids = index_ids(index) if isinstance(faiss.downcast_index(index), faiss.IndexIDMap2) else None
+    promoted = build_index(index_type, reconstruct_all(index), params, ids=ids)
+    print(f"Promoted FAISS index from flat to {index_type} ({promoted.ntotal} vectors) in {time.time() - start:.2f}s.")
+    return promoted
+
+
+def benchmark_index_types(vectors: np.ndarray, queries: np.ndarray, k: int = 3,
+                          index_types: tuple = INDEX_TYPES,
+                          params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Reports recall@k (against exact flat search) and per-query latency for each
+    index type over the same vectors and queries, to pick settings per corpus.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    queries = np.ascontiguousarray(queries, dtype='float32')
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, ground_truth = exact.search(queries, k)
+
+    report = []
+    for index_type in index_types:
+        build_start = time.time()
+        index = build_index(index_type, vectors, params)
+        build_seconds = time.time() - build_start
+
+        latencies = []
+        hits = 0
+        for i in range(len(queries)):
+            query_start = time.perf_counter()
+            _, found = index.search(queries[i:i + 1], k)
+            latencies.append((time.perf_counter() - query_start) * 1000)
+            hits += len(set(found[0]) & set(ground_truth[i]))
+
+        report.append({
+            "index_type": index_type,
+            "factory": factory_string(index_type, vectors.shape[1], len(vectors), params),
+            f"recall@{k}": hits / (len(queries) * k) if len(queries) else 0.0,
+            "latency_ms_p50": float(np.percentile(latencies, 50)) if latencies else 0.0,
+            "latency_ms_p95": float(np.percentile(latencies, 95)) if latencies else 0.0,
+            "build_seconds": build_seconds,
+        })
+    return report
+
+
+# Example usage (for testing)
+if __name__ == "__main__":
+    rng = np.random.default_rng(42)
+    data = rng.standard_normal((20000, 64)).astype('float32')
+    query_vectors = data[rng.choice(len(data), 200, replace=False)] + 0.01
+    for row in benchmark_index_types(data, query_vectors, k=3):
+        print(row)
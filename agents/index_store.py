@@ -0,0 +1,334 @@
+# agents/index_store.py
+
+import json
+import os
+import struct
+import threading
+import zlib
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from agents.chunk_store import ChunkStore
+
+# FAISS can map flat codes straight from the file (IO_FLAG_MMAP_IFC, faiss >= 1.8).
+# Older builds only know IO_FLAG_MMAP, which maps inverted lists.
+_MMAP_FLAG = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+
+# WAL record header: magic, start row, number of vectors, dimension, metadata length, crc32.
+# Delete records use their own magic, no vectors, and a JSON list of the deleted rows as metadata.
+# Commit records mark a document upload as complete: no vectors, {"source", "content_hash"} as metadata.
+_WAL_MAGIC = b"WAL1"
+_WAL_DELETE_MAGIC = b"DEL1"
+_WAL_COMMIT_MAGIC = b"DOC1"
+_WAL_HEADER = struct.Struct("<4sQIIII")
+
+
+class IndexStore:
+    """
+    Persists the RetrievalAgent's FAISS index and chunk metadata on disk.
+
+    Layout of the store directory:
+      manifest.json          - commit point, names the current version and holds the
+                               committed content hash of each document
+      index-<version>.faiss  - FAISS index snapshot (loaded memory-mapped)
+      chunks-<version>.bin   - chunk text and metadata per row id, a ChunkStore file (loaded memory-mapped)
+      wal-<version>.log      - write-ahead log of batches added and rows deleted since the snapshot
+
+    Each index_documents or delete call appends one CRC-checked record to the
+    WAL, so a write costs O(changed chunks) rather than rewriting the whole index. When the
+    WAL grows past `checkpoint_every` vectors it is folded into a new snapshot.
+    New versions are written to temporary files and published by atomically
+    replacing the manifest, so a crash leaves either the old or the new state.
+
+    With `shared=True` several processes use the same store: every process
+    reads the published snapshot (memory-mapped, so the page cache is shared)
+    and follows the WAL with refresh_manifest() and replay_wal(); writers take
+    writer_lock(), an exclusive file lock, so there is a single writer at a time.
+    """
+    MANIFEST_NAME = "manifest.json"
+    LOCK_NAME = "writer.lock"
+
+    def __init__(self, store_dir: str = 'vector_store', checkpoint_every: int = 50000, shared: bool = False):
+        self.store_dir = store_dir
+        self.checkpoint_every = checkpoint_every
+        self.shared = shared
+        os.makedirs(self.store_dir, exist_ok=True)
+        self.manifest = self._read_manifest()
+        self.wal_vectors = 0 # Vectors logged since the last snapshot
+        self.wal_offset = 0 # Bytes of the current WAL already replayed or written by this process
+        self._writer_thread_lock = threading.Lock()
+
+    # --- File helpers ---
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.store_dir, name)
+
+    def _wal_path(self) -> str:
+        return self._path(f"wal-{self.manifest['version']:06d}.log")
+
+    def _fsync_dir(self):
+        """Makes renames inside the store directory durable (no-op where unsupported)."""
+        try:
+            fd = os.open(self.store_dir, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def _atomic_write(self, name: str, write_fn):
+        """Writes a file through a temporary name, fsyncs it and renames it into place."""
+        final_path = self._path(name)
+        tmp_path = final_path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            write_fn(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, final_path)
+
+    def _atomic_write_index(self, name: str, index: faiss.Index):
+        """Same as _atomic_write, but lets FAISS stream the index to the temporary file."""
+        final_path = self._path(name)
+        tmp_path = final_path + ".tmp"
+        faiss.write_index(index, tmp_path)
+        with open(tmp_path, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, final_path)
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        manifest_path = self._path(self.MANIFEST_NAME)
+        if not os.path.exists(manifest_path):
+            return {"version": 0, "index_file": None, "chunks_file": None, "ntotal": 0, "rows": 0, "deleted": 0,
+                    "documents": {}}
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _publish_manifest(self, manifest: Dict[str, Any]):
+        """Atomically switches the store to a new version and removes stale files."""
+        data = json.dumps(manifest).encode('utf-8')
+        self._atomic_write(self.MANIFEST_NAME, lambda f: f.write(data))
+        self._fsync_dir()
+        self.manifest = manifest
+        self.wal_vectors = 0
+        self.wal_offset = 0
+        self._remove_stale_files()
+
+    def _remove_stale_files(self):
+        """
+        Deletes snapshots, WALs and temp files not referenced by the manifest.
+        Processes that still map a deleted snapshot keep reading it until they refresh.
+        """
+        keep = {self.MANIFEST_NAME, self.manifest.get("index_file"), self.manifest.get("chunks_file"),
+                os.path.basename(self._wal_path())}
+        for filename in os.listdir(self.store_dir):
+            if filename in keep:
+                continue
+            if filename.endswith(".tmp") or filename.split("-", 1)[0] in ("index", "chunks", "wal"):
+                try:
+                    os.unlink(self._path(filename))
+                except OSError as e:
+                    print(f"Error deleting stale index file {filename}: {e}")
+
+    # --- Sharing between processes ---
+
+    @contextmanager
+    def writer_lock(self):
+        """
+        Makes the caller the only writer of the store, across threads and (when
+        shared) processes, until the block exits. Uses flock, so it is released
+        even if the holding process dies.
+        """
+        with self._writer_thread_lock:
+            if not self.shared:
+                yield
+                return
+            import fcntl # POSIX only; shared mode is meant for forking servers such as gunicorn
+            with open(self._path(self.LOCK_NAME), 'a+') as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def refresh_manifest(self) -> bool:
+        """Re-reads the manifest; returns True if another process published a new version."""
+        manifest = self._read_manifest()
+        if manifest.get("version") == self.manifest.get("version"):
+            return False
+        self.manifest = manifest
+        self.wal_vectors = 0
+        self.wal_offset = 0
+        return True
+
+    # --- Loading ---
+
+    def load_index(self) -> Optional[faiss.Index]:
+        """Memory-maps the current snapshot index (None if the store is empty)."""
+        if not self.manifest.get("index_file"):
+            return None
+        index_path = self._path(self.manifest["index_file"])
+        try:
+            return faiss.read_index(index_path, _MMAP_FLAG)
+        except RuntimeError:
+            return faiss.read_index(index_path)
+
+    def load_chunk_store(self) -> ChunkStore:
+        """
+        Opens the snapshot's chunks. Snapshots written before the ChunkStore format
+        (chunks-<version>.jsonl) are read into memory and converted on the next checkpoint.
+        """
+        chunks_path = self._path(self.manifest["chunks_file"])
+        if not chunks_path.endswith(".jsonl"):
+            return ChunkStore.open(chunks_path)
+        with open(chunks_path, 'r', encoding='utf-8') as f:
+            return ChunkStore.from_chunks(json.loads(line) for line in f)
+
+    def committed_documents(self) -> Optional[Dict[str, str]]:
+        """
+        Source -> content hash of the documents committed as of the snapshot, or
+        None for snapshots written before commits were recorded.
+        """
+        return self.manifest.get("documents")
+
+    def load_snapshot(self) -> Tuple[Optional[faiss.Index], ChunkStore]:
+        """
+        Loads the current snapshot. The index and the chunks are memory-mapped, so startup
+        cost does not depend on index size; call load_writable_index() before adding to it.
+        """
+        if not self.shared:
+            # A shared store is only tidied by the writer, which knows the latest version
+            self._remove_stale_files()
+        self.wal_vectors = 0
+        self.wal_offset = 0
+        if not self.manifest.get("index_file"):
+            return None, ChunkStore()
+        return self.load_index(), self.load_chunk_store()
+
+    def load_writable_index(self) -> faiss.Index:
+        """Reads the snapshot index fully into memory so new vectors can be added."""
+        return faiss.read_index(self._path(self.manifest["index_file"]))
+
+    def replay_wal(self, start_row: int, truncate: bool = True) -> Iterator[Tuple[str, Optional[np.ndarray], List[Any]]]:
+        """
+        Yields the operations logged after the snapshot that this process has not
+        seen yet, in order: ("add", embeddings, chunks) for added batches,
+        ("delete", None, rows) for deleted rows and ("commit", None,
+        {"source", "content_hash"}) for completed uploads. A torn or corrupt record at the
+        tail (e.g. from a crash mid-append) is truncated away if `truncate` is set;
+        only the writer may truncate, since readers can see a record mid-append.
+        """
+        wal_path = self._wal_path()
+        if not os.path.exists(wal_path):
+            return
+
+        expected_row = start_row
+        valid_end = self.wal_offset
+        with open(wal_path, 'rb') as f:
+            f.seek(self.wal_offset)
+            while True:
+                header = f.read(_WAL_HEADER.size)
+                if len(header) < _WAL_HEADER.size:
+                    break
+                magic, row, n, dim, meta_len, crc = _WAL_HEADER.unpack(header)
+                payload = f.read(n * dim * 4 + meta_len)
+                if (magic not in (_WAL_MAGIC, _WAL_DELETE_MAGIC, _WAL_COMMIT_MAGIC)
+                        or len(payload) < n * dim * 4 + meta_len or zlib.crc32(payload) != crc):
+                    break
+                if magic == _WAL_COMMIT_MAGIC:
+                    valid_end = self.wal_offset = f.tell()
+                    yield "commit", None, json.loads(payload.decode('utf-8'))
+                    continue
+                if magic == _WAL_DELETE_MAGIC:
+                    valid_end = self.wal_offset = f.tell()
+                    self.wal_vectors += n
+                    yield "delete", None, json.loads(payload.decode('utf-8'))
+                    continue
+                if row != expected_row:
+                    break
+                embeddings = np.frombuffer(payload[:n * dim * 4], dtype='float32').reshape(n, dim)
+                chunks = json.loads(payload[n * dim * 4:].decode('utf-8'))
+                valid_end = self.wal_offset = f.tell()
+                expected_row += len(chunks) # Near-duplicate chunks are logged without a vector
+                self.wal_vectors += n
+                yield "add", embeddings, chunks
+
+        if truncate and valid_end < os.path.getsize(wal_path):
+            print(f"Truncating torn write-ahead log record in {wal_path}.")
+            with open(wal_path, 'r+b') as f:
+                f.truncate(valid_end)
+
+    # --- Writing ---
+
+    def append(self, start_row: int, embeddings: np.ndarray, chunks: List[Dict[str, Any]]):
+        """Durably logs a batch of embeddings and their chunks before they are indexed."""
+        embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+        meta_bytes = json.dumps(chunks).encode('utf-8')
+        payload = embeddings.tobytes() + meta_bytes
+        header = _WAL_HEADER.pack(_WAL_MAGIC, start_row, embeddings.shape[0], embeddings.shape[1],
+                                  len(meta_bytes), zlib.crc32(payload))
+        self._write_wal_record(header + payload)
+        self.wal_vectors += embeddings.shape[0]
+
+    def append_delete(self, rows: List[int]):
+        """Durably logs the deletion of rows before it is applied."""
+        payload = json.dumps([int(row) for row in rows]).encode('utf-8')
+        header = _WAL_HEADER.pack(_WAL_DELETE_MAGIC, 0, len(rows), 0, len(payload), zlib.crc32(payload))
+        self._write_wal_record(header + payload)
+        self.wal_vectors += len(rows)
+
+    def append_commit(self, source: str, content_hash: str):
+        """Durably logs that every chunk of a document upload is indexed and its previous version deleted."""
+        payload = json.dumps({"source": source, "content_hash": content_hash}).encode('utf-8')
+        header = _WAL_HEADER.pack(_WAL_COMMIT_MAGIC, 0, 0, 0, len(payload), zlib.crc32(payload))
+        self._write_wal_record(header + payload)
+
+    def _write_wal_record(self, record: bytes):
+        with open(self._wal_path(), 'ab') as f:
+            f.write(record)
+            f.flush()
+            os.fsync(f.fileno())
+            self.wal_offset = f.tell()
+
+    def should_checkpoint(self) -> bool:
+        return self.wal_vectors >= self.checkpoint_every
+
+    def checkpoint(self, index: faiss.Index, chunk_store: ChunkStore, documents: Optional[Dict[str, str]] = None):
+        """
+        Writes a full snapshot of the index and chunks and starts an empty WAL.
+        `documents` (source -> committed content hash) is kept in the manifest.
+        """
+        version = self.manifest["version"] + 1
+        index_file = f"index-{version:06d}.faiss"
+        chunks_file = f"chunks-{version:06d}.bin"
+
+        self._atomic_write_index(index_file, index)
+        self._atomic_write(chunks_file, chunk_store.write)
+
+        self._publish_manifest({
+            "version": version,
+            "index_file": index_file,
+            "chunks_file": chunks_file,
+            "ntotal": int(index.ntotal),
+            "rows": len(chunk_store),
+            "deleted": chunk_store.num_deleted,
+            "documents": documents or {}
+        })
+        print(f"Checkpointed FAISS index version {version} ({index.ntotal} vectors) to {self.store_dir}.")
+
+    def clear(self):
+        """Publishes an empty version; the old snapshot and WAL are then deleted."""
+        self._publish_manifest({
+            "version": self.manifest["version"] + 1,
+            "index_file": None,
+            "chunks_file": None,
+            "ntotal": 0,
+            "rows": 0,
+            "deleted": 0,
+            "documents": {}
+        })
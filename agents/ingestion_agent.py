@@ -1,41 +1,161 @@
 # agents/ingestion_agent.py
 
 import os
-import PyPDF2
-from pptx import Presentation
-import pandas as pd
-from docx import Document
-import markdown
-from typing import List, Dict, Any
+import sys
+import time
+import logging
+import multiprocessing
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+from agents.shared_models import load_module
+from agents.telemetry import tracer
+from mcp.message_protocol import MCPMessage
+
+logger = logging.getLogger(__name__)
+
+# Parser libraries by file extension. They are slow to import, so each is only
+# imported (through load_module) the first time a file of its type arrives.
+PARSER_MODULES = {'.pdf': 'PyPDF2', '.pptx': 'pptx', '.csv': 'pandas', '.docx': 'docx', '.md': 'markdown'}
+# File types the agent can parse
+DOCUMENT_EXTENSIONS = ('.pdf', '.pptx', '.csv', '.docx', '.txt', '.md')
+
+
+def _extract_pdf_page_range(file_path: str, start_page: int, end_page: int) -> List[str]:
+    """Extracts the text of pages [start_page, end_page). Runs inside a worker process."""
+    with open(file_path, 'rb') as file:
+        reader = load_module('PyPDF2').PdfReader(file)
+        return [(reader.pages[page_num].extract_text() or "") for page_num in range(start_page, end_page)]
+
+
+_worker_agent: Optional['IngestionAgent'] = None
+
+
+def _parse_file(file_path: str, source: str) -> Dict[str, Any]:
+    """Parses a whole document into chunks labelled with `source`. Runs inside a worker process."""
+    global _worker_agent
+    if _worker_agent is None:
+        _worker_agent = IngestionAgent(pdf_workers=1) # Files are already spread over the processes
+    start = time.perf_counter()
+    try:
+        chunks = list(_worker_agent.iter_chunks(file_path))
+    except Exception as e: # Partial chunks of a file that failed midway are never indexed
+        return {"source": source, "chunks": [], "error": f"Error reading {source}: {e}",
+                "parse_seconds": time.perf_counter() - start}
+    for chunk in chunks:
+        chunk['source'] = source
+    return {"source": source, "chunks": chunks, "error": None if chunks else "No text could be extracted.",
+            "parse_seconds": time.perf_counter() - start}
+
 
 class IngestionAgent:
     """
     The IngestionAgent is responsible for parsing diverse document formats
     and preprocessing them into manageable text chunks.
+
+    PDFs with at least `parallel_pdf_min_pages` pages are extracted in parallel:
+    page ranges are spread over a pool of `pdf_workers` processes (None = one
+    per CPU) and the results are joined back in page order. The same pool
+    parses whole files for bulk ingestion (see iter_parsed_files).
+
+    CSV files are streamed `csv_batch_rows` rows at a time and chunked by whole
+    rows, with the column header repeated at the top of every chunk.
     """
-    def __init__(self):
+    def __init__(self, pdf_workers: Optional[int] = None, parallel_pdf_min_pages: int = 32,
+                 csv_batch_rows: int = 10000):
         # Configuration for chunking. These can be tuned.
         self.chunk_size = 500
         self.chunk_overlap = 50
 
-    def _read_pdf(self, file_path: str) -> str:
-        """Reads text from a PDF file."""
-        text = ""
+        self.pdf_workers = pdf_workers or os.cpu_count() or 1
+        self.parallel_pdf_min_pages = parallel_pdf_min_pages
+        self.csv_batch_rows = csv_batch_rows
+        self._process_pool: Optional[ProcessPoolExecutor] = None # Created on first large PDF or bulk upload
+
+    def warmup(self):
+        """Imports every parser library now instead of on the first upload of each file type."""
+        for module_name in PARSER_MODULES.values():
+            load_module(module_name)
+
+    def loaded_parsers(self) -> Dict[str, bool]:
+        """Reports, per file extension, whether its parser library is imported yet."""
+        return {extension: module_name in sys.modules for extension, module_name in PARSER_MODULES.items()}
+
+    def _get_process_pool(self) -> ProcessPoolExecutor:
+        if self._process_pool is None:
+            # 'spawn' avoids forking a process that already runs model and Flask threads
+            self._process_pool = ProcessPoolExecutor(max_workers=self.pdf_workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+        return self._process_pool
+
+    def _iter_pdf_pages(self, file_path: str, parallel: Optional[bool] = None) -> Iterator[str]:
+        """
+        Yields the text of every page of a PDF file, in page order.
+        `parallel` forces the process-pool (True) or single-threaded (False) path;
+        by default large PDFs are extracted in parallel. Only a few page ranges
+        are in flight at once, so memory does not grow with the page count.
+        """
+        with open(file_path, 'rb') as file:
+            reader = load_module('PyPDF2').PdfReader(file)
+            num_pages = len(reader.pages)
+            if parallel is None:
+                parallel = self.pdf_workers > 1 and num_pages >= self.parallel_pdf_min_pages
+            if not parallel:
+                for page in reader.pages:
+                    yield page.extract_text() or ""
+                return
+
+        # Several ranges per worker so uneven pages (scans, figures) balance out
+        shard_size = max(1, -(-num_pages // (self.pdf_workers * 4)))
+        pool = self._get_process_pool()
+        in_flight: Deque[Future] = deque()
+        for start in range(0, num_pages, shard_size):
+            in_flight.append(pool.submit(_extract_pdf_page_range, file_path, start, min(start + shard_size, num_pages)))
+            if len(in_flight) >= self.pdf_workers * 2:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+    def _read_pdf_pages(self, file_path: str, parallel: Optional[bool] = None) -> List[str]:
+        """Reads the text of every page of a PDF file, in page order."""
         try:
-            with open(file_path, 'rb') as file:
-                reader = PyPDF2.PdfReader(file)
-                for page_num in range(len(reader.pages)):
-                    text += reader.pages[page_num].extract_text() + "\n"
+            return list(self._iter_pdf_pages(file_path, parallel))
         except Exception as e:
             print(f"Error reading PDF {file_path}: {e}")
-            return ""
-        return text
+            return []
+
+    def _read_pdf(self, file_path: str) -> str:
+        """Reads text from a PDF file."""
+        return "\n".join(self._read_pdf_pages(file_path))
+
+    def benchmark_pdf_extraction(self, file_path: str) -> Dict[str, Any]:
+        """Measures single-threaded vs. parallel page extraction time for a PDF."""
+        self._read_pdf_pages(file_path, parallel=True) # Warm-up: exclude worker start-up from the timing
+
+        start = time.perf_counter()
+        sequential_pages = self._read_pdf_pages(file_path, parallel=False)
+        sequential_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        parallel_pages = self._read_pdf_pages(file_path, parallel=True)
+        parallel_seconds = time.perf_counter() - start
+
+        return {
+            "file": os.path.basename(file_path),
+            "pages": len(sequential_pages),
+            "workers": self.pdf_workers,
+            "sequential_seconds": round(sequential_seconds, 3),
+            "parallel_seconds": round(parallel_seconds, 3),
+            "speedup": round(sequential_seconds / parallel_seconds, 2) if parallel_seconds > 0 else None,
+            "identical_output": sequential_pages == parallel_pages
+        }
 
     def _read_pptx(self, file_path: str) -> str:
         """Reads text from a PPTX file."""
         text = ""
         try:
-            prs = Presentation(file_path)
+            prs = load_module('pptx').Presentation(file_path)
             for i, slide in enumerate(prs.slides):
                 text += f"--- Slide {i+1} ---\n"
                 for shape in slide.shapes:
@@ -47,21 +167,79 @@ class IngestionAgent:
         return text
 
     def _read_csv(self, file_path: str) -> str:
-        """Reads data from a CSV file and converts it to a string representation."""
+        """
+        Reads a whole CSV file as text: the header, then one 'value | value' line
+        per row. iter_chunks() streams CSV files instead of calling this.
+        """
         try:
-            df = pd.read_csv(file_path)
-            # Convert DataFrame to a string, useful for RAG
-            text = df.to_string(index=False)
+            lines = []
+            for header, rows in self._iter_csv_batches(file_path):
+                if not lines:
+                    lines.append(" | ".join(header))
+                lines.extend(" | ".join(values) for values in rows)
         except Exception as e:
             print(f"Error reading CSV {file_path}: {e}")
             return ""
-        return text
+        return "\n".join(lines)
+
+    def _iter_csv_batches(self, file_path: str) -> Iterator[Tuple[List[str], List[Tuple[str, ...]]]]:
+        """
+        Reads a CSV file `csv_batch_rows` rows at a time with pandas' chunked
+        reader, so memory use does not grow with the file. Yields (header, rows)
+        with every value as a string; missing values are empty strings.
+        """
+        reader = load_module('pandas').read_csv(file_path, chunksize=self.csv_batch_rows, dtype=str,
+                                                keep_default_na=False, encoding_errors='replace')
+        with reader:
+            for batch in reader:
+                yield [str(column) for column in batch.columns], list(batch.itertuples(index=False, name=None))
+
+    def _iter_csv_chunks(self, batches: Iterator[Tuple[List[str], List[Tuple[str, ...]]]], source_file: str,
+                         stats: Dict[str, int],
+                         progress_callback: Optional[Callable[..., None]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Groups CSV rows into chunks of whole rows of up to about chunk_size words,
+        header included; a longer row becomes a chunk of its own. Chunks do not
+        overlap. They record the data rows they hold as start_row/end_row
+        (0-based, end exclusive) rather than word indexes, because the repeated
+        header means their words do not line up with the file's. Rows read so
+        far are counted in stats['rows'].
+        """
+        header_line, header_words = "", 0
+        lines: List[str] = []
+        words = start_row = 0
+        for header, rows in batches:
+            if not header_line:
+                header_line = " | ".join(header)
+                header_words = len(header_line.split())
+            for values in rows:
+                line = " | ".join(values)
+                line_words = len(line.split())
+                if lines and header_words + words + line_words > self.chunk_size:
+                    yield self._make_csv_chunk(header_line, lines, source_file, start_row, stats['rows'])
+                    lines, words, start_row = [], 0, stats['rows']
+                lines.append(line)
+                words += line_words
+                stats['rows'] += 1
+            if progress_callback:
+                progress_callback('parsing', rows_parsed=stats['rows'])
+        if lines:
+            yield self._make_csv_chunk(header_line, lines, source_file, start_row, stats['rows'])
+
+    def _make_csv_chunk(self, header_line: str, lines: List[str], source_file: str,
+                        start_row: int, end_row: int) -> Dict[str, Any]:
+        return {
+            "content": header_line + "\n" + "\n".join(lines),
+            "source": source_file,
+            "start_row": start_row,
+            "end_row": end_row
+        }
 
     def _read_docx(self, file_path: str) -> str:
         """Reads text from a DOCX file."""
         text = ""
         try:
-            doc = Document(file_path)
+            doc = load_module('docx').Document(file_path)
             for para in doc.paragraphs:
                 text += para.text + "\n"
         except Exception as e:
@@ -76,12 +254,56 @@ class IngestionAgent:
                 content = file.read()
                 if file_path.endswith('.md'):
                     # Convert markdown to plain text for consistency
-                    return markdown.markdown(content, strip_html=True)
+                    return load_module('markdown').markdown(content, strip_html=True)
                 return content
         except Exception as e:
             print(f"Error reading TXT/MD {file_path}: {e}")
             return ""
 
+    def _iter_txt_blocks(self, file_path: str, block_size: int = 1 << 20) -> Iterator[str]:
+        """Yields a text file in blocks of about `block_size` characters, cut at whitespace."""
+        carry = ""
+        with open(file_path, 'r', encoding='utf-8') as file:
+            while True:
+                block = file.read(block_size)
+                if not block:
+                    break
+                block = carry + block
+                # Hold back a trailing partial word so it is not split across blocks
+                cut = max(block.rfind(" "), block.rfind("\n"), block.rfind("\t"))
+                if cut == -1:
+                    carry = block
+                    continue
+                carry = block[cut + 1:]
+                yield block[:cut + 1]
+        if carry:
+            yield carry
+
+    def _iter_document_text(self, file_path: str, file_extension: str) -> Iterator[Tuple[str, Optional[int]]]:
+        """
+        Yields a document's text as (piece, page_number) pairs without holding
+        the whole text in memory where the format allows it. Pieces always end
+        at a word boundary; page_number is set for PDFs and None otherwise.
+        """
+        if file_extension == '.pdf':
+            for page_num, page_text in enumerate(self._iter_pdf_pages(file_path), start=1):
+                yield page_text, page_num
+        elif file_extension == '.txt':
+            for block in self._iter_txt_blocks(file_path):
+                yield block, None
+        elif file_extension == '.pptx':
+            for i, slide in enumerate(load_module('pptx').Presentation(file_path).slides):
+                texts = [f"--- Slide {i+1} ---"]
+                texts.extend(shape.text for shape in slide.shapes if hasattr(shape, "text"))
+                yield "\n".join(texts) + "\n", None
+        elif file_extension == '.docx':
+            for para in load_module('docx').Document(file_path).paragraphs:
+                yield para.text + "\n", None
+        else:
+            # Markdown has to be converted as a whole (CSV files are chunked by row, see _iter_csv_chunks)
+            reader = self._get_file_reader(file_extension)
+            yield reader(file_path), None
+
     def _get_file_reader(self, file_extension: str):
         """Returns the appropriate reader function based on file extension."""
         if file_extension == '.pdf':
@@ -97,59 +319,205 @@ class IngestionAgent:
         else:
             return None
 
-    def _split_text_into_chunks(self, text: str, source_file: str) -> List[Dict[str, Any]]:
-        """Splits a long text into smaller, overlapping chunks."""
-        chunks = []
-        if not text:
-            return chunks
+    def _make_chunk(self, words: List[str], source_file: str, start_index: int, end_index: int,
+                    page_word_starts: List[int]) -> Dict[str, Any]:
+        """Builds a chunk dict; PDF chunks also record the 1-based pages they span."""
+        chunk = {
+            "content": " ".join(words),
+            "source": source_file,
+            "start_word_index": start_index,
+            "end_word_index": end_index
+        }
+        if page_word_starts:
+            chunk["start_page"] = bisect_right(page_word_starts, start_index)
+            chunk["end_page"] = bisect_right(page_word_starts, end_index - 1)
+        return chunk
+
+    def _iter_chunks_from_pieces(self, pieces: Iterator[Tuple[str, Optional[int]]],
+                                 source_file: str) -> Iterator[Dict[str, Any]]:
+        """
+        Incrementally splits a stream of text pieces into overlapping chunks.
+        Produces exactly the chunks _split_text_into_chunks would for the joined
+        text, but only keeps the words of the current chunk window in memory.
+        """
+        step = self.chunk_size - self.chunk_overlap
+        buffer: List[str] = []  # Words from word index buffer_base onwards
+        buffer_base = 0
+        start_index = 0         # Word index of the next chunk to emit
+        total_words = 0
+        page_word_starts: List[int] = [] # Word index at which each page begins
+
+        for text, page_num in pieces:
+            if page_num is not None:
+                page_word_starts.append(total_words)
+            words = text.split()
+            buffer.extend(words)
+            total_words += len(words)
 
-        words = text.split()
-        total_words = len(words)
-        start_index = 0
+            # Emit every chunk that is already full
+            while total_words - start_index >= self.chunk_size:
+                offset = start_index - buffer_base
+                yield self._make_chunk(buffer[offset:offset + self.chunk_size], source_file,
+                                       start_index, start_index + self.chunk_size, page_word_starts)
+                start_index += step
+            # Drop words no future chunk can contain
+            del buffer[:start_index - buffer_base]
+            buffer_base = start_index
 
+        # Emit the trailing, shorter chunks
         while start_index < total_words:
             end_index = min(start_index + self.chunk_size, total_words)
-            chunk_words = words[start_index:end_index]
-            chunk_content = " ".join(chunk_words)
-
-            # Add metadata to each chunk
-            chunks.append({
-                "content": chunk_content,
-                "source": source_file,
-                "start_word_index": start_index,
-                "end_word_index": end_index
-            })
-
-            # Move start index for next chunk, considering overlap
-            start_index += (self.chunk_size - self.chunk_overlap)
-            if start_index >= total_words: # Ensure we don't go past the end
-                break
-        return chunks
+            offset = start_index - buffer_base
+            yield self._make_chunk(buffer[offset:offset + end_index - start_index], source_file,
+                                   start_index, end_index, page_word_starts)
+            start_index += step
 
-    def process_document(self, file_path: str) -> List[Dict[str, Any]]:
+    def _split_text_into_chunks(self, text: str, source_file: str) -> List[Dict[str, Any]]:
+        """Splits a long text into smaller, overlapping chunks."""
+        if not text:
+            return []
+        return list(self._iter_chunks_from_pieces(iter([(text, None)]), source_file))
+
+    def iter_chunks(self, file_path: str, progress_callback: Optional[Callable[..., None]] = None,
+                    trace_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
         """
-        Parses a document, extracts text, and splits it into chunks.
-        Returns a list of dictionaries, where each dict represents a chunk
-        with its content and metadata.
+        Parses a document and yields its chunks as soon as they are complete,
+        so callers can embed and index while the rest is still being parsed.
+        `progress_callback`, if given, is called as progress_callback('parsing'),
+        and for CSV files after every batch of rows with rows_parsed.
+        Time spent parsing and chunking (not waiting for the consumer) is
+        recorded as 'parse' and 'chunk' spans of `trace_id`.
+        A parser error is logged and re-raised after the chunks yielded so far,
+        so the caller can discard a partially indexed document.
         """
         file_name = os.path.basename(file_path)
         file_extension = os.path.splitext(file_name)[1].lower()
 
-        reader = self._get_file_reader(file_extension)
-        if not reader:
+        if not self._get_file_reader(file_extension):
             print(f"Unsupported file type: {file_extension}")
-            return []
+            return
 
         print(f"Processing document: {file_name}")
-        full_text = reader(file_path)
-        if not full_text:
-            print(f"Could not extract text from {file_name}")
-            return []
+        if progress_callback:
+            progress_callback('parsing')
+        num_chunks = 0
+        parse_seconds = chunk_seconds = 0.0
+        csv_stats = {"rows": 0}
+
+        def timed(pieces: Iterator):
+            nonlocal parse_seconds
+            while True:
+                start = time.perf_counter()
+                piece = next(pieces, None)
+                parse_seconds += time.perf_counter() - start
+                if piece is None:
+                    return
+                yield piece
 
-        chunks = self._split_text_into_chunks(full_text, file_name)
-        print(f"Extracted {len(chunks)} chunks from {file_name}")
+        if file_extension == '.csv':
+            chunks = self._iter_csv_chunks(timed(self._iter_csv_batches(file_path)), file_name, csv_stats,
+                                           progress_callback)
+        else:
+            chunks = self._iter_chunks_from_pieces(timed(self._iter_document_text(file_path, file_extension)), file_name)
+        try:
+            while True:
+                start = time.perf_counter()
+                chunk = next(chunks, None)
+                chunk_seconds += time.perf_counter() - start # Includes the parsing it triggered
+                if chunk is None:
+                    break
+                num_chunks += 1
+                yield chunk
+        except Exception as e:
+            logger.error(f"Error reading {file_name} after {num_chunks} chunks: {e}")
+            raise
+        finally:
+            rows = {"rows": csv_stats["rows"]} if file_extension == '.csv' else {}
+            tracer.record_span('parse', parse_seconds, trace_id, file=file_name, **rows)
+            tracer.record_span('chunk', max(0.0, chunk_seconds - parse_seconds), trace_id, chunks=num_chunks)
+        if file_extension == '.csv':
+            rows_per_second = csv_stats["rows"] / chunk_seconds if chunk_seconds else 0.0
+            print(f"Extracted {num_chunks} chunks from {file_name} "
+                  f"({csv_stats['rows']} rows, {rows_per_second:,.0f} rows/s)")
+            if progress_callback:
+                progress_callback(rows_parsed=csv_stats["rows"], rows_per_second=round(rows_per_second, 1))
+        else:
+            print(f"Extracted {num_chunks} chunks from {file_name}")
+
+    def process_document(self, file_path: str,
+                         progress_callback: Optional[Callable[..., None]] = None) -> List[Dict[str, Any]]:
+        """
+        Parses a document, extracts text, and splits it into chunks.
+        Returns a list of dictionaries, where each dict represents a chunk
+        with its content and metadata; raises if the document cannot be read.
+        Use iter_chunks() to stream instead.
+        """
+        chunks = list(self.iter_chunks(file_path, progress_callback))
+        if not chunks:
+            print(f"Could not extract text from {os.path.basename(file_path)}")
         return chunks
 
+    def iter_parsed_files(self, files: List[Tuple[str, str]]) -> Iterator[Dict[str, Any]]:
+        """
+        Parses many documents on the process pool, each file whole in one
+        worker, and yields {"source", "chunks", "error", "parse_seconds"} per
+        file as it finishes (not in input order). `files` holds (source,
+        file_path) pairs and the chunks are labelled with the source. Only a
+        few files per worker are in flight, so memory does not grow with the
+        number of files, and parsing continues while the caller indexes.
+        """
+        pool = self._get_process_pool()
+        pending = iter(files)
+        in_flight: Dict[Future, str] = {}
+        unsubmitted: Deque[Dict[str, Any]] = deque()
+
+        def submit_next():
+            source, file_path = next(pending, (None, None))
+            if source is None:
+                return
+            try:
+                in_flight[pool.submit(_parse_file, file_path, source)] = source
+            except Exception as e: # A worker died and broke the pool; a new one is created on next use
+                self._process_pool = None
+                unsubmitted.append({"source": source, "chunks": [], "error": str(e), "parse_seconds": 0.0})
+
+        for _ in range(self.pdf_workers * 4):
+            submit_next()
+        try:
+            while in_flight or unsubmitted:
+                while unsubmitted:
+                    yield unsubmitted.popleft()
+                    submit_next()
+                if not in_flight:
+                    continue
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    source = in_flight.pop(future)
+                    submit_next()
+                    try:
+                        result = future.result()
+                    except Exception as e: # The worker crashed, or the result could not be sent back
+                        result = {"source": source, "chunks": [], "error": str(e), "parse_seconds": 0.0}
+                    yield result
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+    def handle_message(self, message: MCPMessage) -> Dict[str, Any]:
+        """
+        Handles messages from the MCP message bus. INGEST_DOCUMENT_REQUEST answers
+        at once with a lazy chunk stream; the document is parsed as the caller consumes it.
+        PARSE_FILES_REQUEST likewise answers with a lazy stream of parsed files.
+        """
+        if message.type == "INGEST_DOCUMENT_REQUEST":
+            file_path = message.payload['file_path']
+            chunks = self.iter_chunks(file_path, progress_callback=message.payload.get('progress_callback'),
+                                      trace_id=message.trace_id)
+            return {"file_path": file_path, "chunks": chunks}
+        if message.type == "PARSE_FILES_REQUEST":
+            return {"results": self.iter_parsed_files(message.payload['files'])}
+        raise ValueError(f"IngestionAgent cannot handle message type {message.type}.")
+
 # Example usage (for testing)
 if __name__ == "__main__":
     # Create dummy files for testing
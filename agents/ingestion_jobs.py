@@ -0,0 +1,166 @@
+# agents/ingestion_jobs.py
+
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+
+class IngestionJobManager:
+    """
+    Runs document ingestion in a bounded background worker pool.
+
+    submit() returns a job id immediately; the job then moves through the
+    stages queued -> parsing -> embedding -> indexing -> done (or failed),
+    where parsing covers chunking too (chunks are cut as the document is
+    read), and get() returns a snapshot of its progress: chunk counts,
+    elapsed time and throughput. At most `max_workers` documents ingest at once
+    so chat traffic keeps CPU to itself, and at most `max_pending` jobs may wait.
+
+    If `state_dir` is set, every job update is also written there as
+    <job_id>.json, so with several worker processes get() can report a job
+    that another worker is running.
+
+    submit_bulk() runs one job over many files with `bulk_ingest_fn`; its
+    progress counts files, and once it finishes the job also holds the
+    per-file summary ("files") and "throughput" the function returned.
+    """
+    def __init__(self, ingest_fn: Callable[..., Dict[str, Any]], max_workers: int = 2,
+                 max_pending: int = 100, max_finished_jobs: int = 1000, state_dir: Optional[str] = None,
+                 bulk_ingest_fn: Optional[Callable[..., Dict[str, Any]]] = None):
+        self.ingest_fn = ingest_fn # Called as ingest_fn(file_path, progress_callback=...)
+        self.bulk_ingest_fn = bulk_ingest_fn # Called as bulk_ingest_fn(paths, progress_callback=...)
+        self.max_pending = max_pending
+        self.max_finished_jobs = max_finished_jobs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='IngestionWorker')
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.state_dir = state_dir
+        if self.state_dir:
+            os.makedirs(self.state_dir, exist_ok=True)
+
+    def _active_jobs(self) -> int:
+        return sum(1 for job in self._jobs.values() if job['status'] in ('queued', 'running'))
+
+    def submit(self, file_path: str) -> str:
+        """Queues a file for ingestion and returns its job id."""
+        return self._submit(os.path.basename(file_path), self.ingest_fn, file_path, {})
+
+    def submit_bulk(self, paths: List[str], name: str) -> str:
+        """Queues a bulk upload (documents, archives, directories) as one job named `name`."""
+        if self.bulk_ingest_fn is None:
+            raise RuntimeError("Bulk ingestion is not enabled.")
+        counters = {"files_total": 0, "files_parsed": 0, "files_indexed": 0, "files_failed": 0}
+        return self._submit(name, self.bulk_ingest_fn, paths, counters)
+
+    def _submit(self, file_name: str, ingest_fn: Callable[..., Dict[str, Any]], target: Any,
+                counters: Dict[str, int]) -> str:
+        with self._lock:
+            if self._active_jobs() >= self.max_pending:
+                raise RuntimeError(f"Ingestion queue is full ({self.max_pending} jobs pending). Try again later.")
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "file_name": file_name,
+                "status": "queued",
+                "stage": "queued",
+                "chunks_total": 0,
+                "chunks_embedded": 0,
+                "chunks_indexed": 0,
+                **counters,
+                "submitted_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "message": None
+            }
+            self._save(self._jobs[job_id])
+            self._trim_finished_jobs()
+        self._executor.submit(self._run_job, job_id, ingest_fn, target)
+        return job_id
+
+    def _trim_finished_jobs(self):
+        """Forgets the oldest finished jobs beyond max_finished_jobs."""
+        finished = [job_id for job_id, job in self._jobs.items() if job['status'] in ('succeeded', 'failed')]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job_id]
+            if self.state_dir:
+                try:
+                    os.unlink(self._state_path(job_id))
+                except OSError:
+                    pass
+
+    def _state_path(self, job_id: str) -> str:
+        return os.path.join(self.state_dir, f"{job_id}.json")
+
+    def _save(self, job: Dict[str, Any]):
+        """Atomically writes a job's state to state_dir (if set). Caller holds the lock."""
+        if not self.state_dir:
+            return
+        tmp_path = self._state_path(job['job_id']) + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(job, f)
+        os.replace(tmp_path, self._state_path(job['job_id']))
+
+    def _load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Reads a job written by another worker process, or None."""
+        if not self.state_dir or not all(c in '0123456789abcdef' for c in job_id):
+            return None
+        try:
+            with open(self._state_path(job_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _update(self, job_id: str, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+            self._save(self._jobs[job_id])
+
+    def _run_job(self, job_id: str, ingest_fn: Callable[..., Dict[str, Any]], target: Any):
+        self._update(job_id, status='running', stage='parsing', started_at=time.time())
+
+        def progress_callback(stage: Optional[str] = None, **counters):
+            if stage:
+                counters['stage'] = stage
+            self._update(job_id, **counters)
+
+        try:
+            result = ingest_fn(target, progress_callback=progress_callback)
+        except Exception as e:
+            print(f"Ingestion job {job_id} for {target} failed: {e}")
+            self._update(job_id, status='failed', stage='failed', finished_at=time.time(), message=str(e))
+            return
+
+        status = 'succeeded' if result.get('status') == 'success' else 'failed'
+        self._update(job_id, status=status, stage='done' if status == 'succeeded' else 'failed',
+                     finished_at=time.time(), message=result.get('message'),
+                     **{key: result[key] for key in ('files', 'throughput') if key in result})
+
+    def status_counts(self) -> Dict[str, int]:
+        """Counts this process's jobs by status (queued, running, succeeded, failed)."""
+        with self._lock:
+            counts = {status: 0 for status in ('queued', 'running', 'succeeded', 'failed')}
+            for job in self._jobs.values():
+                counts[job['status']] += 1
+            return counts
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Returns a snapshot of a job's progress, or None if the id is unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            job = dict(job) if job is not None else self._load(job_id)
+        if job is None:
+            return None
+
+        if job['started_at']:
+            elapsed = (job['finished_at'] or time.time()) - job['started_at']
+            job['elapsed_seconds'] = round(elapsed, 3)
+            job['chunks_per_second'] = round(job['chunks_indexed'] / elapsed, 2) if elapsed > 0 else 0.0
+        return job
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,76 @@
+# agents/ingestion_pipeline.py
+
+import queue
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+_END_OF_STREAM = object()
+
+
+def stream_chunks_to_index(chunks: Iterator[Dict[str, Any]],
+                           index_batch: Callable[[List[Dict[str, Any]]], None],
+                           batch_size: int = 256, max_pending_batches: int = 2,
+                           progress_callback: Optional[Callable[..., None]] = None) -> int:
+    """
+    Runs a parse -> chunk -> embed -> index pipeline with bounded memory.
+
+    A producer thread pulls chunks from `chunks` (a generator that reads and
+    splits the document lazily), groups them into batches of `batch_size` and
+    puts them on a queue holding at most `max_pending_batches` batches. The
+    calling thread takes batches off the queue and passes them to `index_batch`
+    (embedding + FAISS add), so embedding overlaps with parsing, and parsing
+    blocks whenever indexing falls behind. Peak memory is therefore bounded by
+    roughly (max_pending_batches + 2) * batch_size chunks, whatever the document size.
+
+    Returns the number of chunks indexed. Errors on either side stop both.
+    """
+    batches: "queue.Queue" = queue.Queue(maxsize=max_pending_batches)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        batch: List[Dict[str, Any]] = []
+        produced = 0
+        try:
+            for chunk in chunks:
+                batch.append(chunk)
+                produced += 1
+                if len(batch) >= batch_size:
+                    if progress_callback:
+                        progress_callback(chunks_total=produced)
+                    if not put(batch):
+                        return
+                    batch = []
+            if batch:
+                if progress_callback:
+                    progress_callback(chunks_total=produced)
+                put(batch)
+            put(_END_OF_STREAM)
+        except Exception as e:
+            put(e)
+
+    producer = threading.Thread(target=produce, name='IngestionProducer', daemon=True)
+    producer.start()
+
+    indexed = 0
+    try:
+        while True:
+            item = batches.get()
+            if item is _END_OF_STREAM:
+                break
+            if isinstance(item, Exception):
+                raise item
+            index_batch(item)
+            indexed += len(item)
+    finally:
+        stop.set()
+        producer.join()
+    return indexed
@@ -99,29 +99,19 @@
 
 # agents/llm_response_agent.py
 
-from typing import List, Dict, Any
-from transformers import pipeline # Import the pipeline function
-
-class LLMResponseAgent:
-    """
-    The LLMResponseAgent is responsible for forming the final LLM query
-    using the retrieved context and generating the answer.
-    """
-    def __init__(self):
-        # Initialize the Hugging Face pipeline for text generation
-        # Using "google/flan-t5-small" model
-        print("Initializing Hugging Face LLM pipeline (google/flan-t5-small)... This may take a moment.")
-        self.text_generator = pipeline("text2text-generation", model="google/flan-t5-small")
-        print("Hugging Face LLM pipeline initialized.")
-
-    def _format_prompt(self, query: str, retrieved_context: List[Dict[str, Any]]) -> str:
-        """
-        Formats the prompt for the LLM, including the user's query
-        and the retrieved context.
-        """
-        context_str = "\n".join([f"Source: {c['source']}\nContent: {c['content']}" for c in retrieved_context])
-
-        prompt = f"""
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple, Union
+import numpy as np
+from agents.context_packer import pack_context
+from agents.generation_backends import DEFAULT_DECODING, GENERATION_BACKENDS, decoding_kwargs
+from agents.micro_batcher import MicroBatcher
+from agents.shared_models import generator_kind, get_text_generator, is_loaded, load_module
+from agents.telemetry import tracer
+from mcp.message_protocol import MCPMessage
+
+PROMPT_TEMPLATE = """
 You are a helpful AI assistant. Use the following retrieved information to answer the user's question.
 If the answer cannot be found in the provided information, respond with "I don't have enough information to answer that."
 
@@ -134,37 +124,166 @@ User Query: {query}
 
 Answer:
 """
-        return prompt
 
-    def generate_response(self, query: str, retrieved_context: List[Dict[str, Any]]) -> Dict[str, Any]:
+class LLMResponseAgent:
+    """
+    The LLMResponseAgent is responsible for forming the final LLM query
+    using the retrieved context and generating the answer.
+
+    Retrieved context is packed into the model's input window before the
+    prompt is built (see context_packer.pack_context): overlapping chunks of
+    the same document are merged, duplicates dropped, and the lowest-ranked
+    text is cut so the prompt fits `max_input_tokens` (defaults to the
+    tokenizer's model_max_length, 512 for flan-t5-small).
+
+    The model is loaded on the first request or by warmup(), not at construction.
+    `backend` picks how it runs (see generation_backends): 'torch' (fp32),
+    'torch-int8' (dynamically quantized) or 'onnx' (onnxruntime);
+    `backend_params` may set intra_op_threads and inter_op_threads.
+
+    `decoding` holds the default decoding settings (greedy, max_new_tokens=200,
+    key/value cache on); each request may override any of DECODING_KEYS.
+
+    Concurrent generate_response calls are batched dynamically: prompts
+    arriving within `generation_batch_window_ms` of each other (up to
+    `generation_max_batch_size`) are padded into one batch and decoded by a
+    single model.generate call, per distinct decoding setting. Set the window
+    to 0 to disable. Streaming requests are not batched.
+    """
+    def __init__(self, max_input_tokens: Optional[int] = None, backend: str = 'torch',
+                 backend_params: Optional[Dict[str, Any]] = None, decoding: Optional[Dict[str, Any]] = None,
+                 generation_batch_window_ms: float = 10.0, generation_max_batch_size: int = 8):
+        if backend not in GENERATION_BACKENDS:
+            raise ValueError(f"Unknown generation backend '{backend}'. Expected one of {GENERATION_BACKENDS}.")
+        # Using "google/flan-t5-small" model
+        self.model_name = "google/flan-t5-small"
+        self.backend = backend
+        self.backend_params = backend_params or {}
+        self.decoding = {**DEFAULT_DECODING, **(decoding or {})}
+        self._text_generator = None
+        self._max_input_tokens = max_input_tokens
+
+        self.generation_batcher: Optional[MicroBatcher] = None
+        if generation_batch_window_ms > 0:
+            self.generation_batcher = MicroBatcher(self._generate_batch, max_batch_size=generation_max_batch_size,
+                                                   max_wait_ms=generation_batch_window_ms, name='GenerationBatcher')
+
+        # Recent streaming latencies, kept separately: time to first token vs. total time
+        self._latency_lock = threading.Lock()
+        self.latency_samples: Dict[str, Deque[float]] = {
+            "time_to_first_token_ms": deque(maxlen=1000),
+            "total_latency_ms": deque(maxlen=1000)
+        }
+
+    @property
+    def text_generator(self):
+        """The Hugging Face text generation pipeline, loaded on first use."""
+        if self._text_generator is None:
+            print(f"Initializing Hugging Face LLM pipeline ({self.model_name}, {self.backend})... This may take a moment.")
+            # One pipeline per process, shared with other agents (and across forks when preloaded)
+            self._text_generator = get_text_generator(self.model_name, backend=self.backend, params=self.backend_params)
+            print("Hugging Face LLM pipeline initialized.")
+        return self._text_generator
+
+    @property
+    def tokenizer(self):
+        return self.text_generator.tokenizer
+
+    @property
+    def max_input_tokens(self) -> int:
+        if self._max_input_tokens is None:
+            # Tokenizers without a fixed window report a huge sentinel value
+            model_max_length = getattr(self.tokenizer, 'model_max_length', None) or 512
+            self._max_input_tokens = model_max_length if model_max_length < 100000 else 512
+        return self._max_input_tokens
+
+    @property
+    def model_loaded(self) -> bool:
+        return self._text_generator is not None or is_loaded(generator_kind("text2text-generation", self.backend), self.model_name)
+
+    def warmup(self):
+        """Loads the model and generates a few tokens, so the first chat request pays for neither."""
+        self.text_generator("Say hello.", **decoding_kwargs(self.decoding, {"max_new_tokens": 8}))
+
+    def _generate_batch(self, requests: List[Tuple[str, Dict[str, Any]]]) -> List[Union[str, Exception]]:
+        """
+        Generates the answers to several (prompt, decoding kwargs) requests.
+        Requests with the same decoding settings share one padded generate call.
+        A group whose settings fail gets the exception in place of its answers,
+        so it does not fail the other requests of the batch.
+        """
+        answers: List[Union[str, Exception]] = [""] * len(requests)
+        groups: Dict[tuple, List[int]] = {}
+        for row, (_, generation_kwargs) in enumerate(requests):
+            try:
+                groups.setdefault(tuple(sorted(generation_kwargs.items())), []).append(row)
+            except TypeError as e: # An unhashable setting value
+                answers[row] = e
+        tokenizer, model = self.tokenizer, self.text_generator.model
+        for settings, rows in groups.items():
+            try:
+                with tracer.span('generate_batch', batch_size=len(rows)):
+                    inputs = tokenizer([requests[row][0] for row in rows], padding=True, truncation=True,
+                                       return_tensors="pt")
+                    outputs = model.generate(**inputs, **dict(settings))
+                texts = tokenizer.batch_decode(outputs, skip_special_tokens=True)
+            except Exception as e:
+                texts = [e] * len(rows)
+            for row, text in zip(rows, texts):
+                answers[row] = text
+        return answers
+
+    def batching_stats(self) -> Dict[str, Any]:
+        """Batch occupancy and queueing delay of the generation batcher (empty when batching is off)."""
+        return self.generation_batcher.stats() if self.generation_batcher else {}
+
+    def _format_prompt(self, query: str, retrieved_context: List[Dict[str, Any]]) -> str:
+        """
+        Formats the prompt for the LLM, including the user's query
+        and the retrieved context, packed to the model's token budget.
+        """
+        # Whatever the template and query take up is not available for context
+        overhead = len(self.tokenizer(PROMPT_TEMPLATE.format(context_str="", query=query))['input_ids'])
+        packed, stats = pack_context(retrieved_context, self.tokenizer, self.max_input_tokens - overhead)
+        print(f"Context packing: {stats['context_tokens']} context tokens kept, {stats['cut_tokens']} cut "
+              f"(budget {self.max_input_tokens - overhead}, {stats['merged_chunks']} merged, "
+              f"{stats['duplicate_chunks']} duplicate chunks).")
+
+        context_str = "\n".join([f"Source: {c['source']}\nContent: {c['content']}" for c in packed])
+        return PROMPT_TEMPLATE.format(context_str=context_str, query=query)
+
+    def generate_response(self, query: str, retrieved_context: List[Dict[str, Any]],
+                          decoding: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         Generates a response using the LLM based on the query and retrieved context.
+        `decoding` overrides the agent's decoding settings for this request.
         """
+        generation_kwargs = decoding_kwargs(self.decoding, decoding)
         if not retrieved_context:
             return {
                 "answer": "I don't have enough information to answer that based on the uploaded documents. Please upload relevant documents.",
                 "source_context": []
             }
 
-        prompt = self._format_prompt(query, retrieved_context)
+        with tracer.span('prompt'):
+            prompt = self._format_prompt(query, retrieved_context)
         print(f"\n--- LLM Prompt ---\n{prompt}\n--- End Prompt ---")
 
         try:
-            # --- ACTUAL LLM CALL using Hugging Face pipeline ---
-            # The pipeline returns a list of dictionaries, e.g., [{'generated_text': '...'}]
-            llm_output = self.text_generator(prompt, max_length=200, num_return_sequences=1)
-            generated_text = llm_output[0]['generated_text']
+            # --- ACTUAL LLM CALL using the Hugging Face model ---
+            # Concurrent requests are decoded together in one padded batch
+            with tracer.span('generate'):
+                if self.generation_batcher:
+                    generated_text = self.generation_batcher.submit((prompt, generation_kwargs))
+                else:
+                    generated_text = self._generate_batch([(prompt, generation_kwargs)])[0]
+                if isinstance(generated_text, Exception):
+                    raise generated_text
             # --- END ACTUAL LLM CALL ---
 
-            sources = []
-            # Extract unique sources from the retrieved context
-            for chunk in retrieved_context:
-                if chunk['source'] not in sources:
-                    sources.append(chunk['source'])
-
             return {
                 "answer": generated_text,
-                "source_context": sources
+                "source_context": self._sources(retrieved_context)
             }
         except Exception as e:
             print(f"Error during LLM generation: {e}")
@@ -173,6 +292,114 @@ Answer:
                 "source_context": []
             }
 
+    def _sources(self, retrieved_context: List[Dict[str, Any]]) -> List[str]:
+        """Extracts the unique sources from the retrieved context, in rank order."""
+        sources = []
+        for chunk in retrieved_context:
+            if chunk['source'] not in sources:
+                sources.append(chunk['source'])
+        return sources
+
+    def generate_response_stream(self, query: str, retrieved_context: List[Dict[str, Any]],
+                                 decoding: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Streaming variant of generate_response. Yields {"event": "token", "text": ...}
+        as tokens are decoded, then a final {"event": "done", "answer": ...,
+        "source_context": ..., "time_to_first_token_ms": ..., "total_latency_ms": ...}.
+        """
+        generation_kwargs = decoding_kwargs(self.decoding, decoding)
+        if not retrieved_context:
+            yield {"event": "done", **self.generate_response(query, retrieved_context)}
+            return
+
+        with tracer.span('prompt'):
+            prompt = self._format_prompt(query, retrieved_context)
+        print(f"\n--- LLM Prompt (streaming) ---\n{prompt}\n--- End Prompt ---")
+        start = time.perf_counter()
+
+        tokenizer = self.text_generator.tokenizer
+        model = self.text_generator.model
+        inputs = tokenizer(prompt, return_tensors="pt")
+        # The streamer decodes tokens as generate() produces them on the worker thread
+        streamer = load_module('transformers').TextIteratorStreamer(tokenizer, skip_special_tokens=True, timeout=120)
+        generation_error: List[Exception] = []
+
+        def generate():
+            try:
+                model.generate(**inputs, num_return_sequences=1, streamer=streamer, **generation_kwargs)
+            except Exception as e:
+                generation_error.append(e)
+                streamer.end()
+
+        worker = threading.Thread(target=generate, name='LLMStreamingGeneration', daemon=True)
+        worker.start()
+
+        pieces = []
+        time_to_first_token_ms = None
+        for text in streamer:
+            if not text:
+                continue
+            if time_to_first_token_ms is None:
+                time_to_first_token_ms = (time.perf_counter() - start) * 1000
+            pieces.append(text)
+            yield {"event": "token", "text": text}
+        worker.join()
+        total_latency_ms = (time.perf_counter() - start) * 1000
+
+        if generation_error:
+            print(f"Error during LLM generation: {generation_error[0]}")
+            yield {
+                "event": "done",
+                "answer": f"An error occurred while generating the response: {str(generation_error[0])}. Please try again.",
+                "source_context": []
+            }
+            return
+
+        if time_to_first_token_ms is None:
+            time_to_first_token_ms = total_latency_ms
+        with self._latency_lock:
+            self.latency_samples["time_to_first_token_ms"].append(time_to_first_token_ms)
+            self.latency_samples["total_latency_ms"].append(total_latency_ms)
+        tracer.record_span('time_to_first_token', time_to_first_token_ms / 1000)
+        tracer.record_span('generate', total_latency_ms / 1000, streamed=True)
+        print(f"LLM streaming: time to first token {time_to_first_token_ms:.0f} ms, total {total_latency_ms:.0f} ms.")
+
+        yield {
+            "event": "done",
+            "answer": "".join(pieces),
+            "source_context": self._sources(retrieved_context),
+            "time_to_first_token_ms": round(time_to_first_token_ms, 1),
+            "total_latency_ms": round(total_latency_ms, 1)
+        }
+
+    def latency_stats(self) -> Dict[str, Dict[str, float]]:
+        """Returns p50/p95 of recent time-to-first-token and total streaming latencies."""
+        with self._latency_lock:
+            samples = {name: list(values) for name, values in self.latency_samples.items()}
+        return {
+            name: {
+                "count": len(values),
+                "p50": float(np.percentile(values, 50)) if values else 0.0,
+                "p95": float(np.percentile(values, 95)) if values else 0.0
+            }
+            for name, values in samples.items()
+        }
+
+    def handle_message(self, message: MCPMessage) -> Dict[str, Any]:
+        """
+        Handles GENERATE_RESPONSE_REQUEST and GENERATE_RESPONSE_STREAM_REQUEST
+        messages from the MCP message bus. The streaming request answers at once
+        with a lazy event stream; tokens are generated as the caller consumes it.
+        """
+        query, retrieved_context = message.payload['query'], message.payload['retrieved_context']
+        decoding = message.payload.get('decoding')
+        if message.type == "GENERATE_RESPONSE_REQUEST":
+            return self.generate_response(query, retrieved_context, decoding)
+        if message.type == "GENERATE_RESPONSE_STREAM_REQUEST":
+            decoding_kwargs(self.decoding, decoding) # Reject bad settings now rather than mid-stream
+            return {"events": self.generate_response_stream(query, retrieved_context, decoding)}
+        raise ValueError(f"LLMResponseAgent cannot handle message type {message.type}.")
+
 # Example usage (for testing)
 if __name__ == "__main__":
     llm_agent = LLMResponseAgent()
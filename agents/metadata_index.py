@@ -0,0 +1,165 @@
+# agents/metadata_index.py
+
+import json
+import os
+import threading
+from array import array
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+# Filters a retrieval request may set:
+#   source          - document name(s), e.g. "handbook.pdf" or ["a.pdf", "b.docx"]
+#   file_type       - extension(s) of the document name, e.g. "pdf" or [".csv", "md"]
+#   uploaded_after  - upload time at or after this (unix seconds or ISO 8601)
+#   uploaded_before - upload time at or before this (unix seconds or ISO 8601)
+#   pages           - [first, last] (1-based, inclusive) or one page; chunks overlapping it match
+FILTER_FIELDS = ('source', 'file_type', 'uploaded_after', 'uploaded_before', 'pages')
+
+
+def file_type(source: str) -> str:
+    """The file type of a document name: its lower-cased extension without the dot."""
+    return os.path.splitext(source)[1].lower().lstrip('.')
+
+
+def _timestamp(value: Any, name: str) -> float:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            pass
+    raise ValueError(f"{name} must be a unix timestamp or an ISO 8601 date, got {value!r}")
+
+
+def normalize_filters(filters: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Validates the filters of a retrieval request and returns them in canonical
+    form (value lists sorted, file types without dots, times as unix seconds,
+    pages as [first, last]), or None if they restrict nothing. Raises
+    ValueError for unknown fields or unusable values.
+    """
+    if filters is None:
+        return None
+    if not isinstance(filters, dict):
+        raise ValueError("filters must be an object")
+    unknown = sorted(set(filters) - set(FILTER_FIELDS))
+    if unknown:
+        raise ValueError(f"Unknown filter fields {unknown}. Expected any of {list(FILTER_FIELDS)}.")
+
+    normalized: Dict[str, Any] = {}
+    for name in ('source', 'file_type'):
+        value = filters.get(name)
+        if value is None:
+            continue
+        values = [value] if isinstance(value, str) else value
+        if not isinstance(values, list) or not values or not all(isinstance(v, str) and v for v in values):
+            raise ValueError(f"{name} must be a string or a non-empty list of strings")
+        if name == 'file_type':
+            values = [v.lower().lstrip('.') for v in values]
+        normalized[name] = sorted(set(values))
+    for name in ('uploaded_after', 'uploaded_before'):
+        if filters.get(name) is not None:
+            normalized[name] = _timestamp(filters[name], name)
+    pages = filters.get('pages')
+    if pages is not None:
+        pages = [pages, pages] if isinstance(pages, int) and not isinstance(pages, bool) else pages
+        if (not isinstance(pages, list) or len(pages) != 2
+                or not all(isinstance(p, int) and not isinstance(p, bool) and p >= 1 for p in pages)
+                or pages[0] > pages[1]):
+            raise ValueError("pages must be a page number or [first, last] with 1 <= first <= last")
+        normalized['pages'] = pages
+    return normalized or None
+
+
+def filter_key(filters: Optional[Dict[str, Any]]) -> Optional[str]:
+    """A hashable key for normalized filters (None for no filters), e.g. to group or cache requests."""
+    return json.dumps(filters, sort_keys=True) if filters else None
+
+
+class MetadataIndex:
+    """
+    Inverted indexes over chunk metadata, to find the rows matching a filter
+    (see normalize_filters) before a search runs, so the search itself can be
+    restricted to them.
+
+    'source' and 'file_type' map each value to the rows that have it, kept as
+    append-only int64 arrays sorted by row, so selecting by them costs
+    O(matching rows). Upload time and page ranges are then checked on the
+    chunk store's columns, only over the rows the other filters left. Deleted
+    rows are dropped at selection time using the store's flags, the same
+    tombstones the other indexes rely on.
+    """
+    INDEXED_FIELDS = ('source', 'file_type')
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[str, array]] = {field: {} for field in self.INDEXED_FIELDS}
+        self._lock = threading.Lock()
+
+    def add(self, start_row: int, chunks: Iterable[Optional[Dict[str, Any]]]):
+        """Records chunks stored at consecutive rows from start_row (None entries are skipped)."""
+        with self._lock:
+            for row, chunk in enumerate(chunks, start=start_row):
+                source = chunk.get('source') if chunk is not None else None
+                if source is None:
+                    continue
+                for field, value in (('source', source), ('file_type', file_type(source))):
+                    self._postings[field].setdefault(value, array('q')).append(row)
+
+    def _rows(self, field: str, values: List[str]) -> np.ndarray:
+        """Sorted rows having any of `values` in `field`. Caller holds the lock."""
+        postings = [np.frombuffer(self._postings[field][value], dtype=np.int64).copy()
+                    for value in values if value in self._postings[field]]
+        if not postings:
+            return np.empty(0, dtype=np.int64)
+        return postings[0] if len(postings) == 1 else np.unique(np.concatenate(postings))
+
+    def select(self, filters: Dict[str, Any], chunk_store) -> np.ndarray:
+        """Sorted ids of the live rows of `chunk_store` that match normalized `filters`."""
+        rows = None
+        with self._lock:
+            for field in self.INDEXED_FIELDS:
+                if field in filters:
+                    matched = self._rows(field, filters[field])
+                    rows = matched if rows is None else np.intersect1d(rows, matched, assume_unique=True)
+        num_rows = len(chunk_store)
+        rows = np.arange(num_rows, dtype=np.int64) if rows is None else rows[rows < num_rows]
+        rows = rows[chunk_store.column('deleted')[rows] == 0]
+
+        if 'uploaded_after' in filters or 'uploaded_before' in filters:
+            uploaded_at = chunk_store.column('uploaded_at')[rows]
+            keep = uploaded_at >= 0 # Chunks indexed before upload times were recorded never match
+            if 'uploaded_after' in filters:
+                keep &= uploaded_at >= filters['uploaded_after']
+            if 'uploaded_before' in filters:
+                keep &= uploaded_at <= filters['uploaded_before']
+            rows = rows[keep]
+        if 'pages' in filters:
+            first, last = filters['pages']
+            start_page = chunk_store.column('start_page')[rows]
+            end_page = chunk_store.column('end_page')[rows]
+            rows = rows[(start_page >= 0) & (start_page <= last) & (end_page >= first)]
+        return rows
+
+    def clear(self):
+        with self._lock:
+            self._postings = {field: {} for field in self.INDEXED_FIELDS}
+
+
+# Example usage (for testing)
+if __name__ == "__main__":
+    from agents.chunk_store import ChunkStore
+
+    chunks = [
+        {"content": "Remote work policy.", "source": "handbook.pdf", "start_page": 1, "end_page": 2, "uploaded_at": 1700000000},
+        {"content": "Expense policy.", "source": "handbook.pdf", "start_page": 3, "end_page": 3, "uploaded_at": 1700000000},
+        {"content": "region | revenue", "source": "sales.csv", "uploaded_at": 1710000000},
+    ]
+    store = ChunkStore.from_chunks(chunks)
+    index = MetadataIndex()
+    index.add(0, chunks)
+    for request in ({"file_type": "PDF", "pages": 3}, {"uploaded_after": "2024-01-01"}, {"source": ["missing.txt"]}):
+        filters = normalize_filters(request)
+        print(f"{request} -> {filters} -> rows {index.select(filters, store).tolist()}")
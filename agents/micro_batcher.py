@@ -0,0 +1,109 @@
+# agents/micro_batcher.py
+
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, List
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+class MicroBatcher:
+    """
+    Groups items submitted concurrently from many threads into batches.
+
+    Each caller blocks in submit() while a background worker collects waiting
+    items until `max_batch_size` is reached or `max_wait_ms` has passed since the
+    first item arrived. The whole batch is handed to `batch_fn` in one call, which
+    must return one result per item (in order); each caller gets its own result,
+    or the exception raised by `batch_fn`. A result that is an exception is
+    raised to its caller alone, so batch_fn can fail single items.
+    """
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]], max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0, name: str = 'MicroBatcher'):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.name = name
+        self._queue: "queue.Queue" = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._max_batch_seen = 0
+        self._batch_size_histogram: Dict[int, int] = {}
+        self._total_queue_wait_ms = 0.0
+        self._recent_queue_waits_ms: Deque[float] = deque(maxlen=1000)
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+    def submit(self, item: Any) -> Any:
+        """Queues an item and blocks until its batch has been processed."""
+        future: Future = Future()
+        self._queue.put((item, future, time.perf_counter()))
+        return future.result()
+
+    def _collect_batch(self) -> List[tuple]:
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            started = time.perf_counter()
+            with self._stats_lock:
+                self._batches += 1
+                self._items += len(batch)
+                self._max_batch_seen = max(self._max_batch_seen, len(batch))
+                self._batch_size_histogram[len(batch)] = self._batch_size_histogram.get(len(batch), 0) + 1
+                waits = [(started - enqueued) * 1000 for _, _, enqueued in batch]
+                self._total_queue_wait_ms += sum(waits)
+                self._recent_queue_waits_ms.extend(waits)
+
+            try:
+                results = self.batch_fn([item for item, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future, _), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns queue depth and batch-size statistics. Occupancy is the mean batch
+        size as a fraction of max_batch_size; queue waits are the time items spent
+        queued before their batch started (p50/p95 over the last 1000 items).
+        """
+        with self._stats_lock:
+            recent_waits = list(self._recent_queue_waits_ms)
+            return {
+                "queue_depth": self._queue.qsize(),
+                "batches": self._batches,
+                "items": self._items,
+                "mean_batch_size": self._items / self._batches if self._batches else 0.0,
+                "max_batch_size_seen": self._max_batch_seen,
+                "batch_size_histogram": dict(sorted(self._batch_size_histogram.items())),
+                "mean_occupancy": self._items / (self._batches * self.max_batch_size) if self._batches else 0.0,
+                "mean_queue_wait_ms": self._total_queue_wait_ms / self._items if self._items else 0.0,
+                "queue_wait_ms_p50": _percentile(recent_waits, 50),
+                "queue_wait_ms_p95": _percentile(recent_waits, 95),
+            }
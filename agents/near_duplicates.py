@@ -0,0 +1,147 @@
+# agents/near_duplicates.py
+
+import re
+import threading
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+_WORD_RE = re.compile(r"\w+")
+_SHINGLE_MULTIPLIER = np.uint64(0x100000001B3)
+
+
+def lsh_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """
+    Splits a signature of `num_perm` hashes into (bands, rows per band). Pairs
+    with Jaccard similarity s share a band with probability 1 - (1 - s^r)^b,
+    an S-curve centred near (1/b)^(1/r). The curve is placed below `threshold`
+    so that true near-duplicates are rarely missed; candidates are verified
+    exactly afterwards, so the extra false positives only cost a comparison.
+    """
+    options = [(b, num_perm // b) for b in range(1, num_perm + 1) if num_perm % b == 0]
+    below = [(b, r) for b, r in options if (1 / b) ** (1 / r) <= 0.9 * threshold]
+    if not below:
+        return options[-1]
+    return max(below, key=lambda option: (1 / option[0]) ** (1 / option[1]))
+
+
+def jaccard(a: np.ndarray, b: np.ndarray) -> float:
+    """Jaccard similarity of two sorted arrays of unique shingle hashes."""
+    if not len(a) or not len(b):
+        return 0.0
+    common = len(np.intersect1d(a, b, assume_unique=True))
+    return common / (len(a) + len(b) - common)
+
+
+class MinHasher:
+    """
+    MinHash signatures of texts over word `shingle_size`-grams. Shingles are
+    hashed to 64 bits and each of the `num_perm` hash functions is a
+    multiply-shift hash ((a * x + b) mod 2^64) >> 32 with a random odd `a`.
+    """
+    def __init__(self, num_perm: int = 64, shingle_size: int = 5, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        self._a = (rng.integers(0, 2 ** 63, num_perm, dtype=np.uint64) << np.uint64(1)) | np.uint64(1)
+        self._b = rng.integers(0, 2 ** 63, num_perm, dtype=np.uint64)
+
+    def shingles(self, text: str) -> np.ndarray:
+        """Sorted unique hashes of the text's word shingles (one shingle if it has fewer words)."""
+        words = _WORD_RE.findall(text.lower())
+        if not words:
+            return np.empty(0, dtype=np.uint64)
+        hashes = np.fromiter((zlib.crc32(word.encode('utf-8')) for word in words), dtype=np.uint64, count=len(words))
+        count = len(hashes) - min(self.shingle_size, len(hashes)) + 1
+        shingles = hashes[:count].copy()
+        for i in range(1, min(self.shingle_size, len(hashes))):
+            shingles = shingles * _SHINGLE_MULTIPLIER ^ hashes[i:i + count]
+        return np.unique(shingles)
+
+    def signature(self, shingles: np.ndarray) -> np.ndarray:
+        """The MinHash signature (num_perm uint32 values) of a set of shingle hashes."""
+        if not len(shingles):
+            return np.full(self.num_perm, np.iinfo(np.uint32).max, dtype=np.uint32)
+        hashed = (self._a[:, None] * shingles[None, :] + self._b[:, None]) >> np.uint64(32)
+        return hashed.min(axis=1).astype(np.uint32)
+
+
+class NearDuplicateIndex:
+    """
+    Locality-sensitive hashing index over MinHash signatures, for finding the
+    chunks whose text is nearly identical (Jaccard similarity of word shingles
+    at least `threshold`) to a new one.
+
+    Signatures are cut into bands (see lsh_bands); two texts are candidates if
+    any band matches exactly, and a candidate is accepted only if its real
+    shingle similarity, computed from its text, reaches the threshold. Keys are
+    whatever ids the caller uses (row ids for the RetrievalAgent). Removing a
+    key is left to the caller's `shingles_of` callback returning None for it,
+    the same tombstone approach the other indexes take.
+    """
+    def __init__(self, threshold: float = 0.9, num_perm: int = 64, shingle_size: int = 5, seed: int = 1):
+        if not 0 < threshold <= 1:
+            raise ValueError(f"Near-duplicate threshold must be in (0, 1], got {threshold}.")
+        self.threshold = threshold
+        self.seed = seed
+        self.hasher = MinHasher(num_perm, shingle_size, seed)
+        self.bands, self.rows_per_band = lsh_bands(num_perm, threshold)
+        self._band_multipliers = np.random.default_rng(seed + 1).integers(
+            1, 2 ** 63, self.rows_per_band, dtype=np.uint64)
+        self._buckets: List[Dict[int, List[int]]] = [{} for _ in range(self.bands)]
+        self._lock = threading.Lock()
+
+    def new_empty(self) -> 'NearDuplicateIndex':
+        """An empty index with the same settings, e.g. for matching the chunks of one batch against each other."""
+        return NearDuplicateIndex(self.threshold, self.hasher.num_perm, self.hasher.shingle_size, self.seed)
+
+    def _band_keys(self, signature: np.ndarray) -> List[int]:
+        bands = signature.reshape(self.bands, self.rows_per_band).astype(np.uint64)
+        return [int(key) for key in (bands * self._band_multipliers).sum(axis=1)]
+
+    def add(self, key: int, signature: np.ndarray):
+        with self._lock:
+            for buckets, band_key in zip(self._buckets, self._band_keys(signature)):
+                buckets.setdefault(band_key, []).append(key)
+
+    def find(self, shingles: np.ndarray, signature: np.ndarray,
+             shingles_of: Callable[[int], Optional[np.ndarray]]) -> Optional[int]:
+        """
+        Returns the most similar key whose text is a near-duplicate, or None.
+        `shingles_of(key)` gives a candidate's shingles, or None if it is gone.
+        """
+        if not len(shingles):
+            return None
+        with self._lock:
+            candidates = set()
+            for buckets, band_key in zip(self._buckets, self._band_keys(signature)):
+                candidates.update(buckets.get(band_key, ()))
+        best, best_similarity = None, 0.0
+        for key in sorted(candidates): # On ties the oldest key wins
+            candidate_shingles = shingles_of(key)
+            if candidate_shingles is None:
+                continue
+            similarity = jaccard(shingles, candidate_shingles)
+            if similarity >= self.threshold and similarity > best_similarity:
+                best, best_similarity = key, similarity
+        return best
+
+    def clear(self):
+        with self._lock:
+            self._buckets = [{} for _ in range(self.bands)]
+
+
+# Example usage (for testing)
+if __name__ == "__main__":
+    index = NearDuplicateIndex(threshold=0.8)
+    texts = ["Employees may work remotely up to three days per week with manager approval.",
+             "Employees may work remotely up to three days per week, with manager approval!",
+             "Expense reports must be submitted within thirty days of purchase."]
+    shingles = [index.hasher.shingles(text) for text in texts]
+    for key, text_shingles in enumerate(shingles):
+        signature = index.hasher.signature(text_shingles)
+        match = index.find(text_shingles, signature, lambda other: shingles[other])
+        print(f"Text {key}: near-duplicate of {match}")
+        if match is None:
+            index.add(key, signature)
@@ -1,95 +1,1079 @@
 # agents/retrieval_agent.py
 
-from sentence_transformers import SentenceTransformer
 import faiss
 import numpy as np
-from typing import List, Dict, Any, Optional
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+from agents.chunk_store import ChunkStore
+from agents.index_store import IndexStore
+from agents.embedding_backends import EMBEDDING_BACKENDS, benchmark_embedding_backends
+from agents.embedding_cache import EmbeddingCache
+from agents.index_factory import (DEFAULT_INDEX_PARAMS, INDEX_TYPES, benchmark_index_types, build_index, index_ids,
+                                  promote_index, reconstruct_all, reconstruct_ids, search_parameters,
+                                  set_search_params, unwrap_index)
+from agents.document_registry import DocumentRegistry
+from agents.metadata_index import MetadataIndex, filter_key, normalize_filters
+from agents.micro_batcher import MicroBatcher
+from agents.near_duplicates import NearDuplicateIndex
+from agents.shared_models import embedding_kind, get_embedding_model, is_loaded
+from agents.sparse_index import InvertedIndex, reciprocal_rank_fusion
+from agents.telemetry import tracer
+from mcp.message_protocol import MCPMessage
+
+RETRIEVAL_MODES = ('dense', 'sparse', 'hybrid')
 
 class RetrievalAgent:
     """
     The RetrievalAgent handles embedding generation and semantic retrieval
     using a FAISS vector store.
+
+    If `index_dir` is set, the index and chunk metadata are persisted there
+    (see IndexStore) and loaded memory-mapped on startup, so a restart does not
+    require re-uploading and re-embedding every document. If `cache_dir` is set,
+    chunk embeddings are looked up in an on-disk EmbeddingCache before running
+    the model. Query embeddings bypass it and are kept in a small in-memory LRU
+    (QUERY_CACHE_SIZE), so chat traffic neither writes to nor evicts from it.
+
+    `embedding_backend` picks how the model runs (see embedding_backends):
+    'torch' (fp32), 'onnx' (onnxruntime) or 'onnx-int8' (quantized ONNX).
+    `embedding_params` may set intra_op_threads and inter_op_threads. Cached
+    embeddings are kept per backend.
+
+    The index starts as an exact IndexFlatL2. If `index_type` is an approximate
+    backend ('hnsw', 'ivf' or 'ivfpq', see index_factory), it is promoted to that
+    type automatically once it holds `promote_at` vectors.
+
+    Concurrent queries are micro-batched: callers arriving within
+    `query_batch_window_ms` of each other (up to `query_max_batch_size`) share
+    one model.encode call and one FAISS search. Set the window to 0 to disable.
+
+    Alongside FAISS, every chunk is added to a BM25 InvertedIndex, so exact
+    identifiers (part numbers, error codes, SKUs) can be matched. In 'hybrid'
+    retrieval_mode both searches run and are merged by reciprocal rank fusion.
+
+    Every chunk gets a stable row id: its row in the columnar chunk_store, which
+    is also its FAISS id (the index is an IndexIDMap2). Deleting a document
+    tombstones its rows (flagged in the store, and searches skip them through an
+    IDSelector), which costs O(its chunks). Once tombstones make up
+    `compact_ratio` of the index, a background compaction removes their vectors
+    and postings.
+
+    Before a batch is embedded, each chunk is looked up in a MinHash/LSH index
+    of the indexed chunks (see agents.near_duplicates). A chunk whose word
+    shingles are at least `dedup_threshold` similar to an indexed chunk, or to
+    an earlier chunk of the batch, is stored with 'duplicate_of' set to that
+    canonical row but is not embedded and gets no vector or BM25 postings, so
+    copies of a document cannot fill the top_k results. When a canonical chunk
+    is deleted, one of its duplicates takes over its vector. dedup_report()
+    shows the embedding time and index space saved; None disables the check.
+
+    Retrieval can be restricted by metadata filters (source, file type, upload
+    time, page range; see agents.metadata_index). The matching rows are looked
+    up in per-field inverted indexes and handed to FAISS as an IDSelectorBitmap
+    (and to BM25 as a mask), so the search only ever scores matching chunks
+    instead of over-fetching and filtering afterwards.
+
+    With `shared_index=True` several worker processes (e.g. gunicorn workers)
+    serve the same `index_dir`. The published snapshot stays memory-mapped, so
+    its pages are shared by every worker, and each worker keeps the rows logged
+    since then in a small in-memory delta index that is searched alongside it.
+    Writes take the store's writer lock; other workers pick them up from the WAL
+    within `refresh_interval_s`. A checkpoint folds the delta into a new snapshot.
     """
-    def __init__(self, model_name: str = 'all-MiniLM-L6-v2'):
+    QUERY_CACHE_SIZE = 1024
+
+    def __init__(self, model_name: str = 'all-MiniLM-L6-v2', index_dir: Optional[str] = 'vector_store',
+                 cache_dir: Optional[str] = 'embedding_cache', index_type: str = 'flat',
+                 promote_at: int = 100000, index_params: Optional[Dict[str, Any]] = None,
+                 query_batch_window_ms: float = 5.0, query_max_batch_size: int = 32,
+                 index_batch_size: int = 256, retrieval_mode: str = 'hybrid', compact_ratio: float = 0.2,
+                 shared_index: bool = False, refresh_interval_s: float = 1.0,
+                 embedding_backend: str = 'torch', embedding_params: Optional[Dict[str, Any]] = None,
+                 dedup_threshold: Optional[float] = 0.9):
+        if embedding_backend not in EMBEDDING_BACKENDS:
+            raise ValueError(f"Unknown embedding backend '{embedding_backend}'. Expected one of {EMBEDDING_BACKENDS}.")
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type '{index_type}'. Expected one of {INDEX_TYPES}.")
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode '{retrieval_mode}'. Expected one of {RETRIEVAL_MODES}.")
+        self.retrieval_mode = retrieval_mode
+        self.index_type = index_type
+        self.promote_at = promote_at
+        self.index_params = index_params or {}
+
         # Load a pre-trained sentence transformer model for embeddings
         # This model is good for general purpose sentence embeddings and is relatively small.
-        self.model = SentenceTransformer(model_name)
-        self.vector_store: Optional[faiss.IndexFlatL2] = None
-        self.documents_metadata: List[Dict[str, Any]] = [] # Stores chunk content and metadata
+        self.model_name = model_name
+        self.embedding_backend = embedding_backend
+        self.embedding_params = embedding_params or {}
+        self._model = None # Loaded on first use or by warmup(), see the model property
+        # Quantized backends give slightly different vectors, so they get their own cache entries
+        cache_model_name = model_name if embedding_backend == 'torch' else f"{model_name}:{embedding_backend}"
+        self.embedding_cache: Optional[EmbeddingCache] = EmbeddingCache(cache_dir, cache_model_name) if cache_dir else None
+        # Query embeddings stay out of the on-disk chunk cache: a small in-memory LRU
+        # serves the repeats (the answer cache lookup and retrieval embed the same query)
+        self._query_embeddings: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._query_embeddings_lock = threading.Lock()
+        self.vector_store: Optional[faiss.Index] = None
+        self.chunk_store = ChunkStore() # Chunk content and metadata per row id; store[row] is None once deleted
+        self.documents = DocumentRegistry() # Source -> content hash and row ids
+        self.metadata_index = MetadataIndex() # Source / file type -> row ids, for filtered retrieval
+        self._filter_selections: Dict[Tuple[int, str], Dict[str, Any]] = {} # (index_version, filter key) -> selection
+        self.index_batch_size = index_batch_size
+        # Guards vector_store/chunk_store: FAISS does not allow searching while adding
+        self._index_lock = threading.RLock()
+        # Bumped on every change to the index, so caches of search results can be invalidated
+        self.index_version = 0
+
+        # Row ids deleted from the chunk store but still present in vector_store until compaction
+        self._pending_deletes: set = set()
+        self._exclude_selector = None # (IDSelectorBatch, IDSelectorNot) over _pending_deletes, built lazily
+        self.compact_ratio = compact_ratio
+        self._compaction_thread: Optional[threading.Thread] = None
+
+        # Near-duplicate chunks are linked to a canonical row instead of being embedded again
+        self.near_duplicates: Optional[NearDuplicateIndex] = NearDuplicateIndex(dedup_threshold) if dedup_threshold else None
+        self._duplicates: Dict[int, List[int]] = {} # Canonical row -> live rows linked to it
+        self._dedup_counts = {"chunks_checked": 0, "duplicates": 0, "embedding_seconds_saved": 0.0, "index_bytes_saved": 0}
+        self._embed_seconds_per_chunk = 0.0 # Measured on the last batch that was embedded
+
+        # Sparse (BM25) index over the same rows as FAISS, searched on its own threads
+        self.sparse_index = InvertedIndex()
+        self._sparse_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='SparseSearch')
+        self._latency_lock = threading.Lock()
+        self.latency_samples: Dict[str, Deque[float]] = {
+            stage: deque(maxlen=1000) for stage in ('embed_ms', 'dense_search_ms', 'sparse_search_ms', 'fusion_ms')
+        }
+
+        self.query_batcher: Optional[MicroBatcher] = None
+        if query_batch_window_ms > 0:
+            self.query_batcher = MicroBatcher(self.retrieve_relevant_chunks_batch, max_batch_size=query_max_batch_size,
+                                              max_wait_ms=query_batch_window_ms, name='QueryBatcher')
+
+        # Shared mode: rows added since the snapshot live here, vector_store stays mapped
+        self._delta_store: Optional[faiss.Index] = None
+        self.refresh_interval_s = refresh_interval_s
+        self._last_refresh = time.monotonic()
+
+        self.index_store: Optional[IndexStore] = IndexStore(index_dir, shared=shared_index) if index_dir else None
+        self._index_is_mmapped = False # True while vector_store is a read-only mapping of the snapshot
+        if self.index_store:
+            self._load_from_disk()
+
+    def _load_from_disk(self):
+        """Loads the persisted snapshot and replays any batches logged after it."""
+        self.vector_store, self.chunk_store = self.index_store.load_snapshot()
+        self._index_is_mmapped = self.vector_store is not None
+        # The inverted index, near-duplicate index and document registry are cheap to rebuild from the chunks,
+        # so they are not persisted
+        for row in self.chunk_store.live_rows():
+            self._track_chunk(int(row), self.chunk_store[row])
+        committed = self.index_store.committed_documents()
+        # Stores written before uploads were committed can only go by the chunks' hashes
+        self.documents.trust_chunk_hashes = committed is None
+        self.documents.add(0, self.chunk_store)
+        for source, content_hash in (committed or {}).items():
+            self.documents.commit(source, content_hash)
+        self.metadata_index.add(0, self.chunk_store)
+        migrated = False
+        if self.vector_store is not None:
+            if not isinstance(faiss.downcast_index(self.vector_store), faiss.IndexIDMap2):
+                # Snapshots written before row ids existed store row i at position i
+                self.vector_store = build_index('flat', reconstruct_all(self.vector_store),
+                                                ids=np.arange(self.vector_store.ntotal))
+                self._index_is_mmapped = False
+                migrated = True
+            else:
+                # Rows deleted after the last compaction are still in the snapshot index
+                stored = index_ids(self.vector_store)
+                self._pending_deletes = {int(row) for row in stored
+                                         if row < len(self.chunk_store) and self.chunk_store.is_deleted(row)}
+            set_search_params(self.vector_store, self.index_params)
+        # Only the writer may truncate a shared WAL; readers can see a record mid-append
+        replayed = self._replay_wal(truncate=not self._shared)
+        self.documents.trust_chunk_hashes = False
+        if not self._shared and (self._maybe_promote_index() or migrated):
+            self._checkpoint()
+        if len(self.chunk_store):
+            print(f"Loaded {len(self.chunk_store)} indexed chunks from {self.index_store.store_dir} "
+                  f"({replayed} replayed from the write-ahead log).")
+
+    @property
+    def model(self):
+        """
+        The embedding model, loaded on first use. It is shared with every other
+        agent using the same model in this process (and, with preloading, across forks).
+        """
+        if self._model is None:
+            self._model = get_embedding_model(self.model_name, self.embedding_backend, self.embedding_params)
+        return self._model
+
+    @property
+    def model_loaded(self) -> bool:
+        return self._model is not None or is_loaded(embedding_kind(self.embedding_backend), self.model_name)
+
+    def warmup(self):
+        """Loads the embedding model and runs it once, so the first query pays for neither."""
+        self.model.encode(["warmup"], convert_to_numpy=True)
+
+    @property
+    def _shared(self) -> bool:
+        return self.index_store is not None and self.index_store.shared
+
+    def _replay_wal(self, truncate: bool = True) -> int:
+        """Applies the WAL records this process has not seen yet; returns the number of rows they touch."""
+        replayed = 0
+        for op, embeddings, payload in self.index_store.replay_wal(len(self.chunk_store), truncate=truncate):
+            if op == "add":
+                self._add_embeddings(embeddings, payload)
+            elif op == "commit":
+                self.documents.commit(payload["source"], payload["content_hash"])
+                replayed += 1
+                continue
+            else:
+                self._apply_delete(payload)
+            replayed += len(payload)
+        return replayed
+
+    def _num_vectors(self) -> int:
+        return sum(index.ntotal for index in (self.vector_store, self._delta_store) if index is not None)
+
+    def _ensure_writable_index(self):
+        """A memory-mapped index cannot change; swaps in an in-memory copy on the first write."""
+        if self._index_is_mmapped:
+            self.vector_store = self.index_store.load_writable_index()
+            set_search_params(self.vector_store, self.index_params)
+            self._index_is_mmapped = False
+
+    def _add_embeddings(self, embeddings: np.ndarray, chunks: List[Dict[str, Any]],
+                        signatures: Optional[List[np.ndarray]] = None):
+        """
+        Stores chunks at the next rows. `embeddings` holds one vector per chunk that is not
+        a near-duplicate ('duplicate_of' unset), in order; `signatures`, if given, their MinHash signatures.
+        """
+        start_row = len(self.chunk_store)
+        ids = np.array([start_row + i for i, chunk in enumerate(chunks) if chunk.get('duplicate_of') is None],
+                       dtype='int64')
+        if len(ids):
+            self._add_vectors(embeddings, ids)
+        for i, chunk in enumerate(chunks):
+            self._track_chunk(start_row + i, chunk, signatures[i] if signatures else None)
+        self.documents.add(start_row, chunks)
+        self.metadata_index.add(start_row, chunks)
+        self.chunk_store.extend(chunks)
+
+    def _add_vectors(self, embeddings: np.ndarray, ids: np.ndarray):
+        """Adds vectors under row ids to the FAISS index, creating it (or a writable copy of it) if needed."""
+        if self._shared:
+            # The mapped snapshot is shared with the other workers; new rows go to this process's delta
+            if self._delta_store is None:
+                self._delta_store = faiss.IndexIDMap2(faiss.IndexFlatL2(embeddings.shape[1]))
+            self._delta_store.add_with_ids(embeddings, ids)
+        elif self.vector_store is None:
+            dimension = embeddings.shape[1]
+            # Using IndexFlatL2 for simple Euclidean distance search, with row ids as FAISS ids
+            self.vector_store = faiss.IndexIDMap2(faiss.IndexFlatL2(dimension))
+            print(f"Initialized FAISS index with dimension: {dimension}")
+            self.vector_store.add_with_ids(embeddings, ids)
+        else:
+            self._ensure_writable_index()
+            # The chunk's row in self.chunk_store is its id in FAISS
+            self.vector_store.add_with_ids(embeddings, ids)
+
+    def _track_chunk(self, row: int, chunk: Dict[str, Any], signature: Optional[np.ndarray] = None):
+        """Adds a stored chunk to the BM25 and near-duplicate indexes, or, for a duplicate, links it to its canonical row."""
+        canonical = chunk.get('duplicate_of')
+        if canonical is not None:
+            self._duplicates.setdefault(canonical, []).append(row)
+            return
+        self.sparse_index.add(row, chunk['content'])
+        if self.near_duplicates:
+            if signature is None:
+                signature = self.near_duplicates.hasher.signature(self.near_duplicates.hasher.shingles(chunk['content']))
+            self.near_duplicates.add(row, signature)
+
+    def _apply_delete(self, rows: List[int]):
+        """
+        Tombstones rows: they vanish from results now and from the index at the
+        next compaction. A deleted canonical row hands its vector to one of its duplicates.
+        """
+        orphaned = []
+        for row in rows:
+            chunk = self.chunk_store[row]
+            if chunk is None:
+                continue
+            self.chunk_store.delete(row)
+            self.documents.remove(chunk['source'], [row], chunk.get('doc_hash'))
+            canonical = chunk.get('duplicate_of')
+            if canonical is not None: # A duplicate has no vector or postings of its own
+                linked = self._duplicates.get(canonical, [])
+                if row in linked:
+                    linked.remove(row)
+                continue
+            self.sparse_index.remove(row)
+            self._pending_deletes.add(row)
+            if row in self._duplicates:
+                orphaned.append(row)
+        if orphaned:
+            self._promote_duplicates(orphaned)
+        self._exclude_selector = None
+
+    def _promote_duplicates(self, canonicals: List[int]):
+        """
+        For each deleted canonical row, makes its oldest remaining duplicate the
+        new canonical chunk: it gets the old vector (still in the index until
+        compaction) and its own postings, and the other duplicates are relinked.
+        This runs again when the delete is replayed from the WAL, with the same result.
+        """
+        promotions = [(row, self._duplicates.pop(row)) for row in canonicals if self._duplicates.get(row)]
+        if not promotions:
+            return
+        rows = np.array([row for row, _ in promotions], dtype='int64')
+        vectors: Dict[int, np.ndarray] = {}
+        for index in (self._delta_store, self.vector_store):
+            stored = np.intersect1d(index_ids(index), rows) if index is not None else []
+            if len(stored):
+                vectors.update(zip(stored.tolist(), reconstruct_ids(index, stored)))
+
+        promoted_rows, promoted_vectors = [], []
+        for canonical, (promoted, *others) in promotions:
+            if canonical not in vectors:
+                print(f"Warning: no vector found for deleted row {canonical}; its duplicates stay unsearchable.")
+                continue
+            promoted_rows.append(promoted)
+            promoted_vectors.append(vectors[canonical])
+            self.chunk_store.set(promoted, 'duplicate_of', None)
+            for row in others:
+                self.chunk_store.set(row, 'duplicate_of', promoted)
+            if others:
+                self._duplicates[promoted] = others
+        if not promoted_rows:
+            return
+        self._add_vectors(np.vstack(promoted_vectors), np.array(promoted_rows, dtype='int64'))
+        for row in sorted(promoted_rows):
+            self._track_chunk(row, self.chunk_store[row])
+
+    def _is_canonical(self, row: int) -> bool:
+        """True if the row holds a live chunk that has a vector of its own."""
+        chunk_store = self.chunk_store
+        return (row < len(chunk_store) and not chunk_store.is_deleted(row)
+                and chunk_store.field(row, 'duplicate_of') is None)
+
+    def _canonical_shingles(self, row: int) -> Optional[np.ndarray]:
+        """Shingles of an indexed canonical chunk, or None if the row is deleted (or not canonical)."""
+        if not self._is_canonical(row):
+            return None
+        return self.near_duplicates.hasher.shingles(self.chunk_store.content(row))
+
+    def _find_near_duplicates(self, chunks: List[Dict[str, Any]]) -> Tuple[List[Optional[Tuple[str, int]]],
+                                                                            Optional[List[np.ndarray]]]:
+        """
+        Looks each chunk up among the indexed chunks, then among the earlier
+        chunks of the same batch. Returns, per chunk, ('row', canonical row),
+        ('batch', position of the canonical chunk) or None, and the chunks'
+        MinHash signatures (None when deduplication is off).
+        """
+        if self.near_duplicates is None:
+            return [None] * len(chunks), None
+        hasher = self.near_duplicates.hasher
+        shingles = [hasher.shingles(chunk['content']) for chunk in chunks]
+        signatures = [hasher.signature(chunk_shingles) for chunk_shingles in shingles]
+        in_batch = self.near_duplicates.new_empty()
+        links: List[Optional[Tuple[str, int]]] = []
+        for i in range(len(chunks)):
+            row = self.near_duplicates.find(shingles[i], signatures[i], self._canonical_shingles)
+            if row is not None:
+                links.append(('row', row))
+                continue
+            position = in_batch.find(shingles[i], signatures[i], lambda j: shingles[j])
+            if position is not None:
+                links.append(('batch', position))
+                continue
+            links.append(None)
+            in_batch.add(i, signatures[i])
+        return links, signatures
+
+    def _link_duplicates(self, chunks: List[Dict[str, Any]], links: List[Optional[Tuple[str, int]]],
+                         embeddings: Optional[np.ndarray]) -> Tuple[List[Dict[str, Any]], np.ndarray]:
+        """
+        Turns the links found by _find_near_duplicates into 'duplicate_of' rows,
+        now that the batch's rows are known (caller holds the write lock). A
+        canonical row deleted since the lookup cannot be linked to; those few
+        chunks are embedded here after all. Returns the chunks to store and the
+        vectors of the chunks that are not duplicates.
+        """
+        start_row = len(self.chunk_store)
+        stale = {i for i, link in enumerate(links) if link is not None and link[0] == 'row'
+                 and not self._is_canonical(link[1])}
+        late = iter(self._generate_embeddings([chunks[i]['content'] for i in sorted(stale)]) if stale else [])
+        fresh = iter(embeddings if embeddings is not None else [])
+        linked, vectors = [], []
+        for i, (chunk, link) in enumerate(zip(chunks, links)):
+            if link is None or i in stale:
+                vectors.append(next(late) if i in stale else next(fresh))
+                linked.append(chunk)
+            else:
+                linked.append({**chunk, 'duplicate_of': link[1] if link[0] == 'row' else start_row + link[1]})
+
+        duplicates = len(chunks) - len(vectors)
+        dimension = vectors[0].shape[0] if vectors else self._index_dimension()
+        self._dedup_counts["chunks_checked"] += len(chunks)
+        self._dedup_counts["duplicates"] += duplicates
+        self._dedup_counts["embedding_seconds_saved"] += duplicates * self._embed_seconds_per_chunk
+        self._dedup_counts["index_bytes_saved"] += duplicates * (dimension * 4 + 8) # float32 vector + int64 id
+        return linked, np.array(vectors, dtype='float32').reshape(len(vectors), dimension)
+
+    def _index_dimension(self) -> int:
+        index = self.vector_store if self.vector_store is not None else self._delta_store
+        return index.d
+
+    def dedup_report(self) -> Dict[str, Any]:
+        """
+        Near-duplicate chunks found at ingest, and what skipping them saved:
+        embedding time (at the embedding rate measured on the last batch) and
+        index space (vector and id bytes; BM25 postings are not counted).
+        """
+        with self._index_lock:
+            counts = dict(self._dedup_counts)
+            linked = sum(len(rows) for rows in self._duplicates.values())
+        counts["duplicate_ratio"] = counts["duplicates"] / counts["chunks_checked"] if counts["chunks_checked"] else 0.0
+        counts["linked_duplicates"] = linked
+        counts["threshold"] = self.near_duplicates.threshold if self.near_duplicates else None
+        return counts
+
+    def _dense_search_params(self, index: faiss.Index) -> Optional[faiss.SearchParameters]:
+        """Search parameters for `index` that skip deleted rows, or None if there are none."""
+        if not self._pending_deletes:
+            return None
+        if self._exclude_selector is None:
+            batch = faiss.IDSelectorBatch(np.fromiter(self._pending_deletes, dtype='int64'))
+            self._exclude_selector = (batch, faiss.IDSelectorNot(batch))
+        return search_parameters(index, self.index_params, self._exclude_selector[1])
+
+    def _filter_selection(self, filters: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        What a search restricted to `filters` needs, cached per index version:
+        'rows' (the number of matching chunks), 'search_ids' (the rows whose
+        vectors and postings are searched), 'substitutes' (canonical row ->
+        matching near-duplicate), a boolean 'mask' over search_ids and the
+        FAISS 'selector' built from it. A matching near-duplicate has no vector
+        of its own, so its canonical row is searched and, if the canonical
+        chunk does not match itself, replaced by the duplicate in the results.
+        Caller holds the index lock.
+        """
+        key = (self.index_version, filter_key(filters))
+        selection = self._filter_selections.get(key)
+        if selection is not None:
+            return selection
+        rows = self.metadata_index.select(filters, self.chunk_store)
+        canonical_of = self.chunk_store.column('duplicate_of')[rows]
+        is_duplicate = canonical_of >= 0
+        search_ids = rows[~is_duplicate]
+        # The oldest matching duplicate stands in for each canonical row
+        canonicals, first = np.unique(canonical_of[is_duplicate], return_index=True)
+        outside = ~np.isin(canonicals, search_ids, assume_unique=True)
+        substitutes = dict(zip(canonicals[outside].tolist(), rows[is_duplicate][first][outside].tolist()))
+        search_ids = np.union1d(search_ids, canonicals[outside])
+
+        mask = np.zeros(len(self.chunk_store), dtype=bool)
+        mask[search_ids] = True
+        bitmap = np.packbits(mask, bitorder='little') # Bit i of the bitmap is row i, as IDSelectorBitmap reads it
+        # IDSelectorBitmap takes the bitmap's size in bytes and rejects ids past it, such as rows added later
+        selection = {"rows": len(rows), "search_ids": search_ids, "substitutes": substitutes, "mask": mask,
+                     "bitmap": bitmap, "selector": faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))}
+        if len(self._filter_selections) >= 64:
+            self._filter_selections = {}
+        self._filter_selections[key] = selection
+        return selection
+
+    def _filtered_search_params(self, index: faiss.Index, selection: Dict[str, Any]) -> faiss.SearchParameters:
+        """
+        Search parameters for `index` that only accept the selection's rows.
+        A selective filter leaves fewer matching neighbours per HNSW step or
+        IVF list, so efSearch/nprobe are raised (up to 8x) to still find top_k.
+        """
+        params = {**DEFAULT_INDEX_PARAMS, **self.index_params}
+        widen = min(8.0, self._num_vectors() / max(len(selection["search_ids"]), 1))
+        if widen > 1:
+            params["hnsw_ef_search"] = int(params["hnsw_ef_search"] * widen)
+            params["ivf_nprobe"] = int(params["ivf_nprobe"] * widen)
+        return search_parameters(index, params, selection["selector"])
+
+    def _dense_search(self, query_embeddings: np.ndarray, k: int,
+                      selection: Optional[Dict[str, Any]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Searches the index (and the delta index in shared mode), merging their
+        hits by distance. With a filter `selection`, only its rows are searched.
+        """
+        hits = [index.search(query_embeddings, k, params=self._dense_search_params(index) if selection is None
+                             else self._filtered_search_params(index, selection))
+                for index in (self.vector_store, self._delta_store) if index is not None and index.ntotal]
+        if len(hits) == 1:
+            return hits[0]
+        distances = np.hstack([d for d, _ in hits])
+        indices = np.hstack([i for _, i in hits])
+        order = np.argsort(distances, axis=1, kind='stable')[:, :k]
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(indices, order, axis=1)
+
+    def _promotion_due(self) -> bool:
+        return (self.index_type != 'flat' and self._num_vectors() >= self.promote_at
+                and (self.vector_store is None or isinstance(unwrap_index(self.vector_store), faiss.IndexFlat)))
+
+    def _maybe_promote_index(self) -> bool:
+        """Swaps the flat index for the configured ANN index once it is large enough."""
+        if self.vector_store is None or not self._promotion_due():
+            return False
+        self.vector_store = promote_index(self.vector_store, self.index_type, self.index_params)
+        self._index_is_mmapped = False
+        return True
+
+    def _checkpoint_if_due(self):
+        """Writes a snapshot when the WAL is long enough or the index was just promoted. Caller holds the index lock."""
+        if self.index_store is None:
+            return
+        if self._shared:
+            if self.index_store.should_checkpoint() or self._promotion_due():
+                self._merge_delta()
+            return
+        promoted = self._maybe_promote_index()
+        # A freshly trained index is checkpointed right away so restarts do not retrain it
+        if promoted or self.index_store.should_checkpoint():
+            self._checkpoint()
+
+    def _checkpoint(self):
+        """
+        Writes a snapshot, then maps its chunk store: chunk text then lives in the
+        page cache rather than the heap. Caller holds the index lock.
+        """
+        self.index_store.checkpoint(self.vector_store, self.chunk_store, self.documents.committed())
+        self.chunk_store = self.index_store.load_chunk_store()
+
+    # --- Shared mode (several processes on one index_dir) ---
+
+    @contextmanager
+    def _write_section(self):
+        """
+        Holds the index lock for a write. In shared mode also holds the store's
+        writer lock and first catches up with what other workers wrote, so rows
+        are appended after theirs.
+        """
+        if not self._shared:
+            with self._index_lock:
+                yield
+            return
+        with self.index_store.writer_lock(), self._index_lock:
+            self._refresh_locked(force=True, truncate=True)
+            yield
+
+    def _reset_state(self):
+        self.vector_store = None
+        self._delta_store = None
+        self.chunk_store = ChunkStore()
+        self._duplicates = {}
+        if self.near_duplicates:
+            self.near_duplicates.clear()
+        self._index_is_mmapped = False
+        self._pending_deletes = set()
+        self._exclude_selector = None
+        self.documents.clear()
+        self.metadata_index.clear()
+        self._filter_selections = {}
+        self.sparse_index.clear()
+
+    def _refresh_locked(self, force: bool = False, truncate: bool = False) -> bool:
+        """
+        Applies the changes other workers made to the shared store: new WAL
+        records, then a newer snapshot if one was published. Caller holds the
+        index lock. Returns True if anything changed.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_refresh < self.refresh_interval_s:
+            return False
+        self._last_refresh = now
+        changed = self._replay_wal(truncate) > 0
+        if self.index_store.refresh_manifest():
+            manifest = self.index_store.manifest
+            if (manifest.get("rows") == len(self.chunk_store)
+                    and manifest.get("deleted") == self.chunk_store.num_deleted):
+                # The new snapshot holds exactly the rows already replayed: just map it and drop the delta
+                self.vector_store = self.index_store.load_index()
+                if manifest.get("chunks_file"):
+                    self.chunk_store = self.index_store.load_chunk_store()
+                self._index_is_mmapped = self.vector_store is not None
+                self._delta_store = None
+                self._pending_deletes = set()
+                if self.vector_store is not None:
+                    set_search_params(self.vector_store, self.index_params)
+                    self._pending_deletes = {int(row) for row in index_ids(self.vector_store)
+                                             if self.chunk_store.is_deleted(row)}
+                self._exclude_selector = None
+            else:
+                # Cleared, or this worker fell behind the checkpoint: reload from the snapshot
+                self._reset_state()
+                self._load_from_disk()
+            self._replay_wal(truncate)
+            changed = True
+        if changed:
+            self.index_version += 1
+        return changed
+
+    def refresh(self, force: bool = True) -> bool:
+        """
+        Picks up documents indexed or deleted by other worker processes sharing
+        the index. Without `force` it runs at most every refresh_interval_s.
+        A no-op unless shared_index is set.
+        """
+        if not self._shared:
+            return False
+        with self._index_lock:
+            return self._refresh_locked(force=force)
+
+    def _merge_delta(self, compact: bool = False) -> int:
+        """
+        Folds the delta index into the snapshot index, promotes it if due and
+        publishes a new snapshot, which is then memory-mapped again. With
+        `compact`, deleted rows are removed first. Caller holds the writer lock
+        and the index lock. Returns the number of vectors removed.
+        """
+        base = self.vector_store
+        if base is not None and self._index_is_mmapped:
+            base = self.index_store.load_writable_index()
+            set_search_params(base, self.index_params)
+        if self._delta_store is not None and self._delta_store.ntotal:
+            vectors, ids = reconstruct_all(self._delta_store), index_ids(self._delta_store)
+            if base is None:
+                base = build_index('flat', vectors, ids=ids)
+            else:
+                base.add_with_ids(vectors, ids)
+        self.vector_store, self._delta_store, self._index_is_mmapped = base, None, False
+        if base is None:
+            return 0
+        self._maybe_promote_index()
+
+        removed = 0
+        if compact and self._pending_deletes:
+            compacting = np.fromiter(self._pending_deletes, dtype='int64')
+            if isinstance(unwrap_index(self.vector_store), faiss.IndexHNSW):
+                stored_ids = index_ids(self.vector_store)
+                live = ~np.isin(stored_ids, compacting)
+                self.vector_store = build_index('hnsw', reconstruct_all(self.vector_store)[live], self.index_params,
+                                                ids=stored_ids[live])
+                removed = int((~live).sum())
+            else:
+                removed = self.vector_store.remove_ids(faiss.IDSelectorBatch(compacting))
+            self.sparse_index.compact()
+            self._pending_deletes = set()
+            self._exclude_selector = None
+
+        self._checkpoint()
+        self.vector_store = self.index_store.load_index()
+        self._index_is_mmapped = True
+        set_search_params(self.vector_store, self.index_params)
+        return removed
 
     def _generate_embeddings(self, texts: List[str]) -> np.ndarray:
-        """Generates embeddings for a list of texts."""
-        print(f"Generating embeddings for {len(texts)} texts...")
-        embeddings = self.model.encode(texts, convert_to_numpy=True)
-        print("Embeddings generated.")
-        return embeddings
+        """Generates embeddings for a list of texts, only running the model on cache misses."""
+        if not self.embedding_cache:
+            print(f"Generating embeddings for {len(texts)} texts...")
+            embeddings = self.model.encode(texts, convert_to_numpy=True)
+            print("Embeddings generated.")
+            return embeddings
+
+        cached = self.embedding_cache.get_many(texts)
+        miss_positions = [i for i, embedding in enumerate(cached) if embedding is None]
+        if miss_positions:
+            print(f"Generating embeddings for {len(miss_positions)} of {len(texts)} texts (rest cached)...")
+            miss_texts = [texts[i] for i in miss_positions]
+            new_embeddings = self.model.encode(miss_texts, convert_to_numpy=True).astype('float32')
+            self.embedding_cache.put_many(miss_texts, new_embeddings)
+            for i, embedding in zip(miss_positions, new_embeddings):
+                cached[i] = embedding
+            print("Embeddings generated.")
 
-    def index_documents(self, chunks: List[Dict[str, Any]]):
+        stats = self.embedding_cache.stats()
+        print(f"Embedding cache: {len(texts) - len(miss_positions)}/{len(texts)} hits "
+              f"(lifetime hit rate {stats['hit_rate']:.1%}, {stats['entries']} entries).")
+        return np.vstack(cached)
+
+    def _embed_queries(self, queries: List[str]) -> np.ndarray:
+        """Embeds queries, reusing the last QUERY_CACHE_SIZE query embeddings of this process."""
+        with self._query_embeddings_lock:
+            cached = [self._query_embeddings.get(query) for query in queries]
+        misses = list(dict.fromkeys(query for query, embedding in zip(queries, cached) if embedding is None))
+        if misses:
+            new_embeddings = dict(zip(misses, self.model.encode(misses, convert_to_numpy=True).astype('float32')))
+            cached = [new_embeddings[query] if embedding is None else embedding
+                      for query, embedding in zip(queries, cached)]
+            with self._query_embeddings_lock:
+                self._query_embeddings.update(new_embeddings)
+                while len(self._query_embeddings) > self.QUERY_CACHE_SIZE:
+                    self._query_embeddings.popitem(last=False)
+        with self._query_embeddings_lock:
+            for query in queries:
+                if query in self._query_embeddings:
+                    self._query_embeddings.move_to_end(query)
+        return np.vstack(cached)
+
+    def embed_query(self, query: str) -> np.ndarray:
+        """Returns the embedding of a single query (see _embed_queries)."""
+        return self._embed_queries([query])[0]
+
+    def index_documents(self, chunks: List[Dict[str, Any]],
+                        progress_callback: Optional[Callable[..., None]] = None,
+                        batch_size: Optional[int] = None) -> Dict[str, int]:
         """
         Indexes a list of document chunks into the FAISS vector store.
         Each chunk should be a dictionary with at least a 'content' key.
+
+        Chunks are embedded and added in batches of `batch_size` (default
+        `index_batch_size`), so large documents become searchable incrementally
+        and the index lock is only held for the FAISS add, never while the model
+        runs. Bulk uploads pass larger batches, which embed more efficiently. `progress_callback`, if
+        given, is called as progress_callback(stage, **counters) after each step.
+        Returns {"chunks": ..., "duplicates": ...}, the near-duplicates being
+        the chunks linked to an existing chunk rather than embedded.
         """
         if not chunks:
             print("No chunks to index.")
-            return
+            return {"chunks": 0, "duplicates": 0}
 
-        # Extract content for embedding
-        texts_to_embed = [chunk['content'] for chunk in chunks]
-        embeddings = self._generate_embeddings(texts_to_embed)
+        duplicates = 0
+        batch_size = batch_size or self.index_batch_size
+        for start in range(0, len(chunks), batch_size):
+            batch = chunks[start:start + batch_size]
 
-        # Initialize FAISS index if not already done
-        if self.vector_store is None:
-            dimension = embeddings.shape[1]
-            # Using IndexFlatL2 for simple Euclidean distance search
-            self.vector_store = faiss.IndexFlatL2(dimension)
-            print(f"Initialized FAISS index with dimension: {dimension}")
+            # Near-duplicates of indexed chunks (or of earlier chunks in the batch) are not embedded
+            with tracer.span('dedup', chunks=len(batch)):
+                links, signatures = self._find_near_duplicates(batch)
+            texts = [chunk['content'] for chunk, link in zip(batch, links) if link is None]
+
+            # Extract content for embedding
+            embeddings = None
+            if texts:
+                embed_start = time.perf_counter()
+                with tracer.span('embed', chunks=len(texts)):
+                    embeddings = self._generate_embeddings(texts)
+                self._embed_seconds_per_chunk = (time.perf_counter() - embed_start) / len(texts)
+            if progress_callback:
+                progress_callback('embedding', chunks_embedded=start + len(batch))
 
-        # Add embeddings to the FAISS index
-        self.vector_store.add(embeddings)
-        print(f"Added {len(embeddings)} embeddings to FAISS index.")
+            with tracer.span('index', chunks=len(batch)), self._write_section():
+                batch, embeddings = self._link_duplicates(batch, links, embeddings)
+                duplicates += len(batch) - len(embeddings)
+                # Log the batch to disk before applying it, so a crash cannot lose or half-apply it
+                if self.index_store:
+                    self.index_store.append(len(self.chunk_store), embeddings, batch)
 
-        # Store the original chunks (or their metadata) corresponding to the embeddings
-        # The index in self.documents_metadata will correspond to the index in FAISS
-        self.documents_metadata.extend(chunks)
-        print(f"Stored metadata for {len(chunks)} chunks. Total indexed chunks: {len(self.documents_metadata)}")
+                # Add embeddings to the FAISS index and store the original chunks alongside them
+                self._add_embeddings(embeddings, batch, signatures)
+                self.index_version += 1
+                self._checkpoint_if_due()
+            if progress_callback:
+                progress_callback('indexing', chunks_indexed=start + len(batch))
 
-    def retrieve_relevant_chunks(self, query: str, top_k: int = 3) -> List[Dict[str, Any]]:
+        print(f"Added {len(chunks) - duplicates} embeddings to FAISS index ({duplicates} near-duplicate chunks linked "
+              f"instead). Total indexed chunks: {len(self.chunk_store)}")
+        return {"chunks": len(chunks), "duplicates": duplicates}
+
+    def retrieve_relevant_chunks(self, query: str, top_k: int = 3, mode: Optional[str] = None,
+                                 filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
         """
         Retrieves the top_k most relevant chunks based on the query.
+        `mode` is 'dense' (embedding similarity), 'sparse' (BM25 over the inverted
+        index) or 'hybrid' (both, merged with reciprocal rank fusion); it defaults
+        to the agent's retrieval_mode. `filters` restricts the search to chunks
+        with matching metadata (see metadata_index.normalize_filters; raises
+        ValueError if they are invalid). When query batching is enabled,
+        concurrent callers are grouped by the query MicroBatcher into one encode
+        call and one FAISS search per distinct filter.
         """
-        if self.vector_store is None or self.vector_store.ntotal == 0:
+        mode = mode or self.retrieval_mode
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode '{mode}'. Expected one of {RETRIEVAL_MODES}.")
+        filters = normalize_filters(filters)
+        self.refresh(force=False)
+        if self._num_vectors() == 0:
             print("Vector store is empty. No documents indexed yet.")
             return []
 
-        # Generate embedding for the query
-        query_embedding = self._generate_embeddings([query])
-        # Reshape for FAISS search (FAISS expects 2D array for queries)
-        query_embedding = np.array([query_embedding[0]])
-
-        # Perform similarity search
-        # D: distances, I: indices of the nearest neighbors
-        distances, indices = self.vector_store.search(query_embedding, top_k)
-
-        relevant_chunks = []
-        for i, idx in enumerate(indices[0]):
-            if idx != -1: # Ensure the index is valid
-                chunk = self.documents_metadata[idx]
-                # You can add the distance to the chunk if needed for debugging/ranking
-                # chunk['distance'] = distances[0][i]
-                relevant_chunks.append(chunk)
-        print(f"Retrieved {len(relevant_chunks)} relevant chunks for query: '{query}'")
+        with tracer.span('search', mode=mode):
+            if self.query_batcher:
+                relevant_chunks = self.query_batcher.submit((query, top_k, mode, filters))
+            else:
+                relevant_chunks = self.retrieve_relevant_chunks_batch([(query, top_k, mode, filters)])[0]
+        filtered = f", filters {filters}" if filters else ""
+        print(f"Retrieved {len(relevant_chunks)} relevant chunks for query: '{query}' ({mode}{filtered})")
         return relevant_chunks
 
+    def _record_latency(self, stage: str, start: float):
+        seconds = time.perf_counter() - start
+        with self._latency_lock:
+            self.latency_samples[stage].append(seconds * 1000)
+        # With query batching this runs on the batcher's thread, outside any trace: histogram only
+        tracer.record_span('query_' + stage[:-len('_ms')], seconds)
+
+    def _sparse_search(self, query: str, depth: int, allowed: Optional[np.ndarray] = None) -> List[int]:
+        start = time.perf_counter()
+        doc_ids = [doc_id for doc_id, _ in self.sparse_index.search(query, depth, allowed)]
+        self._record_latency('sparse_search_ms', start)
+        return doc_ids
+
+    def retrieve_relevant_chunks_batch(self, requests: List[Tuple[str, int, str, Optional[Dict[str, Any]]]]
+                                       ) -> List[List[Dict[str, Any]]]:
+        """
+        Retrieves chunks for several (query, top_k, mode, filters) requests,
+        returning one list per request; filters must already be normalized.
+        All dense queries share a single embedding call, and those with the
+        same filters (usually none) a single FAISS search; BM25 searches run on
+        a thread pool at the same time.
+        """
+        if self._num_vectors() == 0:
+            return [[] for _ in requests]
+
+        keys = [filter_key(filters) for *_, filters in requests]
+        with self._index_lock:
+            selections = {key: self._filter_selection(filters)
+                          for key, (*_, filters) in zip(keys, requests) if key is not None}
+        # Hybrid requests fetch deeper candidate lists so fusion has something to re-rank
+        depths = [top_k if mode != 'hybrid' else max(top_k * 4, 20) for _, top_k, mode, _ in requests]
+        sparse_futures = {
+            row: self._sparse_pool.submit(self._sparse_search, query, depth, selections[key]["mask"] if key else None)
+            for row, ((query, _, mode, _), depth, key) in enumerate(zip(requests, depths, keys)) if mode != 'dense'
+        }
+
+        dense_rows = [row for row, (_, _, mode, _) in enumerate(requests) if mode != 'sparse']
+        dense_ids: Dict[int, List[int]] = {}
+        if dense_rows:
+            # Generate embeddings for the queries (FAISS expects a 2D array of queries)
+            start = time.perf_counter()
+            query_embeddings = self._embed_queries([requests[row][0] for row in dense_rows])
+            self._record_latency('embed_ms', start)
+
+            # Perform one similarity search per distinct filter, for the largest depth requested
+            # D: distances, I: indices of the nearest neighbors
+            start = time.perf_counter()
+            with self._index_lock:
+                if self._num_vectors() == 0: # Cleared while the queries were being embedded
+                    return [[] for _ in requests]
+                for key in dict.fromkeys(keys[row] for row in dense_rows):
+                    group = [i for i, row in enumerate(dense_rows) if keys[row] == key]
+                    selection = selections.get(key)
+                    if selection is not None and not len(selection["search_ids"]):
+                        dense_ids.update((dense_rows[i], []) for i in group) # Nothing matches the filters
+                        continue
+                    distances, indices = self._dense_search(query_embeddings[group],
+                                                            max(depths[dense_rows[i]] for i in group), selection)
+                    for i, hits in zip(group, indices):
+                        row = dense_rows[i]
+                        dense_ids[row] = [int(idx) for idx in hits[:depths[row]] if idx != -1] # Ensure the index is valid
+            self._record_latency('dense_search_ms', start)
+
+        results = []
+        with self._index_lock:
+            for row, (_, top_k, mode, _) in enumerate(requests):
+                if mode == 'dense':
+                    ranked = dense_ids[row]
+                elif mode == 'sparse':
+                    ranked = sparse_futures[row].result()
+                else:
+                    sparse_ids = sparse_futures[row].result()
+                    start = time.perf_counter()
+                    ranked = reciprocal_rank_fusion([dense_ids[row], sparse_ids])
+                    self._record_latency('fusion_ms', start)
+                if keys[row] is not None:
+                    substitutes = selections[keys[row]]["substitutes"]
+                    ranked = [substitutes.get(idx, idx) for idx in ranked]
+                # Rows deleted since the search are dropped
+                chunks = (self.chunk_store[idx] for idx in ranked if idx < len(self.chunk_store))
+                results.append([chunk for chunk in chunks if chunk is not None][:top_k])
+        return results
+
+    def latency_stats(self) -> Dict[str, Dict[str, float]]:
+        """Returns p50/p95 of recent per-stage retrieval latencies (embed, dense, sparse, fusion)."""
+        with self._latency_lock:
+            samples = {stage: list(values) for stage, values in self.latency_samples.items()}
+        return {
+            stage: {
+                "count": len(values),
+                "p50": float(np.percentile(values, 50)) if values else 0.0,
+                "p95": float(np.percentile(values, 95)) if values else 0.0
+            }
+            for stage, values in samples.items()
+        }
+
+    def benchmark_index_types(self, k: int = 3, sample_size: int = 20000, num_queries: int = 200) -> List[Dict[str, Any]]:
+        """
+        Reports recall@k vs. latency of every index type on a sample of the indexed
+        chunks, queried with chunks from the same sample. Embeddings come from the
+        embedding cache when it is enabled, so this does not re-run the model.
+        """
+        live_rows = self.chunk_store.live_rows()
+        if not len(live_rows):
+            print("Vector store is empty. Nothing to benchmark.")
+            return []
+        rng = np.random.default_rng(0)
+        rows = rng.choice(live_rows, min(sample_size, len(live_rows)), replace=False)
+        vectors = self._generate_embeddings([self.chunk_store.content(i) for i in rows])
+        queries = vectors[rng.choice(len(vectors), min(num_queries, len(vectors)), replace=False)]
+        report = benchmark_index_types(vectors, queries, k=k, params=self.index_params)
+        for row in report:
+            print(row)
+        return report
+
+    def benchmark_embedding_backends(self, sample_size: int = 2000, batch_size: int = 32) -> List[Dict[str, Any]]:
+        """
+        Reports embedding throughput of every backend, and its parity with the
+        fp32 model, on a sample of the indexed chunks (see embedding_backends).
+        """
+        live_rows = self.chunk_store.live_rows()
+        if not len(live_rows):
+            print("Vector store is empty. Nothing to benchmark.")
+            return []
+        rng = np.random.default_rng(0)
+        rows = rng.choice(live_rows, min(sample_size, len(live_rows)), replace=False)
+        report = benchmark_embedding_backends([self.chunk_store.content(i) for i in rows],
+                                              model_name=self.model_name, batch_size=batch_size,
+                                              params=self.embedding_params)
+        for row in report:
+            print(row)
+        return report
+
+    def delete_rows(self, rows: List[int]) -> int:
+        """
+        Deletes chunks by row id and returns how many were deleted. The deletion
+        is logged to the WAL and takes effect for searches immediately; the space
+        is reclaimed by compact(), which starts in the background once enough
+        rows are deleted.
+        """
+        with self._write_section():
+            rows = sorted({int(row) for row in rows
+                           if 0 <= row < len(self.chunk_store) and not self.chunk_store.is_deleted(row)})
+            if not rows:
+                return 0
+            if self.index_store:
+                self.index_store.append_delete(rows)
+            self._apply_delete(rows)
+            self.index_version += 1
+            self._checkpoint_if_due()
+        print(f"Deleted {len(rows)} chunks from the index.")
+        self._maybe_start_compaction()
+        return len(rows)
+
+    def commit_document(self, source: str, content_hash: str):
+        """
+        Records that the upload of `source` with `content_hash` is complete: all
+        its chunks are indexed and its previous version is deleted. Logged to the
+        WAL, so only committed uploads are recognised as unchanged after a restart.
+        """
+        with self._write_section():
+            if self.index_store:
+                self.index_store.append_commit(source, content_hash)
+            self.documents.commit(source, content_hash)
+
+    def delete_document(self, source: str) -> int:
+        """Deletes every chunk of a source document; returns the number of chunks deleted."""
+        self.refresh()
+        document = self.documents.get(source)
+        if document is None:
+            return 0
+        return self.delete_rows(document['rows'])
+
+    def _maybe_start_compaction(self):
+        """Starts compact() on a background thread once tombstones reach compact_ratio of the index."""
+        with self._index_lock:
+            if (not self._pending_deletes
+                    or len(self._pending_deletes) < self.compact_ratio * self._num_vectors()
+                    or (self._compaction_thread and self._compaction_thread.is_alive())):
+                return
+            self._compaction_thread = threading.Thread(target=self.compact, name='IndexCompaction', daemon=True)
+            self._compaction_thread.start()
+
+    def compact(self) -> int:
+        """
+        Removes the vectors and postings of deleted rows and writes a fresh
+        snapshot. Flat and IVF indexes drop them in place; HNSW cannot remove
+        vectors, so its graph is rebuilt from the live vectors without holding
+        the index lock, and rows added meanwhile are copied over before the swap.
+        In shared mode compaction happens while folding the delta into a new
+        snapshot, under the writer lock. Returns the number of vectors removed.
+        """
+        if self._shared:
+            with self._write_section():
+                if not self._pending_deletes:
+                    return 0
+                start = time.time()
+                removed = self._merge_delta(compact=True)
+            print(f"Compacted shared FAISS index: removed {removed} deleted vectors in {time.time() - start:.2f}s.")
+            return removed
+
+        with self._index_lock:
+            if self.vector_store is None or not self._pending_deletes:
+                return 0
+            start = time.time()
+            self._ensure_writable_index()
+            compacting = set(self._pending_deletes)
+            selector = faiss.IDSelectorBatch(np.fromiter(compacting, dtype='int64'))
+            rebuild = isinstance(unwrap_index(self.vector_store), faiss.IndexHNSW)
+            if rebuild:
+                old_index = self.vector_store
+                stored_ids = index_ids(old_index)
+                live = ~np.isin(stored_ids, np.fromiter(compacting, dtype='int64'))
+                live_ids = stored_ids[live]
+                live_vectors = reconstruct_all(old_index)[live]
+            else:
+                removed = self.vector_store.remove_ids(selector)
+
+        if rebuild:
+            rebuilt = build_index('hnsw', live_vectors, self.index_params, ids=live_ids)
+            removed = len(stored_ids) - len(live_ids)
+
+        with self._index_lock:
+            if rebuild:
+                if self.vector_store is not old_index: # Cleared or rebuilt while compacting
+                    return 0
+                # Carry over rows indexed while the graph was being rebuilt
+                new_positions = np.arange(len(stored_ids), old_index.ntotal)
+                if len(new_positions):
+                    new_vectors = unwrap_index(old_index).reconstruct_batch(new_positions)
+                    rebuilt.add_with_ids(new_vectors, index_ids(old_index)[len(stored_ids):])
+                self.vector_store = rebuilt
+            self.sparse_index.compact()
+            self._pending_deletes -= compacting
+            self._exclude_selector = None
+            if self.index_store:
+                self._checkpoint()
+        print(f"Compacted FAISS index: removed {removed} deleted vectors in {time.time() - start:.2f}s.")
+        return removed
+
     def clear_index(self):
         """Clears the current FAISS index and stored metadata."""
-        self.vector_store = None
-        self.documents_metadata = []
+        with self._write_section():
+            self._reset_state()
+            self.index_version += 1
+            if self.index_store:
+                self.index_store.clear()
         print("FAISS index and document metadata cleared.")
 
+    def handle_message(self, message: MCPMessage) -> Dict[str, Any]:
+        """Handles INDEX_CHUNKS_REQUEST and RETRIEVE_CONTEXT_REQUEST messages from the MCP message bus."""
+        if message.type == "INDEX_CHUNKS_REQUEST":
+            chunks = message.payload['chunks']
+            report = self.index_documents(chunks, progress_callback=message.payload.get('progress_callback'),
+                                          batch_size=message.payload.get('batch_size'))
+            return {"status": "indexed", "num_chunks": len(chunks), "duplicates": report["duplicates"]}
+        if message.type == "RETRIEVE_CONTEXT_REQUEST":
+            query = message.payload['query']
+            return {"retrieved_context": self.retrieve_relevant_chunks(query, filters=message.payload.get('filters')),
+                    "query": query}
+        raise ValueError(f"RetrievalAgent cannot handle message type {message.type}.")
 
 # Example usage (for testing)
 if __name__ == "__main__":
-    retrieval_agent = RetrievalAgent()
+    retrieval_agent = RetrievalAgent(index_dir=None, cache_dir=None)
 
     # Create some dummy chunks (as if from IngestionAgent)
     dummy_chunks = [
@@ -0,0 +1,111 @@
+# agents/shared_models.py
+
+import importlib
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+DEFAULT_EMBEDDING_MODEL = 'all-MiniLM-L6-v2'
+DEFAULT_GENERATOR_MODEL = 'google/flan-t5-small'
+
+# One instance of each model per process. When models are loaded before a
+# forking server (gunicorn --preload) starts its workers, every worker reuses
+# the parent's instance and its weights are shared copy-on-write.
+_models: Dict[Tuple[str, str], Any] = {}
+_lock = threading.RLock()
+
+# Startup profile: how long each heavy import and model load took, in load order.
+# Heavy libraries (torch, transformers, the document parsers) are only imported
+# through load_module(), on first use, so importing the app stays fast.
+_profile: Dict[str, Dict[str, Any]] = {}
+_process_start = time.time()
+
+
+def record_timing(component: str, kind: str, seconds: float):
+    """Adds a component's load time to the startup profile (the first timing of a component wins)."""
+    _profile.setdefault(component, {"component": component, "kind": kind, "seconds": round(seconds, 4),
+                                    "loaded_at_s": round(time.time() - _process_start, 3)})
+
+
+def load_module(name: str):
+    """Imports `name` on first use and records how long the import took."""
+    module = sys.modules.get(name)
+    if module is not None and name in _profile:
+        return module
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    record_timing(name, "import", time.perf_counter() - start)
+    return module
+
+
+def embedding_kind(backend: str = 'torch') -> str:
+    """The model-cache kind of an embedding backend ('embedding' for torch, e.g. 'embedding-onnx-int8')."""
+    return 'embedding' if backend == 'torch' else f'embedding-{backend}'
+
+
+def get_embedding_model(model_name: str = DEFAULT_EMBEDDING_MODEL, backend: str = 'torch',
+                        params: Optional[Dict[str, Any]] = None):
+    """
+    Returns the process-wide embedding model for `model_name` on `backend`
+    (see embedding_backends), loading it on first use. `params` only applies
+    to the first load.
+    """
+    with _lock:
+        key = (embedding_kind(backend), model_name)
+        if key not in _models:
+            # Imported here because embedding_backends imports this module
+            from agents.embedding_backends import create_embedding_model
+            if backend == 'torch':
+                load_module('sentence_transformers')
+            start = time.perf_counter()
+            _models[key] = create_embedding_model(model_name, backend, _models.get(('embedding', model_name)), params)
+            record_timing(f"{key[0]}:{model_name}", "model", time.perf_counter() - start)
+        return _models[key]
+
+
+def generator_kind(task: str = "text2text-generation", backend: str = 'torch') -> str:
+    """The model-cache kind of a generation backend (the task for torch, e.g. 'text2text-generation-onnx')."""
+    return task if backend == 'torch' else f'{task}-{backend}'
+
+
+def get_text_generator(model_name: str = DEFAULT_GENERATOR_MODEL, task: str = "text2text-generation",
+                       backend: str = 'torch', params: Optional[Dict[str, Any]] = None):
+    """
+    Returns the process-wide Hugging Face pipeline for `model_name` on
+    `backend` (see generation_backends), loading it on first use. `params`
+    only applies to the first load.
+    """
+    with _lock:
+        key = (generator_kind(task, backend), model_name)
+        if key not in _models:
+            # Imported here because generation_backends imports this module
+            from agents.generation_backends import create_text_generator
+            load_module('transformers')
+            start = time.perf_counter()
+            _models[key] = create_text_generator(model_name, backend, task, params)
+            record_timing(f"{key[0]}:{model_name}", "model", time.perf_counter() - start)
+        return _models[key]
+
+
+def is_loaded(kind: str, model_name: str) -> bool:
+    """True if the model (see embedding_kind and generator_kind) is already loaded in this process."""
+    return (kind, model_name) in _models
+
+
+def startup_profile() -> List[Dict[str, Any]]:
+    """Returns the import and model load times recorded so far, in load order."""
+    return list(_profile.values())
+
+
+def preload_models(embedding_model: str = DEFAULT_EMBEDDING_MODEL, generator_model: str = DEFAULT_GENERATOR_MODEL,
+                   embedding_backend: str = 'torch', embedding_params: Optional[Dict[str, Any]] = None,
+                   generation_backend: str = 'torch', generation_params: Optional[Dict[str, Any]] = None):
+    """
+    Loads the models into this process before it forks. Only load weights here:
+    running inference before fork starts torch/OpenMP thread pools, which do
+    not survive fork and can hang the workers.
+    """
+    print(f"Preloading models before fork: {embedding_model}, {generator_model}")
+    get_embedding_model(embedding_model, embedding_backend, embedding_params)
+    get_text_generator(generator_model, backend=generation_backend, params=generation_params)
@@ -0,0 +1,202 @@
+# agents/sparse_index.py
+
+import math
+import re
+import threading
+from array import array
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Keeps identifiers such as part numbers, error codes and SKUs (e.g. "ERR-404", "AB_12.5") whole
+_TOKEN_RE = re.compile(r"[a-z0-9](?:[a-z0-9_\-\.]*[a-z0-9])?")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cases text and splits it into BM25 terms."""
+    return _TOKEN_RE.findall(text.lower())
+
+
+class InvertedIndex:
+    """
+    A compact in-memory inverted index scored with BM25.
+
+    Each term maps to a postings list stored as two typed arrays: document ids
+    (uint32, the FAISS row of the chunk) and term frequencies (uint16), i.e.
+    6 bytes per posting instead of a Python object per (term, chunk) pair.
+    Document lengths are kept in one more uint32 array. Documents must be added
+    with increasing ids, which keeps every postings list sorted; ids may skip
+    values (e.g. rows deleted before a rebuild, or near-duplicate chunks), and a
+    skipped id can be filled in later. remove() hides a document at once, and
+    compact() drops its postings later.
+    """
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._term_ids: Dict[str, int] = {}
+        self._doc_ids: List[array] = []    # Per term: array('I') of document ids
+        self._term_freqs: List[array] = [] # Per term: array('H') of term frequencies
+        self._doc_lengths = array('I')
+        self._deleted = bytearray() # 1 per removed document id, 0 otherwise
+        self._num_deleted = 0
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    @property
+    def num_docs(self) -> int:
+        return len(self._doc_lengths) - self._num_deleted
+
+    def add(self, doc_id: int, text: str):
+        """
+        Indexes one document. `doc_id` must be greater than every id added so far,
+        or an id that was skipped; filling one in inserts into the middle of its
+        postings lists, so it is meant for the occasional late document.
+        """
+        counts: Dict[str, int] = {}
+        terms = tokenize(text)
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        with self._lock:
+            if doc_id < len(self._doc_lengths):
+                self._fill_skipped(doc_id, counts, len(terms))
+                return
+            # Skipped ids become empty, deleted documents
+            gap = doc_id - len(self._doc_lengths)
+            self._doc_lengths.extend([0] * gap)
+            self._deleted.extend(b"\x01" * gap)
+            self._num_deleted += gap
+            for term, count in counts.items():
+                term_id = self._term_ids.get(term)
+                if term_id is None:
+                    term_id = len(self._doc_ids)
+                    self._term_ids[term] = term_id
+                    self._doc_ids.append(array('I'))
+                    self._term_freqs.append(array('H'))
+                self._doc_ids[term_id].append(doc_id)
+                self._term_freqs[term_id].append(min(count, 65535))
+            self._doc_lengths.append(len(terms))
+            self._deleted.append(0)
+            self._total_length += len(terms)
+
+    def _fill_skipped(self, doc_id: int, counts: Dict[str, int], length: int):
+        if not self._deleted[doc_id] or self._doc_lengths[doc_id]:
+            raise ValueError(f"Document id {doc_id} was not skipped; ids must be added in increasing order.")
+        for term, count in counts.items():
+            term_id = self._term_ids.get(term)
+            if term_id is None:
+                term_id = len(self._doc_ids)
+                self._term_ids[term] = term_id
+                self._doc_ids.append(array('I'))
+                self._term_freqs.append(array('H'))
+            position = bisect_left(self._doc_ids[term_id], doc_id)
+            self._doc_ids[term_id].insert(position, doc_id)
+            self._term_freqs[term_id].insert(position, min(count, 65535))
+        self._doc_lengths[doc_id] = length
+        self._deleted[doc_id] = 0
+        self._num_deleted -= 1
+        self._total_length += length
+
+    def remove(self, doc_id: int):
+        """Hides a document from search; its postings stay until compact()."""
+        with self._lock:
+            if doc_id >= len(self._doc_lengths) or self._deleted[doc_id]:
+                return
+            self._deleted[doc_id] = 1
+            self._num_deleted += 1
+            self._total_length -= self._doc_lengths[doc_id]
+            self._doc_lengths[doc_id] = 0
+
+    def compact(self) -> int:
+        """Drops postings of removed documents; returns the number of postings dropped."""
+        with self._lock:
+            if not self._num_deleted:
+                return 0
+            deleted = np.frombuffer(self._deleted, dtype=np.uint8).astype(bool)
+            dropped = 0
+            term_ids: Dict[str, int] = {}
+            doc_ids_lists: List[array] = []
+            term_freqs_lists: List[array] = []
+            for term, term_id in self._term_ids.items():
+                doc_ids = np.frombuffer(self._doc_ids[term_id], dtype=np.uint32)
+                keep = ~deleted[doc_ids]
+                dropped += len(doc_ids) - int(keep.sum())
+                if keep.any():
+                    term_ids[term] = len(doc_ids_lists)
+                    doc_ids_lists.append(array('I', doc_ids[keep].tobytes()))
+                    tfs = np.frombuffer(self._term_freqs[term_id], dtype=np.uint16)
+                    term_freqs_lists.append(array('H', tfs[keep].tobytes()))
+                del doc_ids
+            del deleted
+            self._term_ids = term_ids
+            self._doc_ids = doc_ids_lists
+            self._term_freqs = term_freqs_lists
+            return dropped
+
+    def search(self, query: str, top_k: int, allowed: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """
+        Returns up to top_k (doc_id, BM25 score) pairs, best first. If `allowed`
+        (a boolean mask over doc ids) is given, only documents it marks are ranked.
+        """
+        with self._lock:
+            num_rows = len(self._doc_lengths)
+            num_docs = num_rows - self._num_deleted
+            if num_docs == 0:
+                return []
+            avg_length = max(self._total_length / num_docs, 1e-9)
+            doc_lengths = np.frombuffer(self._doc_lengths, dtype=np.uint32)
+            scores = None
+            for term in set(tokenize(query)):
+                term_id = self._term_ids.get(term)
+                if term_id is None:
+                    continue
+                doc_ids = np.frombuffer(self._doc_ids[term_id], dtype=np.uint32)
+                tfs = np.frombuffer(self._term_freqs[term_id], dtype=np.uint16).astype(np.float32)
+                idf = math.log(1 + (num_docs - len(doc_ids) + 0.5) / (len(doc_ids) + 0.5))
+                norm = self.k1 * (1 - self.b + self.b * doc_lengths[doc_ids] / avg_length)
+                term_scores = idf * tfs * (self.k1 + 1) / (tfs + norm)
+                contribution = np.bincount(doc_ids, weights=term_scores, minlength=num_rows)
+                scores = contribution if scores is None else scores + contribution
+                # Release the numpy views before the lock, so add() can grow the arrays again
+                del doc_ids
+            del doc_lengths
+            if scores is not None and self._num_deleted:
+                scores[np.frombuffer(self._deleted, dtype=np.uint8).astype(bool)] = 0.0
+        if scores is not None and allowed is not None:
+            covered = min(len(allowed), num_rows)
+            scores[:covered][~allowed[:covered]] = 0.0
+            scores[covered:] = 0.0
+        if scores is None:
+            return []
+
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+        ranked = candidates[np.argsort(-scores[candidates])]
+        return [(int(doc_id), float(scores[doc_id])) for doc_id in ranked]
+
+    def clear(self):
+        with self._lock:
+            self._term_ids = {}
+            self._doc_ids = []
+            self._term_freqs = []
+            self._doc_lengths = array('I')
+            self._deleted = bytearray()
+            self._num_deleted = 0
+            self._total_length = 0
+
+    def memory_bytes(self) -> int:
+        """Approximate size of the postings and document-length arrays."""
+        with self._lock:
+            postings = sum(ids.buffer_info()[1] * ids.itemsize + tfs.buffer_info()[1] * tfs.itemsize
+                           for ids, tfs in zip(self._doc_ids, self._term_freqs))
+            return postings + len(self._doc_lengths) * self._doc_lengths.itemsize + len(self._deleted)
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = 60) -> List[int]:
+    """Merges several ranked lists of ids; each id scores sum(1 / (k + rank))."""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused, key=fused.get, reverse=True)
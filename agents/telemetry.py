@@ -0,0 +1,220 @@
+# agents/telemetry.py
+
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds, in seconds (Prometheus convention)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# A metric family: (name, type, help text, [(labels, value), ...])
+MetricFamily = Tuple[str, str, str, List[Tuple[Dict[str, Any], float]]]
+
+
+class Histogram:
+    """Cumulative Prometheus-style histogram of durations (seconds), one series per label value."""
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._series: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label: str, seconds: float):
+        with self._lock:
+            series = self._series.get(label)
+            if series is None:
+                series = self._series[label] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series["counts"][i] += 1
+            series["sum"] += seconds
+            series["count"] += 1
+
+    def samples(self, label_name: str) -> List[Tuple[str, Dict[str, Any], float]]:
+        """Returns (suffix, labels, value) samples: _bucket per bound and +Inf, _sum and _count."""
+        with self._lock:
+            series = {label: {"counts": list(s["counts"]), "sum": s["sum"], "count": s["count"]}
+                      for label, s in self._series.items()}
+        samples = []
+        for label, s in sorted(series.items()):
+            for bound, count in zip(self.buckets, s["counts"]):
+                samples.append(("_bucket", {label_name: label, "le": repr(bound)}, count))
+            samples.append(("_bucket", {label_name: label, "le": "+Inf"}, s["count"]))
+            samples.append(("_sum", {label_name: label}, s["sum"]))
+            samples.append(("_count", {label_name: label}, s["count"]))
+        return samples
+
+
+class Tracer:
+    """
+    Timed spans linked by trace_id, and the stage latency histograms behind /metrics.
+
+    A trace covers one request (an upload, a chat query). trace() opens it on the
+    calling thread; span() and record_span() add timed steps to it. Spans run on
+    other threads (e.g. agent workers of the MessageBus) join the trace either by
+    passing its trace_id or by running inside activate(trace_id). Every span is
+    also counted in the stage histogram, whether or not a trace is open.
+
+    When a trace ends after more than `slow_request_ms`, its span breakdown is
+    logged, kept in memory (the last `max_slow_requests`) and, if
+    `slow_log_path` is set, appended to that file as a JSON line.
+    """
+    def __init__(self, slow_request_ms: float = 2000.0, slow_log_path: Optional[str] = None,
+                 max_slow_requests: int = 100):
+        self.slow_request_ms = slow_request_ms
+        self.slow_log_path = slow_log_path
+        self.stage_latency = Histogram()
+        self.request_latency = Histogram()
+        self._traces: Dict[str, Dict[str, Any]] = {}
+        self._slow_requests: Deque[Dict[str, Any]] = deque(maxlen=max_slow_requests)
+        self._slow_counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def current_trace_id(self) -> Optional[str]:
+        """The trace active on this thread, if any."""
+        return getattr(self._local, 'trace_id', None)
+
+    @contextmanager
+    def activate(self, trace_id: Optional[str]) -> Iterator[None]:
+        """Makes `trace_id` the active trace of this thread for the duration of the block."""
+        previous = self.current_trace_id()
+        self._local.trace_id = trace_id
+        try:
+            yield
+        finally:
+            self._local.trace_id = previous
+
+    @contextmanager
+    def trace(self, operation: str, trace_id: Optional[str] = None, **attributes) -> Iterator[str]:
+        """Opens a trace for one `operation` (e.g. 'chat') and yields its trace_id."""
+        trace_id = trace_id or str(uuid.uuid4())
+        with self._lock:
+            self._traces[trace_id] = {"operation": operation, "trace_id": trace_id, "attributes": attributes,
+                                      "started_at": time.time(), "start": time.perf_counter(), "spans": []}
+        status = "ok"
+        try:
+            with self.activate(trace_id):
+                yield trace_id
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            self._finish(trace_id, status)
+
+    @contextmanager
+    def span(self, name: str, trace_id: Optional[str] = None, **attributes) -> Iterator[None]:
+        """Times the block as a `name` span of `trace_id` (default: this thread's active trace)."""
+        trace_id = trace_id or self.current_trace_id()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_span(name, time.perf_counter() - start, trace_id, **attributes)
+
+    def record_span(self, name: str, seconds: float, trace_id: Optional[str] = None, **attributes):
+        """Records a span that has already been timed (e.g. summed over the steps of a generator)."""
+        self.stage_latency.observe(name, seconds)
+        trace_id = trace_id or self.current_trace_id()
+        if trace_id is None:
+            return
+        end = time.perf_counter()
+        with self._lock:
+            trace = self._traces.get(trace_id)
+            if trace is None: # The trace has already ended
+                return
+            trace["spans"].append({"name": name, "start_ms": round((end - seconds - trace["start"]) * 1000, 2),
+                                   "duration_ms": round(seconds * 1000, 2), "thread": threading.current_thread().name,
+                                   **attributes})
+
+    def _finish(self, trace_id: str, status: str):
+        with self._lock:
+            trace = self._traces.pop(trace_id, None)
+        if trace is None:
+            return
+        seconds = time.perf_counter() - trace["start"]
+        self.request_latency.observe(trace["operation"], seconds)
+        if seconds * 1000 < self.slow_request_ms:
+            return
+
+        breakdown: Dict[str, float] = {}
+        for span in trace["spans"]:
+            breakdown[span["name"]] = round(breakdown.get(span["name"], 0.0) + span["duration_ms"], 2)
+        record = {
+            "operation": trace["operation"],
+            "trace_id": trace_id,
+            "status": status,
+            "started_at": trace["started_at"],
+            "duration_ms": round(seconds * 1000, 2),
+            "attributes": trace["attributes"],
+            "breakdown_ms": dict(sorted(breakdown.items(), key=lambda item: -item[1])),
+            "spans": sorted(trace["spans"], key=lambda span: span["start_ms"])
+        }
+        with self._lock:
+            self._slow_requests.append(record)
+            self._slow_counts[trace["operation"]] = self._slow_counts.get(trace["operation"], 0) + 1
+        line = json.dumps(record, default=str)
+        logger.warning(f"Slow request: {line}")
+        if self.slow_log_path:
+            try:
+                with open(self.slow_log_path, 'a') as f:
+                    f.write(line + "\n")
+            except OSError as e:
+                logger.error(f"Could not write the slow-request log {self.slow_log_path}: {e}")
+
+    def slow_requests(self) -> List[Dict[str, Any]]:
+        """The most recent slow requests with their span breakdown, newest last."""
+        with self._lock:
+            return list(self._slow_requests)
+
+    def metric_families(self) -> List[MetricFamily]:
+        """Stage and request latency histograms and slow-request counts."""
+        with self._lock:
+            slow_counts = dict(self._slow_counts)
+        return [
+            ("rag_stage_duration_seconds", "histogram", "Duration of each pipeline stage (span).",
+             self.stage_latency.samples("stage")),
+            ("rag_request_duration_seconds", "histogram", "End-to-end duration of traced requests.",
+             self.request_latency.samples("operation")),
+            ("rag_slow_requests_total", "counter", "Requests slower than the slow-request threshold.",
+             [({"operation": operation}, count) for operation, count in sorted(slow_counts.items())])
+        ]
+
+
+def _format_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    def escape(value: Any) -> str:
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int): # Includes bools
+        return str(int(value))
+    return repr(float(value))
+
+
+def render_prometheus(families: List[MetricFamily]) -> str:
+    """
+    Renders metric families in the Prometheus text exposition format. Samples
+    are (labels, value), or (suffix, labels, value) for histogram series.
+    """
+    lines = []
+    for name, metric_type, help_text, samples in families:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for sample in samples:
+            suffix, labels, value = sample if len(sample) == 3 else ("", *sample)
+            lines.append(f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# One tracer per process, shared by the coordinator, the agents and the MessageBus
+tracer = Tracer()
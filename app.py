@@ -1,11 +1,26 @@
 # app.py
 
+import time
+_import_start = time.perf_counter()
+
 import os
-from flask import Flask, render_template, request, jsonify
+import json
+import threading
+from functools import partial
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
 from werkzeug.utils import secure_filename
 from agents.agent_coordinator import AgentCoordinator
+from agents.bulk_ingestion import is_archive
+from agents.metadata_index import normalize_filters
+from agents.ingestion_jobs import IngestionJobManager
+from agents.generation_backends import DEFAULT_DECODING, decoding_kwargs
+from agents.shared_models import preload_models, record_timing, startup_profile
+from agents.telemetry import render_prometheus, tracer
 import logging
 
+# Models and document parsers are loaded on first use (or by /warmup), so this is all an import costs
+record_timing('app_imports', 'import', time.perf_counter() - _import_start)
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -13,18 +28,111 @@ app = Flask(__name__)
 
 # Configuration for file uploads
 UPLOAD_FOLDER = 'documents'
+# The FAISS index and chunk metadata are persisted here and reloaded on restart
+INDEX_FOLDER = 'vector_store'
+# Chunk embeddings are cached here by content hash; survives /clear_data and restarts
+EMBEDDING_CACHE_FOLDER = 'embedding_cache'
 ALLOWED_EXTENSIONS = {'pdf', 'pptx', 'csv', 'docx', 'txt', 'md'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 # Increased MAX_CONTENT_LENGTH to 200 MB (200 * 1024 * 1024 bytes)
 # This helps with larger PDF files. Adjust as needed.
 app.config['MAX_CONTENT_LENGTH'] = 200 * 1024 * 1024
 
-# Initialize the AgentCoordinator
-coordinator = AgentCoordinator(documents_dir=UPLOAD_FOLDER)
+# Uploads are ingested in the background by a small, bounded worker pool
+INGESTION_WORKERS = 2
+
+# Several server processes (e.g. gunicorn workers, see gunicorn.conf.py) can serve
+# one index: set RAG_SHARED_INDEX=1 so they share the store and follow each other's writes.
+SHARED_INDEX = os.environ.get('RAG_SHARED_INDEX') == '1'
+# Job progress is written here in shared mode, so /jobs/<id> works on any worker
+JOBS_FOLDER = os.path.join(INDEX_FOLDER, 'jobs')
+# With RAG_PRELOAD_MODELS=1 only the models are loaded at import (before a preloading
+# server forks); each worker then calls init_worker() after fork.
+PRELOAD_MODELS = os.environ.get('RAG_PRELOAD_MODELS') == '1'
+# With RAG_WARMUP_ON_START=1 each worker warms up in the background as soon as it starts;
+# /ready reports 503 until it is done, so traffic is only routed to warm workers.
+WARMUP_ON_START = os.environ.get('RAG_WARMUP_ON_START') == '1'
+
+# Embedding backend: 'torch' (fp32), 'onnx' or 'onnx-int8' (see agents/embedding_backends.py),
+# and the number of CPU threads it may use (0 = library default)
+EMBEDDING_BACKEND = os.environ.get('RAG_EMBEDDING_BACKEND', 'torch')
+EMBEDDING_PARAMS = {"intra_op_threads": int(os.environ.get('RAG_EMBEDDING_THREADS', '0')) or None}
+# Generation backend: 'torch' (fp32), 'torch-int8' or 'onnx' (see agents/generation_backends.py)
+GENERATION_BACKEND = os.environ.get('RAG_GENERATION_BACKEND', 'torch')
+GENERATION_PARAMS = {"intra_op_threads": int(os.environ.get('RAG_GENERATION_THREADS', '0')) or None}
+
+# Chunks at least this similar (Jaccard of word shingles) to an indexed chunk are linked to it
+# instead of being embedded again; RAG_DEDUP_THRESHOLD=0 turns the check off
+DEDUP_THRESHOLD = float(os.environ.get('RAG_DEDUP_THRESHOLD', '0.9')) or None
+
+# /upload_bulk may ingest server-side directories below RAG_BULK_INGEST_ROOT (unset = not allowed),
+# and the archives of one bulk upload may expand to at most RAG_BULK_MAX_EXTRACTED_BYTES
+BULK_INGEST_ROOT = os.environ.get('RAG_BULK_INGEST_ROOT') or None
+BULK_MAX_EXTRACTED_BYTES = int(os.environ.get('RAG_BULK_MAX_EXTRACTED_BYTES', str(5 * 1024 ** 3)))
+
+# Requests slower than RAG_SLOW_REQUEST_MS are logged with their span breakdown
+# (also appended as JSON lines to RAG_SLOW_REQUEST_LOG, if set) and listed by /slow_requests
+tracer.slow_request_ms = float(os.environ.get('RAG_SLOW_REQUEST_MS', '2000'))
+tracer.slow_log_path = os.environ.get('RAG_SLOW_REQUEST_LOG') or None
+
+coordinator = None
+ingestion_jobs = None
+
+def init_worker():
+    """Creates this process's AgentCoordinator and ingestion job pool."""
+    global coordinator, ingestion_jobs
+    start = time.perf_counter()
+    coordinator = AgentCoordinator(documents_dir=UPLOAD_FOLDER, index_dir=INDEX_FOLDER,
+                                   cache_dir=EMBEDDING_CACHE_FOLDER, shared_index=SHARED_INDEX,
+                                   embedding_backend=EMBEDDING_BACKEND, embedding_params=EMBEDDING_PARAMS,
+                                   generation_backend=GENERATION_BACKEND, generation_params=GENERATION_PARAMS,
+                                   dedup_threshold=DEDUP_THRESHOLD, max_extracted_bytes=BULK_MAX_EXTRACTED_BYTES)
+    # Uploaded archives are only needed until their documents are extracted
+    ingestion_jobs = IngestionJobManager(coordinator.handle_document_upload, max_workers=INGESTION_WORKERS,
+                                         state_dir=JOBS_FOLDER if SHARED_INDEX else None,
+                                         bulk_ingest_fn=partial(coordinator.handle_bulk_upload, delete_archives=True))
+    record_timing('agents', 'init', time.perf_counter() - start)
+    logging.info(f"Startup profile: {json.dumps(startup_profile())}")
+    if WARMUP_ON_START:
+        threading.Thread(target=coordinator.warmup, name='Warmup', daemon=True).start()
+
+_init_lock = threading.Lock()
+
+def ensure_worker():
+    """Creates this process's agents on first use, unless init_worker() already ran."""
+    with _init_lock:
+        if coordinator is None:
+            init_worker()
+
+# Agents are never created at import: the ingestion process pool uses 'spawn', whose
+# children re-import the main module (as __mp_main__), and a coordinator built there
+# would replay and truncate the write-ahead log under the serving process. They are
+# created by the __main__ block below, gunicorn's post_fork, or the first request.
+if PRELOAD_MODELS and __name__ != '__mp_main__':
+    # Threads (the message bus, batchers, thread pools) do not survive fork, so agents are created per worker
+    preload_models(embedding_backend=EMBEDDING_BACKEND, embedding_params=EMBEDDING_PARAMS,
+                   generation_backend=GENERATION_BACKEND, generation_params=GENERATION_PARAMS)
+
+@app.before_request
+def _ensure_worker():
+    if coordinator is None:
+        ensure_worker()
 
 # Ensure the upload folder exists
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+def invalid_decoding(decoding):
+    """Returns an error message if a request's decoding settings (keys or values) are unusable, else None."""
+    if decoding is None:
+        return None
+    if not isinstance(decoding, dict):
+        return "decoding must be an object"
+    try:
+        decoding_kwargs(DEFAULT_DECODING, decoding)
+    except ValueError as e:
+        return str(e)
+    return None
+
 def allowed_file(filename):
     """Checks if the uploaded file's extension is allowed."""
     return '.' in filename and \
@@ -35,9 +143,51 @@ def index():
     """Renders the main chatbot interface."""
     return render_template('index.html')
 
+@app.route('/warmup', methods=['POST'])
+def warmup():
+    """Loads the document parsers and models now, so the first real request is not slow."""
+    try:
+        timings = coordinator.warmup()
+        return jsonify({"status": "success", "warmup_seconds": timings, **coordinator.readiness()}), 200
+    except Exception as e:
+        logging.error(f"Error during warm-up: {e}", exc_info=True)
+        return jsonify({"status": "error", "message": f"Error during warm-up: {str(e)}"}), 500
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """
+    Readiness probe: 200 once both models are loaded, 503 before. Lists which
+    components are loaded and the startup profile (import and load times).
+    """
+    readiness = coordinator.readiness()
+    readiness["startup_profile"] = startup_profile()
+    return jsonify(readiness), (200 if readiness["ready"] else 503)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Prometheus metrics of this process: stage and request latency histograms,
+    index size, queue depths, cache hit rates, model load state and times.
+    """
+    families = tracer.metric_families() + coordinator.metric_families()
+    families.append(("rag_ingestion_jobs", "gauge", "Ingestion jobs known to this process, by status.",
+                     [({"status": status}, count) for status, count in ingestion_jobs.status_counts().items()]))
+    families.append(("rag_startup_seconds", "gauge", "Import and model load times (see /ready).",
+                     [({"component": entry["component"], "kind": entry["kind"]}, entry["seconds"])
+                      for entry in startup_profile()]))
+    return Response(render_prometheus(families), mimetype='text/plain; version=0.0.4')
+
+@app.route('/slow_requests', methods=['GET'])
+def slow_requests():
+    """Lists the most recent slow requests with the time each of their spans took."""
+    return jsonify({"threshold_ms": tracer.slow_request_ms, "requests": tracer.slow_requests()}), 200
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    """Handles document uploads."""
+    """
+    Handles document uploads. The file is saved and queued for ingestion;
+    the response carries a job id whose progress is reported by /jobs/<job_id>.
+    """
     if 'file' not in request.files:
         logging.warning("No file part in upload request.")
         return jsonify({"status": "error", "message": "No file part"}), 400
@@ -54,9 +204,13 @@ def upload_file():
         try:
             file.save(file_path)
             logging.info(f"File saved: {file_path}")
-            # Process the document using the coordinator
-            result = coordinator.handle_document_upload(file_path)
-            return jsonify(result), 200
+            # Queue the document for processing by the coordinator
+            job_id = ingestion_jobs.submit(file_path)
+            return jsonify({"status": "accepted", "job_id": job_id,
+                            "message": f"Document '{filename}' uploaded and queued for processing."}), 202
+        except RuntimeError as e:
+            logging.warning(f"Ingestion queue full, rejecting {filename}: {e}")
+            return jsonify({"status": "error", "message": str(e)}), 503
         except Exception as e:
             # Log the full traceback for debugging server-side errors
             logging.error(f"Error during file upload or processing for {filename}: {e}", exc_info=True)
@@ -66,24 +220,153 @@ def upload_file():
         logging.warning(f"Invalid file type uploaded: {file.filename}")
         return jsonify({"status": "error", "message": "Invalid file type"}), 400
 
+def bulk_directory(directory):
+    """Resolves a server-side directory for bulk ingestion; returns (path, error message)."""
+    if not BULK_INGEST_ROOT:
+        return None, "Directory ingestion is disabled (set RAG_BULK_INGEST_ROOT)."
+    root = os.path.realpath(BULK_INGEST_ROOT)
+    path = os.path.realpath(os.path.join(root, directory))
+    if os.path.commonpath([root, path]) != root or not os.path.isdir(path):
+        return None, f"Not a directory below the bulk ingestion root: {directory}"
+    return path, None
+
+@app.route('/upload_bulk', methods=['POST'])
+def upload_bulk():
+    """
+    Handles bulk uploads: any number of documents and zip/tar archives as
+    'file' parts, or a "directory" (form field or JSON) below
+    RAG_BULK_INGEST_ROOT to read on the server. Everything is ingested as one
+    job; when it finishes, /jobs/<job_id> lists the outcome of every file and
+    the overall throughput.
+    """
+    data = request.get_json(silent=True) or request.form
+    directory = data.get('directory')
+    if directory:
+        path, error = bulk_directory(directory)
+        if error:
+            logging.warning(f"Rejected bulk directory {directory}: {error}")
+            return jsonify({"status": "error", "message": error}), 400
+        paths, name = [path], os.path.basename(path) or path
+    else:
+        files = [file for file in request.files.getlist('file') if file.filename]
+        if not files:
+            logging.warning("No files or directory in bulk upload request.")
+            return jsonify({"status": "error", "message": "No files or directory given"}), 400
+        invalid = [file.filename for file in files if not (allowed_file(file.filename) or is_archive(file.filename))]
+        if invalid:
+            logging.warning(f"Invalid file types in bulk upload: {invalid}")
+            return jsonify({"status": "error", "message": f"Invalid file type: {', '.join(invalid)}"}), 400
+        paths = []
+        for file in files:
+            file_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(file.filename))
+            file.save(file_path)
+            paths.append(file_path)
+        name = os.path.basename(paths[0]) if len(paths) == 1 else f"{len(paths)} files"
+
+    try:
+        job_id = ingestion_jobs.submit_bulk(paths, name)
+    except RuntimeError as e:
+        logging.warning(f"Ingestion queue full, rejecting bulk upload {name}: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 503
+    logging.info(f"Bulk upload {name} queued as job {job_id}")
+    return jsonify({"status": "accepted", "job_id": job_id,
+                    "message": f"Bulk upload '{name}' queued for processing."}), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Reports the stage, chunk counts and throughput of an ingestion job."""
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": f"Unknown job id: {job_id}"}), 404
+    return jsonify(job), 200
+
 @app.route('/chat', methods=['POST'])
 def chat():
-    """Handles user chat queries."""
+    """
+    Handles user chat queries. An optional "decoding" object overrides the
+    LLM's decoding settings (max_new_tokens, num_beams, do_sample, ...), and an
+    optional "filters" object restricts retrieval by source, file_type,
+    uploaded_after/uploaded_before and pages (see agents/metadata_index.py).
+    """
     data = request.get_json()
     user_query = data.get('query')
+    decoding = data.get('decoding')
 
     if not user_query:
         logging.warning("No query provided in chat request.")
         return jsonify({"status": "error", "message": "No query provided"}), 400
+    decoding_error = invalid_decoding(decoding)
+    if decoding_error:
+        return jsonify({"status": "error", "message": decoding_error}), 400
+    try:
+        filters = normalize_filters(data.get('filters'))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
 
     logging.info(f"Received chat query: {user_query}")
     try:
-        response = coordinator.handle_chat_query(user_query)
+        response = coordinator.handle_chat_query(user_query, decoding, filters)
         return jsonify(response), 200
     except Exception as e:
         logging.error(f"Error during chat query processing for query '{user_query}': {e}", exc_info=True)
         return jsonify({"status": "error", "message": f"Error processing query: {str(e)}. Please check server logs for details."}), 500
 
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Streams the answer to a chat query as Server-Sent Events: one 'token' event
+    per decoded piece of text, then a 'done' event with the full answer,
+    source_context, time_to_first_token_ms and total_latency_ms. Takes the
+    same optional "decoding" and "filters" objects as /chat.
+    """
+    data = request.get_json()
+    user_query = data.get('query')
+    decoding = data.get('decoding')
+
+    if not user_query:
+        logging.warning("No query provided in streaming chat request.")
+        return jsonify({"status": "error", "message": "No query provided"}), 400
+    decoding_error = invalid_decoding(decoding)
+    if decoding_error:
+        return jsonify({"status": "error", "message": decoding_error}), 400
+    try:
+        filters = normalize_filters(data.get('filters'))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    logging.info(f"Received streaming chat query: {user_query}")
+
+    def event_stream():
+        try:
+            for event in coordinator.handle_chat_query_stream(user_query, decoding, filters):
+                if event["event"] == "done" and "time_to_first_token_ms" in event:
+                    logging.info(f"Streamed answer: time to first token {event['time_to_first_token_ms']} ms, "
+                                 f"total {event['total_latency_ms']} ms")
+                yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+        except Exception as e:
+            logging.error(f"Error during streaming chat for query '{user_query}': {e}", exc_info=True)
+            error = {"event": "error", "message": f"Error processing query: {str(e)}. Please check server logs for details."}
+            yield f"event: error\ndata: {json.dumps(error)}\n\n"
+
+    # Disable proxy buffering so tokens reach the browser as soon as they are sent
+    return Response(stream_with_context(event_stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/documents', methods=['GET'])
+def list_documents():
+    """Lists the indexed documents with their content hash and chunk count."""
+    return jsonify({"documents": coordinator.list_documents()}), 200
+
+@app.route('/documents/<filename>', methods=['DELETE'])
+def delete_document(filename):
+    """Removes one document from the index without touching the others."""
+    try:
+        result = coordinator.delete_document(secure_filename(filename))
+        return jsonify(result), (200 if result['status'] == 'success' else 404)
+    except Exception as e:
+        logging.error(f"Error deleting document {filename}: {e}", exc_info=True)
+        return jsonify({"status": "error", "message": f"Error deleting document: {str(e)}"}), 500
+
 @app.route('/clear_data', methods=['POST'])
 def clear_data():
     """Clears all indexed data and uploaded documents."""
@@ -96,6 +379,7 @@ def clear_data():
         return jsonify({"status": "error", "message": f"Error clearing data: {str(e)}"}), 500
 
 if __name__ == '__main__':
+    ensure_worker()
     # Run the Flask app
     # In a production environment, use a more robust WSGI server like Gunicorn
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,395 @@
+# benchmarks/load_test.py
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.synthetic_corpus import CORPUS_FORMATS, generate_corpus
+
+STAGES = ('parse', 'chunk', 'embed', 'index', 'search', 'generate')
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far (ru_maxrss is KB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+
+
+def latency_summary(values: List[float]) -> Dict[str, float]:
+    """Count, mean and p50/p95/p99 of a list of millisecond samples."""
+    if not values:
+        return {"count": 0, "mean_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0}
+    return {
+        "count": len(values),
+        "mean_ms": round(float(np.mean(values)), 2),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2)
+    }
+
+
+class StageRecorder:
+    """
+    Collects per-stage latency samples (ms) by wrapping agent methods of a
+    live AgentCoordinator, so the agents themselves need no benchmark code.
+
+    - parse / chunk: per document. Parsing is the time spent pulling text out of
+      the file; chunking is the rest of the chunk generator's time.
+    - embed / index: per indexed batch. Embedding is the model call; indexing is
+      the rest of index_documents (WAL append, FAISS and BM25 add, checkpoint).
+    - search / generate: per chat query, as the coordinator waits for them
+      (including MessageBus and micro-batcher queueing).
+    """
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def record(self, stage: str, ms: float):
+        with self._lock:
+            self.samples[stage].append(ms)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {stage: latency_summary(values) for stage, values in self.samples.items()}
+
+    def instrument(self, coordinator):
+        """Wraps the coordinator's agent methods to record stage timings."""
+        ingestion, retrieval, llm = coordinator.ingestion_agent, coordinator.retrieval_agent, coordinator.llm_response_agent
+        recorder = self
+
+        iter_chunks_from_pieces = ingestion._iter_chunks_from_pieces
+        def timed_chunks(pieces, source_file):
+            parse_s = [0.0]
+            def timed_pieces():
+                iterator = iter(pieces)
+                while True:
+                    start = time.perf_counter()
+                    try:
+                        piece = next(iterator)
+                    except StopIteration:
+                        parse_s[0] += time.perf_counter() - start
+                        return
+                    parse_s[0] += time.perf_counter() - start
+                    yield piece
+            total_s = 0.0
+            chunks = iter_chunks_from_pieces(timed_pieces(), source_file)
+            while True:
+                start = time.perf_counter()
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    total_s += time.perf_counter() - start
+                    break
+                total_s += time.perf_counter() - start
+                yield chunk
+            recorder.record('parse', parse_s[0] * 1000)
+            recorder.record('chunk', (total_s - parse_s[0]) * 1000)
+        ingestion._iter_chunks_from_pieces = timed_chunks
+
+        generate_embeddings = retrieval._generate_embeddings
+        def timed_embeddings(texts):
+            start = time.perf_counter()
+            try:
+                return generate_embeddings(texts)
+            finally:
+                if getattr(recorder._local, 'indexing', False):
+                    elapsed_ms = (time.perf_counter() - start) * 1000
+                    recorder._local.embed_ms += elapsed_ms
+                    recorder.record('embed', elapsed_ms)
+        retrieval._generate_embeddings = timed_embeddings
+
+        index_documents = retrieval.index_documents
+        def timed_index(chunks, progress_callback=None):
+            recorder._local.indexing, recorder._local.embed_ms = True, 0.0
+            start = time.perf_counter()
+            try:
+                return index_documents(chunks, progress_callback)
+            finally:
+                recorder._local.indexing = False
+                recorder.record('index', (time.perf_counter() - start) * 1000 - recorder._local.embed_ms)
+        retrieval.index_documents = timed_index
+
+        coordinator._retrieve_context = self._timed('search', coordinator._retrieve_context)
+        llm.generate_response = self._timed('generate', llm.generate_response)
+
+    def _timed(self, stage: str, fn: Callable) -> Callable:
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.record(stage, (time.perf_counter() - start) * 1000)
+        return wrapper
+
+
+class CoordinatorClient:
+    """Drives an in-process AgentCoordinator directly."""
+    def __init__(self, coordinator):
+        self.coordinator = coordinator
+
+    def warmup(self) -> Dict[str, Any]:
+        return self.coordinator.warmup()
+
+    def upload(self, file_path: str) -> Dict[str, Any]:
+        return self.coordinator.handle_document_upload(file_path)
+
+    def chat(self, query: str) -> Dict[str, Any]:
+        return self.coordinator.handle_chat_query(query)
+
+
+class FlaskClient:
+    """
+    Drives the Flask app through its test client: POST /upload then polls
+    /jobs/<id> until the job finishes, and POST /chat. This exercises request
+    parsing, the background ingestion pool and JSON encoding as well.
+    """
+    def __init__(self, app_module, poll_interval_s: float = 0.02):
+        self.app_module = app_module
+        self.client = app_module.app.test_client()
+        self.poll_interval_s = poll_interval_s
+
+    @property
+    def coordinator(self):
+        return self.app_module.coordinator
+
+    def warmup(self) -> Dict[str, Any]:
+        return self.client.post('/warmup').get_json()['warmup_seconds']
+
+    def upload(self, file_path: str) -> Dict[str, Any]:
+        with open(file_path, 'rb') as f:
+            response = self.client.post('/upload', data={'file': (f, os.path.basename(file_path))},
+                                        content_type='multipart/form-data')
+        body = response.get_json()
+        if response.status_code != 202:
+            return {"status": "error", "message": body.get('message')}
+        while True:
+            job = self.client.get(f"/jobs/{body['job_id']}").get_json()
+            if job['status'] in ('succeeded', 'failed'):
+                return {"status": "success" if job['status'] == 'succeeded' else "error", "message": job.get('message')}
+            time.sleep(self.poll_interval_s)
+
+    def chat(self, query: str) -> Dict[str, Any]:
+        response = self.client.post('/chat', json={"query": query})
+        return response.get_json()
+
+
+def _run_concurrently(fn: Callable[[Any], Dict[str, Any]], items: List[Any], concurrency: int) -> Dict[str, Any]:
+    """Calls fn on every item with `concurrency` callers; returns per-call latencies, errors and wall time."""
+    latencies: List[float] = []
+    results: List[Dict[str, Any]] = []
+    lock = threading.Lock()
+
+    def call(item):
+        start = time.perf_counter()
+        try:
+            result = fn(item)
+        except Exception as e:
+            result = {"status": "error", "message": str(e)}
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with lock:
+            latencies.append(elapsed_ms)
+            results.append(result)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(call, items))
+    return {"seconds": time.perf_counter() - start, "latencies": latencies, "results": results}
+
+
+def run_benchmark(target: str = 'coordinator', num_documents: int = 24, formats=CORPUS_FORMATS,
+                  words_per_document: int = 2000, num_queries: int = 50, upload_concurrency: int = 4,
+                  chat_concurrency: int = 8, seed: int = 0, work_dir: Optional[str] = None,
+                  embedding_cache: bool = False, embedding_backend: str = 'torch',
+                  generation_backend: str = 'torch') -> Dict[str, Any]:
+    """
+    Generates a synthetic corpus, uploads it, then asks `num_queries` questions
+    about it, through an in-process AgentCoordinator (target='coordinator') or
+    the Flask endpoints (target='flask'). Everything runs in `work_dir` (a
+    temporary directory by default), so the real index is never touched.
+
+    Models are warmed up before anything is timed. The embedding cache is off
+    by default so every run embeds every chunk; the answer cache stays on, and
+    its hits are reported. Returns the report written by main() as JSON.
+    """
+    config = {key: value for key, value in locals().items() if key != 'work_dir'}
+    config['formats'] = list(formats)
+    own_work_dir = work_dir is None
+    work_dir = os.path.abspath(work_dir or tempfile.mkdtemp(prefix='rag_benchmark_'))
+    os.makedirs(work_dir, exist_ok=True)
+    previous_cwd = os.getcwd()
+    try:
+        corpus = generate_corpus(os.path.join(work_dir, 'corpus'), num_documents, formats, words_per_document, seed=seed)
+        queries = [q['query'] for q in corpus['queries']]
+        queries = (queries * (num_queries // max(1, len(queries)) + 1))[:num_queries]
+
+        if target == 'flask':
+            # app.py keeps its documents, index and caches relative to the working directory
+            os.chdir(work_dir)
+            os.environ['RAG_EMBEDDING_BACKEND'] = embedding_backend
+            os.environ['RAG_GENERATION_BACKEND'] = generation_backend
+            import app as app_module
+            app_module.ensure_worker()
+            if not embedding_cache:
+                app_module.coordinator.retrieval_agent.embedding_cache = None
+            client = FlaskClient(app_module)
+        elif target == 'coordinator':
+            from agents.agent_coordinator import AgentCoordinator
+            client = CoordinatorClient(AgentCoordinator(
+                documents_dir=os.path.join(work_dir, 'documents'), index_dir=os.path.join(work_dir, 'vector_store'),
+                cache_dir=os.path.join(work_dir, 'embedding_cache') if embedding_cache else None,
+                embedding_backend=embedding_backend, generation_backend=generation_backend))
+        else:
+            raise ValueError(f"Unknown benchmark target '{target}'. Expected 'coordinator' or 'flask'.")
+
+        recorder = StageRecorder()
+        recorder.instrument(client.coordinator)
+
+        start = time.perf_counter()
+        warmup = client.warmup()
+        warmup_seconds = round(time.perf_counter() - start, 3)
+        rss_after_warmup = peak_rss_mb()
+
+        print(f"Benchmark: uploading {len(corpus['files'])} documents with concurrency {upload_concurrency}...")
+        chunks_before = len(client.coordinator.retrieval_agent.chunk_store)
+        uploads = _run_concurrently(client.upload, corpus['files'], upload_concurrency)
+        chunks_indexed = len(client.coordinator.retrieval_agent.chunk_store) - chunks_before
+        rss_after_ingest = peak_rss_mb()
+
+        print(f"Benchmark: asking {len(queries)} questions with concurrency {chat_concurrency}...")
+        chats = _run_concurrently(client.chat, queries, chat_concurrency)
+
+        ingest_seconds, chat_seconds = uploads['seconds'], chats['seconds']
+        return {
+            "config": config,
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count()
+            },
+            "corpus": {"documents": len(corpus['files']), "bytes": corpus['bytes'], "queries": len(queries)},
+            "warmup": {"seconds": warmup_seconds, "steps": warmup},
+            "ingest": {
+                "seconds": round(ingest_seconds, 3),
+                "errors": sum(1 for r in uploads['results'] if r.get('status') != 'success'),
+                "chunks_indexed": chunks_indexed,
+                "documents_per_second": round(len(corpus['files']) / ingest_seconds, 2) if ingest_seconds else 0.0,
+                "chunks_per_second": round(chunks_indexed / ingest_seconds, 1) if ingest_seconds else 0.0,
+                "mb_per_second": round(corpus['bytes'] / (1024 * 1024) / ingest_seconds, 3) if ingest_seconds else 0.0,
+                "upload_latency": latency_summary(uploads['latencies'])
+            },
+            "chat": {
+                "seconds": round(chat_seconds, 3),
+                "errors": sum(1 for r in chats['results'] if r.get('status') == 'error'),
+                "answer_cache_hits": sum(1 for r in chats['results'] if r.get('cache')),
+                "queries_per_second": round(len(queries) / chat_seconds, 2) if chat_seconds else 0.0,
+                "query_latency": latency_summary(chats['latencies'])
+            },
+            "stages": recorder.summary(),
+            "generation_batching": client.coordinator.llm_response_agent.batching_stats(),
+            "deduplication": client.coordinator.retrieval_agent.dedup_report(),
+            "memory": {
+                "peak_rss_mb_after_warmup": rss_after_warmup,
+                "peak_rss_mb_after_ingest": rss_after_ingest,
+                "peak_rss_mb": peak_rss_mb()
+            }
+        }
+    finally:
+        os.chdir(previous_cwd)
+        if own_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+# Throughputs are higher-is-better; everything else compared is a latency
+COMPARED_METRICS = [("ingest", "documents_per_second"), ("ingest", "chunks_per_second"),
+                    ("chat", "queries_per_second"), ("ingest", "upload_latency", "p95_ms"),
+                    ("chat", "query_latency", "p95_ms")] + \
+                   [("stages", stage, percentile) for stage in STAGES for percentile in ("p50_ms", "p95_ms", "p99_ms")] + \
+                   [("memory", "peak_rss_mb")]
+
+
+def compare_reports(baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float = 0.10) -> List[Dict[str, Any]]:
+    """
+    Compares two reports metric by metric. A metric regresses when it is worse
+    than the baseline by more than `tolerance` (0.10 = 10%). Metrics missing
+    or zero in the baseline are skipped.
+    """
+    rows = []
+    for path in COMPARED_METRICS:
+        old, new = baseline, current
+        for key in path:
+            old, new = (old or {}).get(key), (new or {}).get(key)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        higher_is_better = path[-1].endswith('per_second')
+        rows.append({"metric": ".".join(path), "baseline": old, "current": new, "change": round(change, 3),
+                     "regression": (change < -tolerance) if higher_is_better else (change > tolerance)})
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline load test of the upload and chat paths.")
+    parser.add_argument('--target', choices=('coordinator', 'flask'), default='coordinator')
+    parser.add_argument('--documents', type=int, default=24, help="Number of synthetic documents")
+    parser.add_argument('--formats', default=",".join(CORPUS_FORMATS), help="Comma-separated file formats")
+    parser.add_argument('--words', type=int, default=2000, help="Words per document")
+    parser.add_argument('--queries', type=int, default=50, help="Number of chat queries")
+    parser.add_argument('--upload-concurrency', type=int, default=4)
+    parser.add_argument('--chat-concurrency', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--work-dir', help="Keep the corpus, index and caches here instead of a temporary directory")
+    parser.add_argument('--embedding-cache', action='store_true', help="Keep the embedding cache on")
+    parser.add_argument('--embedding-backend', default='torch')
+    parser.add_argument('--generation-backend', default='torch')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help="Baseline report to check this run against for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="Allowed relative slowdown (0.10 = 10%%)")
+    args = parser.parse_args(argv)
+
+    # Models must already be in the local Hugging Face cache; never reach for the network
+    os.environ.setdefault('HF_HUB_OFFLINE', '1')
+    os.environ.setdefault('TRANSFORMERS_OFFLINE', '1')
+
+    report = run_benchmark(target=args.target, num_documents=args.documents, formats=args.formats.split(','),
+                           words_per_document=args.words, num_queries=args.queries,
+                           upload_concurrency=args.upload_concurrency, chat_concurrency=args.chat_concurrency,
+                           seed=args.seed, work_dir=args.work_dir, embedding_cache=args.embedding_cache,
+                           embedding_backend=args.embedding_backend, generation_backend=args.generation_backend)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Benchmark: report written to {args.output}")
+    print(json.dumps({"ingest": report["ingest"], "chat": report["chat"], "memory": report["memory"]}, indent=2))
+    for stage, summary in report["stages"].items():
+        print(f"  {stage:>8}: n={summary['count']:<5} p50={summary['p50_ms']:>9.1f} ms  "
+              f"p95={summary['p95_ms']:>9.1f} ms  p99={summary['p99_ms']:>9.1f} ms")
+
+    if args.compare:
+        with open(args.compare) as f:
+            rows = compare_reports(json.load(f), report, args.tolerance)
+        regressions = [row for row in rows if row["regression"]]
+        for row in rows:
+            flag = "REGRESSION" if row["regression"] else ""
+            print(f"  {row['metric']:<40} {row['baseline']:>10} -> {row['current']:>10} ({row['change']:+.1%}) {flag}")
+        print(f"Benchmark: {len(regressions)} regression(s) against {args.compare}.")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+# benchmarks/synthetic_corpus.py
+
+import csv
+import os
+import random
+from typing import Any, Dict, List, Sequence
+
+from agents.shared_models import load_module
+
+CORPUS_FORMATS = ('txt', 'md', 'csv', 'docx', 'pptx', 'pdf')
+
+PRODUCTS = ['Atlas', 'Beacon', 'Cobalt', 'Delta', 'Ember', 'Falcon', 'Granite', 'Harbor', 'Ion', 'Juniper']
+METRICS = ['revenue growth', 'churn rate', 'support tickets', 'active users', 'gross margin', 'latency budget']
+QUARTERS = ['Q1', 'Q2', 'Q3', 'Q4']
+FILLER_WORDS = ('the team reviewed roadmap customer feedback release planning migration dashboard report '
+                'incident budget forecast hiring onboarding contract renewal pipeline review quality audit '
+                'partner integration pricing experiment survey backlog sprint milestone risk').split()
+
+
+def _fact(rng: random.Random) -> Dict[str, str]:
+    return {"product": rng.choice(PRODUCTS), "metric": rng.choice(METRICS),
+            "quarter": rng.choice(QUARTERS), "value": f"{rng.randint(1, 99)}%"}
+
+
+def _fact_sentence(fact: Dict[str, str]) -> str:
+    return f"The {fact['product']} team reported {fact['metric']} of {fact['value']} in {fact['quarter']}."
+
+
+def _filler_sentence(rng: random.Random) -> str:
+    words = rng.choices(FILLER_WORDS, k=rng.randint(8, 20))
+    return " ".join(words).capitalize() + "."
+
+
+def _paragraphs(rng: random.Random, num_words: int, facts: List[Dict[str, str]]) -> List[str]:
+    """Filler paragraphs of about `num_words` words, with the fact sentences spread through them."""
+    sentences, words = [], 0
+    while words < num_words:
+        sentence = _filler_sentence(rng)
+        sentences.append(sentence)
+        words += len(sentence.split())
+    for fact in facts:
+        sentences.insert(rng.randint(0, len(sentences)), _fact_sentence(fact))
+    return [" ".join(sentences[i:i + 6]) for i in range(0, len(sentences), 6)]
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def _write_pdf(path: str, paragraphs: List[str], lines_per_page: int = 50, chars_per_line: int = 90):
+    """Writes a minimal text-only PDF (Helvetica, one content stream per page) without a PDF library."""
+    lines: List[str] = []
+    for paragraph in paragraphs:
+        line = ""
+        for word in paragraph.split():
+            if len(line) + len(word) + 1 > chars_per_line:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}" if line else word
+        lines.extend([line, ""])
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[""]]
+
+    # Objects: 1 catalog, 2 page tree, 3 font, then a (page, content stream) pair per page
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for page_lines in pages:
+        stream = "BT /F1 10 Tf 14 TL 50 790 Td " + " ".join(f"({_pdf_escape(line)}) '" for line in page_lines) + " ET"
+        stream = stream.encode('latin-1', 'replace')
+        page_ids.append(len(objects) + 1)
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Resources << /Font << /F1 3 0 R >> >> "
+                       f"/Contents {len(objects) + 2} 0 R >>".encode())
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(page_ids)} >>".encode()
+
+    data, offsets = bytearray(b"%PDF-1.4\n"), []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(data)
+    data += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    data += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    data += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _write_document(path: str, file_format: str, rng: random.Random, num_words: int,
+                    facts: List[Dict[str, str]]):
+    if file_format == 'csv':
+        # One row per fact, padded with filler rows to about num_words words
+        rows = [[fact['product'], fact['metric'], fact['quarter'], fact['value'], _filler_sentence(rng)]
+                for fact in facts]
+        while sum(len(" ".join(row).split()) for row in rows) < num_words:
+            filler = _fact(rng)
+            rows.append([filler['product'], 'note', filler['quarter'], '', _filler_sentence(rng)])
+        rng.shuffle(rows)
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['product', 'metric', 'quarter', 'value', 'comment'])
+            writer.writerows(rows)
+        return
+
+    paragraphs = _paragraphs(rng, num_words, facts)
+    title = os.path.splitext(os.path.basename(path))[0].replace('_', ' ').title()
+    if file_format == 'txt':
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(title + "\n\n" + "\n\n".join(paragraphs) + "\n")
+    elif file_format == 'md':
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f"# {title}\n\n" + "\n\n".join(f"## Section {i + 1}\n\n{p}" for i, p in enumerate(paragraphs)) + "\n")
+    elif file_format == 'docx':
+        document = load_module('docx').Document()
+        document.add_heading(title, level=1)
+        for paragraph in paragraphs:
+            document.add_paragraph(paragraph)
+        document.save(path)
+    elif file_format == 'pptx':
+        presentation = load_module('pptx').Presentation()
+        for i, paragraph in enumerate(paragraphs):
+            slide = presentation.slides.add_slide(presentation.slide_layouts[1])
+            slide.shapes.title.text = f"{title} ({i + 1})"
+            slide.placeholders[1].text = paragraph
+        presentation.save(path)
+    elif file_format == 'pdf':
+        _write_pdf(path, [title] + paragraphs)
+    else:
+        raise ValueError(f"Unknown corpus format '{file_format}'. Expected one of {CORPUS_FORMATS}.")
+
+
+def generate_corpus(output_dir: str, num_documents: int = 20, formats: Sequence[str] = CORPUS_FORMATS,
+                    words_per_document: int = 2000, facts_per_document: int = 5, seed: int = 0) -> Dict[str, Any]:
+    """
+    Writes `num_documents` synthetic documents to `output_dir`, cycling through
+    `formats`. Each is about `words_per_document` words of filler text with
+    `facts_per_document` fact sentences ("The Atlas team reported churn rate of
+    12% in Q3.") mixed in. The same seed always produces the same corpus.
+
+    Returns {"files": [...], "queries": [...], "bytes": ...}; each query asks
+    for one of the facts and names the document that holds it.
+    """
+    for file_format in formats:
+        if file_format not in CORPUS_FORMATS:
+            raise ValueError(f"Unknown corpus format '{file_format}'. Expected one of {CORPUS_FORMATS}.")
+    os.makedirs(output_dir, exist_ok=True)
+    rng = random.Random(seed)
+    files, queries, total_bytes = [], [], 0
+    for i in range(num_documents):
+        file_format = formats[i % len(formats)]
+        path = os.path.join(output_dir, f"synthetic_{i:04d}.{file_format}")
+        facts = [_fact(rng) for _ in range(facts_per_document)]
+        _write_document(path, file_format, rng, words_per_document, facts)
+        files.append(path)
+        total_bytes += os.path.getsize(path)
+        for fact in facts:
+            queries.append({"query": f"What {fact['metric']} did the {fact['product']} team report in {fact['quarter']}?",
+                            "expected_answer": fact['value'], "source": os.path.basename(path)})
+    rng.shuffle(queries)
+    return {"files": files, "queries": queries, "bytes": total_bytes}
+
+
+# Example usage (for testing)
+if __name__ == "__main__":
+    corpus = generate_corpus("synthetic_corpus", num_documents=6, words_per_document=500)
+    print(f"Wrote {len(corpus['files'])} files ({corpus['bytes']} bytes), {len(corpus['queries'])} queries.")
+    print(corpus['queries'][0])
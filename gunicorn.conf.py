@@ -0,0 +1,28 @@
+# gunicorn.conf.py
+#
+# Serves app.py with several worker processes sharing one set of models and one index:
+#   gunicorn -c gunicorn.conf.py app:app
+#
+# The models are loaded once in the master before it forks (preload_app), so
+# workers share their weights copy-on-write instead of each loading a copy.
+# Each worker then builds its own agents in post_fork; they memory-map the
+# same FAISS snapshot and follow each other's writes through the write-ahead log.
+
+import os
+
+os.environ.setdefault('RAG_SHARED_INDEX', '1')
+os.environ.setdefault('RAG_PRELOAD_MODELS', '1')
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', '4'))
+# Requests also run on the agents' own thread pools; a few threads per worker keep them fed
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+# Uploads are accepted immediately and ingested in the background, but chat generation can be slow
+timeout = 300
+preload_app = True
+
+
+def post_fork(server, worker):
+    """Creates the worker's agents (the message bus and thread pools must start after fork)."""
+    import app
+    app.init_worker()
@@ -0,0 +1,181 @@
+# mcp/message_bus.py
+
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, Optional
+
+from mcp.message_protocol import MCPMessage
+
+logger = logging.getLogger(__name__)
+
+
+def response_type(request_type: str) -> str:
+    """GENERATE_RESPONSE_REQUEST -> GENERATE_RESPONSE_RESPONSE; other types get a _RESPONSE suffix."""
+    if request_type.endswith("_REQUEST"):
+        return request_type[:-len("_REQUEST")] + "_RESPONSE"
+    return request_type + "_RESPONSE"
+
+
+class MessageBus:
+    """
+    In-process asynchronous MCP message bus.
+
+    The bus runs an asyncio event loop on its own thread. Each registered
+    receiver (an agent) gets a bounded asyncio.Queue and `concurrency` worker
+    tasks; a worker takes a message off the queue and runs the receiver's
+    handler on that receiver's own thread pool, so a slow agent (e.g. the LLM)
+    never holds up another (e.g. retrieval). A full queue makes senders wait,
+    which gives natural backpressure.
+
+    request() is a blocking call usable from any thread: it routes a message by
+    `receiver`, waits for the handler's result and returns it as a response
+    MCPMessage carrying the same trace_id. Payloads are passed by reference;
+    nothing is serialized in-process, so they may hold generators and callbacks.
+
+    Every message is logged as one JSON line with a payload summary (sizes, not
+    contents). Only `log_sample_rate` of messages are logged, except errors and
+    messages slower than `slow_message_ms`, which always are.
+
+    With a `tracer` (see agents.telemetry.Tracer), each message's queue wait and
+    handler run are recorded as spans of its trace_id, and the handler runs with
+    that trace active, so spans the agent records join the same trace.
+    """
+    def __init__(self, max_queue_size: int = 100, log_sample_rate: float = 0.1, slow_message_ms: float = 1000.0,
+                 tracer=None):
+        self.max_queue_size = max_queue_size
+        self.log_sample_rate = log_sample_rate
+        self.slow_message_ms = slow_message_ms
+        self.tracer = tracer
+        self._receivers: Dict[str, Dict[str, Any]] = {}
+        self._pending: Dict[str, asyncio.Future] = {} # trace_id -> future of the in-flight request
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name='MCPMessageBus', daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def _log(self, event: str, message: MCPMessage, force: bool = False, **fields):
+        if not force and random.random() >= self.log_sample_rate:
+            return
+        record = {"event": event, "type": message.type, "sender": message.sender, "receiver": message.receiver,
+                  "trace_id": message.trace_id, "payload": message.summary(), **fields}
+        logger.info(json.dumps(record, default=str))
+
+    # --- Registration ---
+
+    def register(self, receiver: str, handler: Callable[[MCPMessage], Dict[str, Any]],
+                 concurrency: int = 1, max_queue_size: Optional[int] = None):
+        """
+        Routes messages addressed to `receiver` to `handler`, which takes the
+        request message and returns the response payload (or raises).
+        """
+        asyncio.run_coroutine_threadsafe(
+            self._register(receiver, handler, concurrency, max_queue_size or self.max_queue_size), self._loop
+        ).result()
+
+    async def _register(self, receiver: str, handler, concurrency: int, max_queue_size: int):
+        if receiver in self._receivers:
+            raise ValueError(f"Receiver '{receiver}' is already registered.")
+        self._receivers[receiver] = {
+            "handler": handler,
+            "queue": asyncio.Queue(maxsize=max_queue_size),
+            "executor": ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f'MCP-{receiver}'),
+            "processed": 0,
+            "errors": 0
+        }
+        self._receivers[receiver]["workers"] = [
+            asyncio.ensure_future(self._worker(receiver)) for _ in range(concurrency)
+        ]
+
+    # --- Delivery ---
+
+    async def _worker(self, receiver: str):
+        entry = self._receivers[receiver]
+        while True:
+            message, enqueued_at = await entry["queue"].get()
+            started_at = time.perf_counter()
+            queue_ms = (started_at - enqueued_at) * 1000
+            if self.tracer:
+                self.tracer.record_span(f"queue:{receiver}", queue_ms / 1000, message.trace_id)
+            try:
+                payload = await self._loop.run_in_executor(entry["executor"], self._handle, entry["handler"], message)
+            except Exception as e:
+                entry["errors"] += 1
+                self._log("error", message, force=True, error=repr(e), queue_ms=round(queue_ms, 2))
+                self._resolve(message.trace_id, error=e)
+            else:
+                entry["processed"] += 1
+                response = MCPMessage(sender=receiver, receiver=message.sender, type=response_type(message.type),
+                                      payload=payload, trace_id=message.trace_id)
+                handler_ms = (time.perf_counter() - started_at) * 1000
+                self._log("handled", response, force=handler_ms >= self.slow_message_ms,
+                          queue_ms=round(queue_ms, 2), handler_ms=round(handler_ms, 2))
+                self._resolve(message.trace_id, response=response)
+            finally:
+                entry["queue"].task_done()
+
+    def _handle(self, handler: Callable[[MCPMessage], Dict[str, Any]], message: MCPMessage) -> Dict[str, Any]:
+        """Runs a handler on the receiver's thread pool, as a span of the message's trace."""
+        if not self.tracer:
+            return handler(message)
+        with self.tracer.activate(message.trace_id), self.tracer.span(f"{message.receiver}:{message.type}"):
+            return handler(message)
+
+    def _resolve(self, trace_id: str, response: Optional[MCPMessage] = None, error: Optional[Exception] = None):
+        """Completes the request waiting on `trace_id` (it may have timed out and gone already)."""
+        future = self._pending.get(trace_id)
+        if future is None or future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(response)
+
+    async def _request(self, message: MCPMessage) -> MCPMessage:
+        entry = self._receivers.get(message.receiver)
+        if entry is None:
+            raise ValueError(f"No agent registered for receiver '{message.receiver}'.")
+        if message.trace_id in self._pending:
+            raise ValueError(f"A request with trace_id {message.trace_id} is already in flight.")
+        future = self._loop.create_future()
+        self._pending[message.trace_id] = future
+        try:
+            self._log("sent", message, queue_depth=entry["queue"].qsize())
+            await entry["queue"].put((message, time.perf_counter()))
+            return await future
+        finally:
+            self._pending.pop(message.trace_id, None)
+
+    def request(self, message: MCPMessage, timeout: Optional[float] = None) -> MCPMessage:
+        """
+        Sends a request and blocks until its receiver responds. Re-raises the
+        handler's exception, or TimeoutError after `timeout` seconds. Requests
+        sharing a trace_id must be sent one after another.
+        """
+        future = asyncio.run_coroutine_threadsafe(self._request(message), self._loop)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Returns queue depth and processed/error counts per receiver."""
+        return {
+            receiver: {"queue_depth": entry["queue"].qsize(), "processed": entry["processed"], "errors": entry["errors"]}
+            for receiver, entry in list(self._receivers.items())
+        }
+
+    def shutdown(self):
+        """Stops the event loop and the receivers' thread pools."""
+        for entry in list(self._receivers.values()):
+            entry["executor"].shutdown(wait=False)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
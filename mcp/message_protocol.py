@@ -4,6 +4,19 @@ import json
 from typing import Dict, Any, Optional
 import uuid
 
+def summarize_value(value: Any) -> Any:
+    """Describes a payload value compactly: short strings and numbers as-is, containers by size."""
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, str):
+        return value if len(value) <= 80 else f"<str len={len(value)}>"
+    if isinstance(value, (list, tuple)):
+        return f"<{type(value).__name__} len={len(value)}>"
+    if isinstance(value, dict):
+        return f"<dict keys={sorted(value)[:10]}>"
+    return f"<{type(value).__name__}>"
+
+
 class MCPMessage:
     """
     Represents a Model Context Protocol (MCP) message for inter-agent communication.
@@ -25,6 +38,10 @@ class MCPMessage:
             "payload": self.payload
         }
 
+    def summary(self) -> Dict[str, Any]:
+        """Returns the payload with large values (chunk lists, long texts) replaced by their size."""
+        return {key: summarize_value(value) for key, value in self.payload.items()}
+
     def to_json(self) -> str:
         """Converts the MCP message to a JSON string."""
         return json.dumps(self.to_dict(), indent=2)
@@ -47,7 +64,7 @@ class MCPMessage:
         return cls.from_dict(data)
 
     def __repr__(self):
-        return f"MCPMessage(sender={self.sender}, receiver={self.receiver}, type={self.type}, trace_id={self.trace_id}, payload={self.payload})"
+        return f"MCPMessage(sender={self.sender}, receiver={self.receiver}, type={self.type}, trace_id={self.trace_id}, payload={self.summary()})"
 
 # Example usage (for testing/demonstration)
 if __name__ == "__main__":
@@ -14,6 +14,7 @@ document.addEventListener('DOMContentLoaded', () => {
     // Define a timeout for fetch requests (e.g., 5 minutes for uploads, 2 minutes for chat)
     const UPLOAD_TIMEOUT_MS = 300 * 1000; // 5 minutes
     const CHAT_TIMEOUT_MS = 120 * 1000;   // 2 minutes
+    const JOB_POLL_INTERVAL_MS = 1000;    // How often to poll ingestion job progress
 
     // Function to show a temporary message box
     function showMessageBox(message, type = 'info') {
@@ -52,16 +53,52 @@ document.addEventListener('DOMContentLoaded', () => {
         bubbleDiv.innerHTML = message.replace(/\n/g, '<br>');
 
         messageDiv.appendChild(bubbleDiv);
+        appendSources(bubbleDiv, sources);
 
+        chatMessages.appendChild(messageDiv);
+        chatMessages.scrollTop = chatMessages.scrollHeight; // Scroll to bottom
+        return bubbleDiv;
+    }
+
+    // Function to list the source documents below a bot answer
+    function appendSources(bubbleDiv, sources = []) {
         if (sources.length > 0) {
             const sourcesDiv = document.createElement('div');
             sourcesDiv.classList.add('source-context', 'mt-2', 'text-xs', 'text-gray-500', 'pl-2', 'border-l-2', 'border-indigo-200');
             sourcesDiv.textContent = 'Sources: ' + sources.join(', ');
             bubbleDiv.appendChild(sourcesDiv); // Append sources inside the bubble
         }
+    }
 
-        chatMessages.appendChild(messageDiv);
-        chatMessages.scrollTop = chatMessages.scrollHeight; // Scroll to bottom
+    // Reads Server-Sent Events from a fetch response, calling onEvent(name, data) per event
+    async function readEventStream(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) {
+                break;
+            }
+            buffer += decoder.decode(value, { stream: true });
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const frame = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                let eventName = 'message';
+                let data = '';
+                for (const line of frame.split('\n')) {
+                    if (line.startsWith('event: ')) {
+                        eventName = line.slice(7);
+                    } else if (line.startsWith('data: ')) {
+                        data += line.slice(6);
+                    }
+                }
+                if (data) {
+                    onEvent(eventName, JSON.parse(data));
+                }
+            }
+        }
     }
 
     // Function to show/hide loading modal
@@ -86,7 +123,7 @@ document.addEventListener('DOMContentLoaded', () => {
             const timeoutId = setTimeout(() => controller.abort(), CHAT_TIMEOUT_MS);
 
             try {
-                const response = await fetch('/chat', {
+                const response = await fetch('/chat/stream', {
                     method: 'POST',
                     headers: {
                         'Content-Type': 'application/json',
@@ -94,16 +131,33 @@ document.addEventListener('DOMContentLoaded', () => {
                     body: JSON.stringify({ query: query }),
                     signal: controller.signal // Attach the signal
                 });
-                clearTimeout(timeoutId); // Clear timeout if request completes
 
-                const data = await response.json();
-
-                if (response.ok) {
-                    addMessage('bot', data.answer, data.source_context);
-                } else {
+                if (!response.ok) {
+                    clearTimeout(timeoutId);
+                    const data = await response.json();
                     addMessage('bot', `Error: ${data.message || 'Something went wrong.'}`);
                     showMessageBox(`Chat error: ${data.message || 'Something went wrong.'}`, 'error');
+                    return;
                 }
+
+                // Render tokens as they arrive instead of waiting for the whole answer
+                toggleLoading(false);
+                const bubbleDiv = addMessage('bot', '');
+                let answer = '';
+                await readEventStream(response, (eventName, data) => {
+                    if (eventName === 'token') {
+                        answer += data.text;
+                        bubbleDiv.innerHTML = answer.replace(/\n/g, '<br>');
+                    } else if (eventName === 'done') {
+                        bubbleDiv.innerHTML = data.answer.replace(/\n/g, '<br>');
+                        appendSources(bubbleDiv, data.source_context);
+                    } else if (eventName === 'error') {
+                        bubbleDiv.innerHTML = `Error: ${data.message}`;
+                        showMessageBox(`Chat error: ${data.message}`, 'error');
+                    }
+                    chatMessages.scrollTop = chatMessages.scrollHeight;
+                });
+                clearTimeout(timeoutId); // Clear timeout once the stream completes
             } catch (error) {
                 console.error('Error:', error);
                 if (error.name === 'AbortError') {
@@ -126,6 +180,44 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
+    // Polls an ingestion job until it finishes, showing its stage and progress
+    async function pollIngestionJob(jobId) {
+        while (true) {
+            await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+            let job;
+            try {
+                const response = await fetch(`/jobs/${jobId}`);
+                job = await response.json();
+                if (!response.ok) {
+                    uploadStatus.innerHTML = `<span class="text-red-600">${job.message}</span>`;
+                    return;
+                }
+            } catch (error) {
+                console.error('Error polling ingestion job:', error);
+                continue; // Transient network error; keep polling
+            }
+
+            if (job.status === 'succeeded') {
+                uploadStatus.innerHTML = `<span class="text-green-600">${job.message}</span>`;
+                showMessageBox(job.message, 'success');
+                return;
+            }
+            if (job.status === 'failed') {
+                uploadStatus.innerHTML = `<span class="text-red-600">${job.message}</span>`;
+                showMessageBox(job.message, 'error');
+                return;
+            }
+
+            let progress = `${job.file_name}: ${job.stage}`;
+            if (job.files_total) {
+                progress += ` (${job.files_parsed}/${job.files_total} files parsed, ${job.chunks_indexed} chunks indexed)`;
+            } else if (job.chunks_total) {
+                progress += ` (${job.chunks_indexed}/${job.chunks_total} chunks, ${job.chunks_per_second || 0} chunks/s)`;
+            }
+            uploadStatus.innerHTML = `<span class="text-yellow-600">${progress}...</span>`;
+        }
+    }
+
     // Event listener for document upload
     documentUpload.addEventListener('change', async (event) => {
         const files = event.target.files;
@@ -138,8 +230,10 @@ document.addEventListener('DOMContentLoaded', () => {
         toggleLoading(true);
 
         const formData = new FormData();
+        let bulk = files.length > 1;
         for (let i = 0; i < files.length; i++) {
             formData.append('file', files[i]); // Append each file
+            bulk = bulk || /\.(zip|tar|tar\.gz|tgz)$/i.test(files[i].name);
         }
 
         // Use AbortController for fetch timeout
@@ -147,7 +241,8 @@ document.addEventListener('DOMContentLoaded', () => {
         const timeoutId = setTimeout(() => controller.abort(), UPLOAD_TIMEOUT_MS);
 
         try {
-            const response = await fetch('/upload', {
+            // Several files or an archive are ingested together as one bulk job
+            const response = await fetch(bulk ? '/upload_bulk' : '/upload', {
                 method: 'POST',
                 body: formData,
                 signal: controller.signal // Attach the signal
@@ -156,7 +251,12 @@ document.addEventListener('DOMContentLoaded', () => {
 
             const data = await response.json();
 
-            if (response.ok) {
+            if (response.ok && data.job_id) {
+                // Processing continues in the background; chat stays usable meanwhile
+                uploadStatus.innerHTML = `<span class="text-yellow-600">${data.message}</span>`;
+                toggleLoading(false);
+                pollIngestionJob(data.job_id);
+            } else if (response.ok) {
                 uploadStatus.innerHTML = `<span class="text-green-600">${data.message}</span>`;
                 showMessageBox(data.message, 'success');
             } else {
@@ -0,0 +1,21 @@
+# tests/test_decoding_settings.py
+
+import pytest
+
+from agents.generation_backends import DEFAULT_DECODING, MAX_NEW_TOKENS_LIMIT, decoding_kwargs
+
+
+@pytest.mark.parametrize("decoding", [
+    {"max_new_tokens": "abc"}, {"max_new_tokens": -5}, {"max_new_tokens": MAX_NEW_TOKENS_LIMIT + 1},
+    {"max_new_tokens": True}, {"num_beams": 0}, {"num_beams": 2.5}, {"do_sample": "yes"},
+    {"temperature": [1]}, {"temperature": 0}, {"top_p": 0}, {"top_p": 1.5}, {"early_stopping": 1},
+])
+def test_unusable_values_are_rejected(decoding):
+    with pytest.raises(ValueError):
+        decoding_kwargs(DEFAULT_DECODING, decoding)
+
+
+def test_usable_values_are_merged():
+    kwargs = decoding_kwargs(DEFAULT_DECODING, {"max_new_tokens": 64, "do_sample": True, "temperature": 0.7,
+                                                "top_p": 1})
+    assert kwargs["max_new_tokens"] == 64 and kwargs["temperature"] == 0.7 and kwargs["use_cache"]
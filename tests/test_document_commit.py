@@ -0,0 +1,47 @@
+# tests/test_document_commit.py
+
+import zlib
+
+import numpy as np
+
+from agents.retrieval_agent import RetrievalAgent
+
+
+class _HashModel:
+    """Deterministic stand-in for the embedding model."""
+    def encode(self, texts, convert_to_numpy=True):
+        return np.stack([np.random.default_rng(zlib.crc32(text.encode())).standard_normal(8) for text in texts]
+                        ).astype('float32')
+
+
+def _agent(index_dir):
+    agent = RetrievalAgent(index_dir=str(index_dir), cache_dir=None, query_batch_window_ms=0, dedup_threshold=None)
+    agent._model = _HashModel()
+    return agent
+
+
+def _chunks(source, doc_hash, count):
+    return [{"content": f"{source} {doc_hash} chunk {i}", "source": source, "doc_hash": doc_hash} for i in range(count)]
+
+
+def test_only_committed_complete_uploads_have_a_content_hash(tmp_path):
+    agent = _agent(tmp_path)
+    agent.index_documents(_chunks("a.txt", "v1", 4))
+    assert agent.documents.get("a.txt")["content_hash"] is None # Indexed, but not committed yet
+    agent.commit_document("a.txt", "v1")
+    # A replacement and a first upload that stop before their commit (e.g. a crash)
+    agent.index_documents(_chunks("a.txt", "v2", 2))
+    agent.index_documents(_chunks("b.txt", "v1", 2))
+
+    restarted = _agent(tmp_path)
+    a, b = restarted.documents.get("a.txt"), restarted.documents.get("b.txt")
+    assert len(a["rows"]) == 6 and a["content_hash"] is None # Old and partial new rows: re-ingest, don't skip
+    assert len(b["rows"]) == 2 and b["content_hash"] is None
+
+    restarted.delete_rows(a["rows"][:4])
+    restarted.commit_document("a.txt", "v2")
+    restarted.commit_document("b.txt", "v1")
+    restarted._checkpoint() # Commits survive folding the WAL into a snapshot
+    reloaded = _agent(tmp_path)
+    assert reloaded.documents.get("a.txt")["content_hash"] == "v2"
+    assert reloaded.documents.get("b.txt")["content_hash"] == "v1"
@@ -0,0 +1,27 @@
+# tests/test_embedding_cache.py
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from agents.embedding_cache import EmbeddingCache
+
+
+def test_entry_count_tracks_inserts_replacements_and_evictions(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), 'model', max_entries=50)
+    for i in range(10):
+        texts = [f"chunk {i}-{j}" for j in range(10)] + ["repeated chunk"]
+        cache.put_many(texts, np.ones((len(texts), 4), dtype='float32'))
+        assert cache.stats()["entries"] == cache._count() == min(50, 10 * (i + 1) + 1)
+    # The most recently stored entries survive eviction
+    assert all(vector is not None for vector in cache.get_many([f"chunk 9-{j}" for j in range(10)]))
+    assert EmbeddingCache(str(tmp_path), 'model', max_entries=50).stats()["entries"] == 50
+
+
+def test_hit_and_miss_counts_are_exact_under_concurrency(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), 'model')
+    cache.put_many(["cached"], np.ones((1, 4), dtype='float32'))
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda _: cache.get_many(["cached", "missing"]), range(400)))
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (400, 400, 0.5)
@@ -0,0 +1,38 @@
+# tests/test_filtered_retrieval.py
+
+import numpy as np
+
+from agents.metadata_index import normalize_filters
+from agents.retrieval_agent import RetrievalAgent
+
+
+def _chunks(source, count):
+    return [{"content": f"{source} chunk {i}", "source": source} for i in range(count)]
+
+
+def _agent():
+    # Vectors are added directly, so no embedding model is loaded
+    return RetrievalAgent(index_dir=None, cache_dir=None, query_batch_window_ms=0, dedup_threshold=None)
+
+
+def test_filter_selection_excludes_rows_added_after_it():
+    rng = np.random.default_rng(0)
+    agent = _agent()
+    agent._add_embeddings(rng.standard_normal((10, 8)).astype('float32'), _chunks("a.txt", 5) + _chunks("b.txt", 5))
+    with agent._index_lock:
+        selection = agent._filter_selection(normalize_filters({"source": "a.txt"}))
+
+    agent._add_embeddings(rng.standard_normal((30, 8)).astype('float32'), _chunks("b.txt", 30))
+    selector = selection["selector"]
+    assert [row for row in range(40) if selector.is_member(row)] == [0, 1, 2, 3, 4]
+
+    _, ids = agent._dense_search(rng.standard_normal((3, 8)).astype('float32'), 40, selection)
+    assert set(ids[ids >= 0].tolist()) <= {0, 1, 2, 3, 4}
+
+
+def test_filters_match_only_their_rows():
+    agent = _agent()
+    agent._add_embeddings(np.eye(8, dtype='float32')[:6], _chunks("a.pdf", 3) + _chunks("b.txt", 3))
+    with agent._index_lock:
+        assert agent._filter_selection(normalize_filters({"file_type": "PDF"}))["search_ids"].tolist() == [0, 1, 2]
+        assert agent._filter_selection(normalize_filters({"source": "missing.txt"}))["rows"] == 0
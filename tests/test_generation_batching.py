@@ -0,0 +1,47 @@
+# tests/test_generation_batching.py
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from agents.llm_response_agent import LLMResponseAgent
+from agents.micro_batcher import MicroBatcher
+
+
+class _Tokenizer:
+    def __call__(self, prompts, **kwargs):
+        return {"prompts": prompts}
+
+    def batch_decode(self, outputs, skip_special_tokens=True):
+        return outputs
+
+
+class _Model:
+    def generate(self, prompts, max_new_tokens=200, **kwargs):
+        if not isinstance(max_new_tokens, int) or max_new_tokens < 0:
+            raise ValueError(f"bad max_new_tokens {max_new_tokens!r}")
+        return [f"answer to {prompt}" for prompt in prompts]
+
+
+class _Generator:
+    tokenizer = _Tokenizer()
+    model = _Model()
+
+
+def test_bad_settings_fail_only_their_own_requests():
+    agent = LLMResponseAgent(generation_batch_window_ms=0)
+    agent._text_generator = _Generator()
+    answers = agent._generate_batch([("a", {"max_new_tokens": 8}), ("b", {"max_new_tokens": -5}),
+                                     ("c", {"temperature": [1]}), ("d", {"max_new_tokens": 8})])
+    assert answers[0] == "answer to a" and answers[3] == "answer to d"
+    assert isinstance(answers[1], ValueError) and isinstance(answers[2], TypeError)
+
+
+def test_micro_batcher_raises_item_exceptions_to_their_callers_only():
+    batcher = MicroBatcher(lambda items: [ValueError(item) if item < 0 else item * 2 for item in items],
+                           max_batch_size=8, max_wait_ms=50)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        futures = [pool.submit(batcher.submit, item) for item in (1, -1, 2, 3)]
+    assert [futures[i].result() for i in (0, 2, 3)] == [2, 4, 6]
+    with pytest.raises(ValueError):
+        futures[1].result()
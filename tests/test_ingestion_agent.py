@@ -0,0 +1,22 @@
+# tests/test_ingestion_agent.py
+
+import pytest
+
+from agents.ingestion_agent import IngestionAgent
+
+
+def test_parse_error_midway_is_raised_after_partial_chunks(tmp_path, monkeypatch):
+    file_path = tmp_path / "report.txt"
+    file_path.write_text("placeholder")
+
+    def failing_blocks(path, block_size=1 << 20):
+        yield "word " * 2000
+        raise OSError("disk read failed")
+
+    agent = IngestionAgent(pdf_workers=1)
+    monkeypatch.setattr(agent, "_iter_txt_blocks", failing_blocks)
+    chunks = []
+    with pytest.raises(OSError, match="disk read failed"):
+        for chunk in agent.iter_chunks(str(file_path)):
+            chunks.append(chunk)
+    assert chunks # The caller saw partial output, so it must roll back rather than keep it
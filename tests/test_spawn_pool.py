@@ -0,0 +1,47 @@
+# tests/test_spawn_pool.py
+
+import os
+import subprocess
+import sys
+import textwrap
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# A main module with app.py's import-time side effects that starts the ingestion
+# process pool; 'spawn' re-imports it (as __mp_main__) in every pool process.
+MAIN_MODULE = textwrap.dedent("""
+    import os
+    import sys
+    sys.path.insert(0, {repo_dir!r})
+    import app
+    from agents.ingestion_agent import IngestionAgent
+
+    def has_agents():
+        return app.coordinator is not None
+
+    if __name__ == '__main__':
+        pool = IngestionAgent(pdf_workers=2)._get_process_pool()
+        print(any(pool.submit(has_agents).result() for _ in range(4)))
+        pool.shutdown()
+""")
+
+
+def _run(cwd, args):
+    result = subprocess.run([sys.executable, *args], cwd=cwd, capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stderr
+    return result.stdout.strip().splitlines()[-1]
+
+
+def test_pool_processes_do_not_create_agents(tmp_path):
+    (tmp_path / "main.py").write_text(MAIN_MODULE.format(repo_dir=REPO_DIR))
+    assert _run(tmp_path, ["main.py"]) == "False"
+    # Agents would have opened (and possibly truncated) the index here
+    assert not (tmp_path / "vector_store").exists()
+
+
+def test_app_rerun_as_mp_main_does_not_create_agents(tmp_path):
+    # What a spawned process does with app.py when the server runs as `python app.py`
+    script = (f"import runpy, sys; sys.path.insert(0, {REPO_DIR!r}); "
+              f"print(runpy.run_path({os.path.join(REPO_DIR, 'app.py')!r}, run_name='__mp_main__')['coordinator'])")
+    assert _run(tmp_path, ["-c", script]) == "None"
+    assert not (tmp_path / "vector_store").exists()